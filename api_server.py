@@ -1,98 +1,158 @@
 import asyncio
-import json
 import logging
 import math
 import os
-import subprocess
-from pathlib import Path
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
-import cv2
 import zenoh
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
 
-from zenoh_app.camera_autoware import MJPEG_server
-from zenoh_app.list_autoware import list_autoware
-from zenoh_app.pose_service import PoseServer
-from zenoh_app.status_autoware import get_cpu_status, get_vehicle_status
-from zenoh_app.teleop_autoware import ManualController
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Print to stdout
-        logging.FileHandler('logs/api_server.log', mode='a')  # Also write to file
-    ]
-)
+from zenoh_app import log_pipeline, pointcloud, qos
+from zenoh_app.encoding import EncodedCache, negotiate
+from zenoh_app.map_registry import REGISTRY as map_registry
+from zenoh_app.metrics import HTTP_REQUEST_SECONDS, render
+
+# Configure logging: records are written by a background thread, see zenoh_app/log_pipeline.py
+log_pipeline.setup(logging.INFO, log_file='logs/api_server.log')
 logger = logging.getLogger(__name__)
 
 # ✓ Custom filter to suppress only frequent polling endpoints
 class SkipFrequentEndpointsFilter(logging.Filter):
-    def filter(self, record):
-        # Skip logging for frequent polling requests
-        skip_paths = ['/map/pose', '/map/goalPose']
-        return not any(path in record.getMessage() for path in skip_paths)
+    skip_paths = frozenset(['/map/pose', '/map/goalPose'])
 
-# Apply filter to uvicorn.access logger
+    def filter(self, record):
+        # uvicorn access records carry (client, method, path, http version, status) as args: test the path
+        # without formatting the message
+        args = record.args
+        if isinstance(args, tuple) and len(args) == 5:
+            return str(args[2]).partition('?')[0] not in self.skip_paths
+        return not any(path in record.getMessage() for path in self.skip_paths)
+
+# Apply filter to uvicorn.access logger, and move the uvicorn handlers off the event loop
 uvicorn_logger = logging.getLogger('uvicorn.access')
 uvicorn_logger.addFilter(SkipFrequentEndpointsFilter())
+for name in ('uvicorn', 'uvicorn.error', 'uvicorn.access'):
+    log_pipeline.detach(name)
 logging.getLogger('fastapi').setLevel(logging.WARNING)
 
 MJPEG_HOST = '0.0.0.0'
 MJPEG_PORT = 5000
 
-app = FastAPI()
-app.add_middleware(CORSMiddleware, allow_origins=['*'])
+# The teleop WebSocket stops the vehicle when the client is silent for longer than this (seconds)
+TELEOP_DEADMAN_TIMEOUT = 1.0
+TELEOP_STATUS_INTERVAL = 0.1
 
-conf = zenoh.Config.from_file('config.json5')
-session = zenoh.open(conf)
 use_bridge_ros2dds = True
-manual_controller = None
-mjpeg_server = None
-pose_service = PoseServer(session, use_bridge_ros2dds)
+# Created by the lifespan handler, so that importing this module stays cheap
+session = None
+# FleetState in single-process mode, or HubClient when FMS_STATE_HUB names the state hub of an ingest process
+fleet = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global session, fleet
+    hub_name = os.environ.get('FMS_STATE_HUB')
+    if hub_name:
+        # Stateless worker: the ingest process (python -m zenoh_app.state_hub) owns the session and the map
+        from zenoh_app.state_hub import HubClient
+
+        fleet = HubClient(hub_name)
+        logger.info(f'Serving from state hub {hub_name}')
+        yield
+        fleet.close()
+        return
 
+    from zenoh_app.fleet_state import FleetState
 
-def _get_maps_config_file():
-    """Get the path to the maps configuration file."""
-    return Path(__file__).parent / 'my_scripts' / 'maps_config.json'
+    conf = zenoh.Config.from_file('config.json5')
+    session = zenoh.open(conf)
+    video_session = qos.open_video_session()
+    fleet = FleetState(session, use_bridge_ros2dds, video_session)
 
+    # Apply the current map, then parse it without holding up the startup
+    try:
+        _, info = map_registry.current()
+        _apply_map_config(info)
+        logger.info('Map config applied on startup')
+    except Exception as e:
+        logger.error(f'failed to apply map config on startup: {e}')
+    asyncio.get_running_loop().run_in_executor(None, fleet.preload_map)
+
+    yield
 
-def _load_all_maps_config():
-    """Load all maps configuration from file."""
-    config_file = _get_maps_config_file()
-    with open(config_file, 'r') as f:
-        return json.load(f)
+    fleet.close()
+    if video_session is not None:
+        video_session.close()
+    session.close()
 
 
-def _load_current_map_config():
-    """Load current map configuration."""
-    config = _load_all_maps_config()
-    map_key = config.get('current_map', None)
-    map_info = config.get('maps', {}).get(map_key)
-    return map_key, map_info
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=['*'])
+
+
+# Encoded bodies of the polling endpoints, reused until the state they were made from changes
+encoded_cache = EncodedCache()
+
+
+# Long-poll: longest wait granted, and how often the version is checked meanwhile (s)
+LONG_POLL_MAX_WAIT = 30.0
+LONG_POLL_INTERVAL = 0.02
+
+
+async def _versioned_response(request, key, version_of, produce, since=None, wait=0):
+    """
+    produce() encoded as JSON, MessagePack or CBOR depending on the Accept header, tagged with the state version.
+    Answers 304 when If-None-Match holds the current ETag. With since and wait (ms), holds the request until the
+    version differs from since or the wait expires.
+    """
+    version = version_of()
+    if since is not None and wait > 0 and version == since:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(wait / 1000, LONG_POLL_MAX_WAIT)
+        while version == since and loop.time() < deadline:
+            await asyncio.sleep(LONG_POLL_INTERVAL)
+            version = version_of()
+
+    media_type = negotiate(request.headers.get('accept'))
+    etag = f'"{fleet.epoch}-{version}-{media_type.rsplit("/", 1)[-1]}"'
+    headers = {'ETag': etag, 'X-State-Version': str(version), 'Vary': 'Accept', 'Cache-Control': 'no-cache'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return Response(status_code=304, headers=headers)
+    body = encoded_cache.get(key, version, media_type, produce)
+    return Response(body, media_type=media_type, headers=headers)
 
 
 def _apply_map_config(map_info):
     if not map_info:
         return
-    origin_lat = map_info['origin_lat']
-    origin_lon = map_info['origin_lon']
-    map_path = Path(__file__).parent / 'frontend' / 'public' / map_info['path'].lstrip('/')
-    os.environ['REACT_APP_MAP_ORIGIN_LAT'] = str(origin_lat)
-    os.environ['REACT_APP_MAP_ORIGIN_LON'] = str(origin_lon)
-    os.environ['REACT_APP_MAP_FILE_PATH'] = map_info['path']
-    pose_service.update_map(str(map_path), origin_lat, origin_lon)
+    fleet.apply_map(map_info)
+    # Start building the point cloud tiles of the map in the background
+    try:
+        _current_pointcloud()
+    except (FileNotFoundError, pointcloud.PointCloudNotReady, ValueError):
+        pass
+
+
+@app.middleware('http')
+async def record_http_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template rather than raw path to keep the series count bounded
+    route = request.scope.get('route')
+    HTTP_REQUEST_SECONDS.labels(request.method, route.path if route is not None else 'unmatched').observe(time.perf_counter() - start)
+    return response
 
 
-# initialize map config on startup
-# try:
-#     _, info = _load_current_map_config()
-#     _apply_map_config(info)
-#     logger.info("Map config applied on startup")
-# except Exception as e:
-#     logger.error(f"failed to apply map config on startup: {e}")
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(render(), media_type='text/plain; version=0.0.4')
 
 
 @app.get('/')
@@ -100,29 +160,41 @@ async def root():
     return {'message': 'Hello World'}
 
 
+@app.get('/health')
+async def health():
+    return {'status': 'ok', 'map_ready': fleet is not None and fleet.map_ready}
+
+
 @app.get('/list')
 async def manage_list_autoware():
-    return list_autoware(session, use_bridge_ros2dds)
+    return fleet.list_autoware()
 
 
 @app.get('/status/{scope}')
-async def manage_status_autoware(scope):
-    return {'cpu': get_cpu_status(session, scope, use_bridge_ros2dds), 'vehicle': get_vehicle_status(session, scope, use_bridge_ros2dds)}
+async def manage_status_autoware(scope, request: Request, since: Optional[int] = None, wait: int = 0):
+    """Status of a vehicle; see _versioned_response for ETag and long-poll (?since=<version>&wait=<ms>)"""
+    return await _versioned_response(request, ('status', scope), lambda: fleet.version('status', scope), lambda: fleet.status(scope), since, wait)
+
+
+@app.get('/status/{scope}/history')
+async def manage_status_history(scope, res: str = '1s', since: Optional[float] = None):
+    """Velocity, steering and CPU history of a vehicle; res is one of raw, 1s, 10s, 1m and since a UNIX time"""
+    try:
+        return fleet.status_history(scope, res, since)
+    except (ValueError, RuntimeError) as e:
+        return {'error': str(e)}
 
 
 @app.websocket('/video')
 async def handle_ws(websocket: WebSocket):
     await websocket.accept()
-    global mjpeg_server
 
     try:
         while True:
-            if mjpeg_server is None or mjpeg_server.camera_image is None:
+            frame_bytes = fleet.jpeg_frame()
+            if frame_bytes is None:
                 await asyncio.sleep(2)
             else:
-                # Encode the frame as JPEG
-                _, buffer = cv2.imencode('.jpg', mjpeg_server.camera_image)
-                frame_bytes = buffer.tobytes()
                 await websocket.send_bytes(frame_bytes)
                 await asyncio.sleep(0.1)
     except WebSocketDisconnect:
@@ -131,15 +203,7 @@ async def handle_ws(websocket: WebSocket):
 
 @app.get('/teleop/startup')
 async def manage_teleop_startup(scope):
-    global manual_controller, mjpeg_server, mjpeg_server_thread
-    if manual_controller is not None:
-        manual_controller.stop_teleop()
-    manual_controller = ManualController(session, scope, use_bridge_ros2dds)
-
-    if mjpeg_server is not None:
-        mjpeg_server.change_vehicle(scope)
-    else:
-        mjpeg_server = MJPEG_server(session, scope, use_bridge_ros2dds)
+    fleet.teleop_startup(scope)
     return {
         'text': f'Startup manual control on {scope}.',
         'mjpeg_host': 'localhost' if MJPEG_HOST == '0.0.0.0' else MJPEG_HOST,
@@ -147,102 +211,192 @@ async def manage_teleop_startup(scope):
     }
 
 
+@app.get('/teleop/stop')
+async def manage_teleop_stop(scope):
+    return fleet.teleop_stop(scope)
+
+
 @app.get('/teleop/gear')
 async def manage_teleop_gear(scope, gear):
-    global manual_controller
-    if manual_controller is not None:
-        manual_controller.pub_gear(gear)
-        return f'Set gear {gear} to {scope}.'
-    else:
-        return 'Please startup the teleop first'
+    return fleet.teleop_gear(scope, gear)
 
 
 @app.get('/teleop/velocity')
 async def manage_teleop_speed(scope, velocity):
-    global manual_controller
-    if manual_controller is not None:
-        manual_controller.update_control_command(float(velocity) * 1000 / 3600, None)
-        return f'Set speed {velocity} to {scope}.'
-    else:
-        return 'Please startup the teleop first'
+    return fleet.teleop_velocity(scope, velocity)
 
 
 @app.get('/teleop/turn')
 async def manage_teleop_turn(scope, angle):
-    global manual_controller
-    if manual_controller is not None:
-        manual_controller.update_control_command(None, float(angle) * math.pi / 180)
-        return f'Set steering angle {angle}.'
-    else:
-        return 'Please startup the teleop first'
+    return fleet.teleop_turn(scope, angle)
 
 
 @app.get('/teleop/status')
-async def manage_teleop_status():
-    global manual_controller
-    if manual_controller is not None:
-        return {
-            'velocity': round(manual_controller.current_velocity * 3600 / 1000, 2),
-            'gear': manual_controller.current_gear,
-            'steering': manual_controller.current_steer * 180 / math.pi,
-        }
-    else:
-        return {'velocity': '---', 'gear': '---', 'steering': '---'}
+async def manage_teleop_status(request: Request, scope: Optional[str] = None, since: Optional[int] = None, wait: int = 0):
+    return await _versioned_response(request, ('teleop', scope), lambda: fleet.version('teleop'), lambda: fleet.teleop_status(scope), since, wait)
+
+
+@app.websocket('/teleop/ws')
+async def handle_teleop_ws(websocket: WebSocket, scope: str):
+    """
+    Bidirectional teleop channel.
+    The client sends JSON inputs {"steering": deg, "velocity": km/h, "gear": name}, all optional; an empty
+    object works as a heartbeat. The latest inputs become the controller targets for the next scheduler tick,
+    and the status is streamed back every TELEOP_STATUS_INTERVAL.
+    """
+    await websocket.accept()
+    token = fleet.teleop_attach(scope, TELEOP_DEADMAN_TIMEOUT)
+    if token is None:
+        await websocket.send_json({'error': 'Please startup the teleop first'})
+        await websocket.close()
+        return
+
+    async def send_status():
+        while True:
+            await websocket.send_json(fleet.teleop_status(scope))
+            await asyncio.sleep(TELEOP_STATUS_INTERVAL)
+
+    status_task = asyncio.create_task(send_status())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            error = fleet.teleop_input(scope, message)
+            if error is not None:
+                await websocket.send_json({'error': error})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f'Teleop WebSocket error on {scope}: {e}')
+    finally:
+        status_task.cancel()
+        try:
+            await status_task
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
+        except Exception as e:
+            logger.warning(f'Teleop status stream of {scope} failed: {e}')
+        fleet.teleop_detach(scope, token)
+
+
+@app.get('/teleop/scheduler')
+async def manage_teleop_scheduler():
+    return fleet.scheduler_stats()
+
+
+@app.get('/monitor/alerts')
+async def get_fleet_alerts():
+    """Proximity and geofence alerts in progress, and the recently raised or cleared ones"""
+    return fleet.alerts()
 
 
 @app.get('/map/list')
 async def get_vehilcle_list():
-    global pose_service
-    pose_service.findVehicles()
-    return list(pose_service.vehicles.keys())
+    return fleet.find_vehicles()
 
 
 @app.get('/map/pose')
-async def get_vehicle_pose():
-    global pose_service
-    if pose_service is not None:
-        return pose_service.returnPose()
-    else:
-        return []
+async def get_vehicle_pose(request: Request, since: Optional[int] = None, wait: int = 0):
+    """Poses of every vehicle; see _versioned_response for ETag and long-poll (?since=<version>&wait=<ms>)"""
+    return await _versioned_response(request, 'pose', lambda: fleet.version('pose'), fleet.pose, since, wait)
 
 
 @app.get('/map/goalPose')
-async def get_vehicle_goalpose():
-    global pose_service
-    if pose_service is not None:
-        return pose_service.returnGoalPose()
-    else:
-        return []
+async def get_vehicle_goalpose(request: Request, since: Optional[int] = None, wait: int = 0):
+    return await _versioned_response(request, 'goal', lambda: fleet.version('goal'), fleet.goal_pose, since, wait)
 
 
 @app.get('/map/setGoal')
-async def set_goal_pose(scope: str, lat: float, lon: float):
-    global pose_service
-    if pose_service is not None:
-        logger.info(f'Set Goal Pose of {scope} as (lat={lat}, lon={lon})')
-        pose_service.setGoal(scope, lat, lon)
-        return 'success'
-    else:
-        return 'fail'
+async def set_goal_pose(scope: str, lat: float, lon: float, snap: bool = False):
+    logger.info(f'Set Goal Pose of {scope} as (lat={lat}, lon={lon})')
+    # Snapping and the route check can parse the map and search the routing graph, off the event loop
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, fleet.set_goal, scope, lat, lon, snap)
+    except ValueError as e:
+        # Unroutable goal, nothing was sent to the vehicle
+        return JSONResponse(status_code=422, content={'success': False, 'error': str(e)})
+    return 'success'
+
+
+@app.get('/map/routePreview')
+async def get_route_preview(scope: str, lat: float, lon: float):
+    """Shortest route from the current lanelet of a vehicle to a goal, with its geometry and length"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, fleet.route_preview, scope, lat, lon)
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={'success': False, 'error': str(e)})
 
 
 @app.get('/map/engage')
 async def set_engage(scope):
-    global pose_service
-    if pose_service is not None:
-        pose_service.engage(scope)
-        return 'success'
-    else:
-        return 'fail'
+    fleet.engage(scope)
+    return 'success'
+
+
+class GoalRequest(BaseModel):
+    scope: str
+    lat: float
+    lon: float
+
+
+class PointRequest(BaseModel):
+    lat: float
+    lon: float
+
+
+@app.get('/map/snap')
+async def snap_goal(lat: float, lon: float):
+    """Nearest point on a lanelet centerline, with its lanelet id, lane heading (deg) and distance moved (m)"""
+    # The first call can parse the map and build its KD-tree, off the event loop
+    loop = asyncio.get_running_loop()
+    try:
+        return (await loop.run_in_executor(None, fleet.snap_goals, [(lat, lon)]))[0]
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={'success': False, 'error': str(e)})
+
+
+@app.post('/map/snap')
+async def snap_goals(points: List[PointRequest]):
+    """Batch version of GET /map/snap"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, fleet.snap_goals, [(p.lat, p.lon) for p in points])
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={'success': False, 'error': str(e)})
+
+
+@app.post('/map/setGoals')
+async def set_goal_poses(goals: List[GoalRequest], engage: bool = False, snap: bool = False):
+    """Set the goals of many vehicles concurrently (snapped to the lanelets with snap), optionally engaging the ones that succeeded"""
+    loop = asyncio.get_running_loop()
+    logger.info(f'Set Goal Pose of {len(goals)} vehicles')
+    try:
+        goal_results = await loop.run_in_executor(None, fleet.set_goals, [(g.scope, g.lat, g.lon) for g in goals], snap)
+    except ValueError as e:
+        # Duplicate scopes, nothing was sent
+        return JSONResponse(status_code=422, content={'success': False, 'error': str(e)})
+    engage_results = []
+    if engage:
+        scopes = [r['scope'] for r in goal_results if r['success']]
+        engage_results = await loop.run_in_executor(None, fleet.engage_all, scopes)
+    return {'goals': goal_results, 'engage': engage_results}
+
+
+@app.post('/map/engageAll')
+async def set_engage_all(scopes: List[str]):
+    """Engage many vehicles concurrently"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fleet.engage_all, scopes)
 
 
 @app.get('/map/list-available')
 async def list_available_maps():
     """Get list of all available maps from maps_config.json"""
     try:
-        config = _load_all_maps_config()
+        current_map, _ = map_registry.current()
         maps = {}
-        for key, map_info in config.get('maps', {}).items():
+        for key, map_info in map_registry.maps().items():
             maps[key] = {
                 'name': map_info['name'],
                 'path': map_info['path'],
@@ -250,7 +404,7 @@ async def list_available_maps():
                 'origin_lat': map_info['origin_lat'],
                 'origin_lon': map_info['origin_lon'],
             }
-        current_map = config.get('current_map', 'unknown')
+        current_map = current_map or 'unknown'
         # logger.info(f"list-available current_map={current_map}")
         return {
             'maps': maps,
@@ -264,32 +418,104 @@ async def list_available_maps():
 @app.get('/map/switch')
 async def switch_map(map_key: str):
     """Switch to a different map"""
-    script_path = Path(__file__).parent / 'my_scripts' / 'switch_map.py'
     try:
-        # logger.info(f"switch map to {map_key}")
-        result = subprocess.run(
-            ['python3', str(script_path), 'set', map_key],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        # Log the subprocess output
-        if result.stdout:
-            logger.info(f"switch_map.py stdout:\n{result.stdout}")
-        if result.stderr:
-            logger.error(f"switch_map.py stderr:\n{result.stderr}")
-        
-        if result.returncode == 0:
-            try:
-                _, info = _load_current_map_config()
-                _apply_map_config(info)
-            except Exception as e:
-                logger.error(f"failed to apply map config after switch: {e}")
-            logger.info(f"switch map success {map_key}")
-            return {'success': True, 'message': f'Switched to {map_key}'}
-        else:
-            # logger.error(f"switch map failed with return code {result.returncode}")
-            return {'success': False, 'error': result.stderr}
+        info = map_registry.set_current(map_key)
+    except KeyError as e:
+        return {'success': False, 'error': e.args[0]}
     except Exception as e:
         # logger.error(f"switch map error {e}")
         return {'success': False, 'error': str(e)}
+    try:
+        _apply_map_config(info)
+    except Exception as e:
+        logger.error(f"failed to apply map config after switch: {e}")
+    logger.info(f"switch map success {map_key}")
+    return {'success': True, 'message': f'Switched to {map_key}'}
+
+
+def _current_pointcloud():
+    """Tiles of the point cloud of the current map; raises FileNotFoundError, PointCloudNotReady or ValueError"""
+    _, info = map_registry.current()
+    if info is None:
+        raise FileNotFoundError('No current map')
+    path = pointcloud.pcd_path(info)
+    if not path.exists():
+        raise FileNotFoundError(f'No point cloud for map {info["name"]}')
+    return pointcloud.STORE.get(path, (info['origin_lat'], info['origin_lon']))
+
+
+def _pointcloud_error(e):
+    if isinstance(e, FileNotFoundError):
+        return JSONResponse({'error': str(e)}, status_code=404)
+    if isinstance(e, pointcloud.PointCloudNotReady):
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '2'})
+    logger.error(f"point cloud error: {e}")
+    return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.get('/map/pointcloud')
+async def get_pointcloud_info():
+    """Bounds and levels of detail of the point cloud of the current map (503 while its tiles are being built)"""
+    try:
+        tiles = _current_pointcloud()
+    except (FileNotFoundError, pointcloud.PointCloudNotReady, ValueError) as e:
+        return _pointcloud_error(e)
+    meta = tiles.meta
+    return {
+        'key': tiles.key,
+        'points': meta['points'],
+        'bounds': meta['bounds'],
+        'tile_size': meta['tile_size'],
+        'format': meta['format'],
+        'latlon_transform': meta['latlon_transform'],
+        'lods': [
+            {'lod': lod, 'voxel': info['voxel'], 'points': info['points'], 'tiles': len(info['tiles'])} for lod, info in enumerate(meta['lods'])
+        ],
+    }
+
+
+@app.get('/map/pointcloud/tiles')
+async def get_pointcloud_tiles(lod: int, bbox: str, latlon: bool = False):
+    """Tiles of a level of detail intersecting bbox=min x,min y,max x,max y (map frame, or min lat,min lon,max lat,max lon with latlon)"""
+    try:
+        tiles = _current_pointcloud()
+        values = [float(v) for v in bbox.split(',')]
+        if len(values) != 4 or not 0 <= lod < len(tiles.meta['lods']):
+            raise ValueError('bbox needs 4 values and lod must be one of the levels of /map/pointcloud')
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError('bbox values must be finite')
+        if latlon:
+            values = tiles.map_bbox(*values)
+        found = tiles.tiles(lod, values)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=422)
+    except (FileNotFoundError, pointcloud.PointCloudNotReady) as e:
+        return _pointcloud_error(e)
+    return {
+        'key': tiles.key,
+        'lod': lod,
+        'voxel': tiles.meta['lods'][lod]['voxel'],
+        'tiles': [{'x': tx, 'y': ty, 'points': count, 'url': f'/map/pointcloud/tile/{lod}/{tx}/{ty}'} for tx, ty, count in found],
+    }
+
+
+@app.get('/map/pointcloud/tile/{lod}/{tx}/{ty}')
+async def get_pointcloud_tile(lod: int, tx: int, ty: int, request: Request):
+    """Points of a tile: little-endian float32 x, y, z, intensity rows in the map frame"""
+    try:
+        tiles = _current_pointcloud()
+    except (FileNotFoundError, pointcloud.PointCloudNotReady, ValueError) as e:
+        return _pointcloud_error(e)
+    if not 0 <= lod < len(tiles.meta['lods']):
+        return JSONResponse({'error': f'Unknown level of detail {lod}'}, status_code=404)
+    # Tiles never change for a given cache key
+    etag = f'"{tiles.key}-{lod}-{tx}-{ty}"'
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=86400'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    loop = asyncio.get_running_loop()
+    body = await loop.run_in_executor(None, tiles.tile, lod, tx, ty)
+    if body is None:
+        return JSONResponse({'error': f'No points in tile {tx},{ty}'}, status_code=404)
+    headers['X-Point-Count'] = str(len(body) // 16)
+    return Response(body, media_type='application/octet-stream', headers=headers)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Control and telemetry latency under camera load, with and without the zenoh traffic classes of zenoh_app/qos.py.
+
+A 'vehicle' session listens on a local port and an 'fms' session connects to it, and the traffic flows the way it
+does in the field. The fms side publishes control commands toward the vehicle; the vehicle side publishes telemetry
+and N camera streams of raw frames toward the fms, so that telemetry and frames compete for the vehicle's
+transmission queue while the commands cross the link the other way. Commands and telemetry are stamped with their
+send time, and the receiving side measures how late every one arrives. Every mode runs once without and once with
+the camera streams:
+
+- default: every publisher with zenoh's defaults
+- qos: the 'control', 'telemetry' and 'video' classes
+- separate: like qos, with the frames sent over a session pair of their own (as with FMS_VIDEO_SESSION)
+
+Usage:
+    python benchmark/control_latency.py
+    python benchmark/control_latency.py --streams 4 --fps 15 --duration 20 --modes default,qos
+"""
+
+import argparse
+import json
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+import zenoh
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+sys.path.insert(0, str(ROOT))
+
+from zenoh_app.qos import TRAFFIC_CLASSES  # noqa: E402
+
+CONTROL_KEY_EXPR = 'bench/external/selected/control_cmd'
+TELEMETRY_KEY_EXPR = 'bench/localization/kinematic_state'
+IMAGE_KEY_EXPR = 'bench/camera{}/image_raw'
+# Size of a serialized autoware_control_msgs/Control
+CONTROL_SIZE = 80
+# Size of a serialized autoware_adapi_v1_msgs/VehicleKinematics, published at 30 Hz
+TELEMETRY_SIZE = 700
+TELEMETRY_RATE = 30
+# Raw bgra8 640x480 frame, as published by the camera of the simulated vehicles
+FRAME_SIZE = 640 * 480 * 4
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(values[-1] * 1000, 3)}
+
+
+def open_session(listen=None, connect=None):
+    conf = zenoh.Config()
+    conf.insert_json5('mode', '"peer"')
+    conf.insert_json5('scouting/multicast/enabled', 'false')
+    conf.insert_json5('listen/endpoints', json.dumps([listen] if listen else []))
+    conf.insert_json5('connect/endpoints', json.dumps([connect] if connect else []))
+    return zenoh.open(conf)
+
+
+def publish_stamped(publisher, size, rate, end_event):
+    """Put payloads of size bytes stamped with their send time at rate Hz until end_event; return the number sent"""
+    payload = bytearray(size)
+    period = 1.0 / rate
+    deadline = time.perf_counter()
+    sent = 0
+    while not end_event.is_set():
+        struct.pack_into('<d', payload, 0, time.perf_counter())
+        publisher.put(bytes(payload))
+        sent += 1
+        deadline += period
+        end_event.wait(max(0.0, deadline - time.perf_counter()))
+    return sent
+
+
+def run_phase(sessions, mode, streams, args):
+    """Latency percentiles (ms) of the control commands and the telemetry of one phase, and the frames delivered"""
+    fms, vehicle, fms_video, vehicle_video = sessions
+    control_latencies = []
+    telemetry_latencies = []
+    frames = [0]
+
+    def stamped(latencies):
+        def on_sample(sample):
+            sent = struct.unpack_from('<d', sample.payload.to_bytes())[0]
+            latencies.append(time.perf_counter() - sent)
+
+        return on_sample
+
+    def on_frame(sample):
+        frames[0] += 1
+
+    def options(traffic_class):
+        return TRAFFIC_CLASSES[traffic_class] if mode != 'default' else {}
+
+    subscribers = [
+        vehicle.declare_subscriber(CONTROL_KEY_EXPR, stamped(control_latencies)),
+        fms.declare_subscriber(TELEMETRY_KEY_EXPR, stamped(telemetry_latencies)),
+    ]
+    subscribers += [fms_video.declare_subscriber(IMAGE_KEY_EXPR.format(i), on_frame) for i in range(streams)]
+    control = fms.declare_publisher(CONTROL_KEY_EXPR, **options('control'))
+    telemetry = vehicle.declare_publisher(TELEMETRY_KEY_EXPR, **options('telemetry'))
+    cameras = [vehicle_video.declare_publisher(IMAGE_KEY_EXPR.format(i), **options('video')) for i in range(streams)]
+    # Let the declarations propagate before measuring
+    time.sleep(1.0)
+
+    end_event = threading.Event()
+
+    def publish_frames():
+        frame = bytes(FRAME_SIZE)
+        period = 1.0 / args.fps
+        deadline = time.perf_counter()
+        while not end_event.is_set():
+            for camera in cameras:
+                camera.put(frame)
+            deadline += period
+            end_event.wait(max(0.0, deadline - time.perf_counter()))
+
+    video_thread = threading.Thread(target=publish_frames, daemon=True) if cameras else None
+    if video_thread is not None:
+        video_thread.start()
+        time.sleep(0.5)
+
+    telemetry_sent = [0]
+
+    def publish_telemetry():
+        telemetry_sent[0] = publish_stamped(telemetry, TELEMETRY_SIZE, TELEMETRY_RATE, end_event)
+
+    telemetry_thread = threading.Thread(target=publish_telemetry, daemon=True)
+    telemetry_thread.start()
+    timer = threading.Timer(args.duration, end_event.set)
+    timer.start()
+    control_sent = publish_stamped(control, CONTROL_SIZE, args.rate, end_event)
+
+    telemetry_thread.join()
+    if video_thread is not None:
+        video_thread.join()
+    # Samples still in flight
+    time.sleep(0.5)
+    for publisher in [control, telemetry] + cameras:
+        publisher.undeclare()
+    for subscriber in subscribers:
+        subscriber.undeclare()
+    return {
+        'control': {'sent': control_sent, 'received': len(control_latencies), 'latency_ms': percentiles(control_latencies)},
+        'telemetry': {'sent': telemetry_sent[0], 'received': len(telemetry_latencies), 'latency_ms': percentiles(telemetry_latencies)},
+        'frames_per_s': round(frames[0] / args.duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=4, help='camera streams during the loaded phases')
+    parser.add_argument('--fps', type=float, default=10, help='frames per second of every stream')
+    parser.add_argument('--rate', type=float, default=50, help='control commands per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per phase')
+    parser.add_argument('--modes', default='default,qos,separate', help='comma-separated modes to run')
+    parser.add_argument('--port', type=int, default=7897, help='local port of the vehicle session, the next one for its video session')
+    parser.add_argument('--output', help='result file (default: benchmark/results/control_latency-<time>.json)')
+    args = parser.parse_args()
+
+    endpoint = f'tcp/127.0.0.1:{args.port}'
+    video_endpoint = f'tcp/127.0.0.1:{args.port + 1}'
+    vehicle = open_session(listen=endpoint)
+    fms = open_session(connect=endpoint)
+    vehicle_video = open_session(listen=video_endpoint)
+    fms_video = open_session(connect=video_endpoint)
+    time.sleep(1.0)
+
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            sessions = (fms, vehicle, fms_video, vehicle_video) if mode == 'separate' else (fms, vehicle, fms, vehicle)
+            for streams in (0, args.streams):
+                name = f'{mode}/{streams} streams'
+                print(f'Running {name} ...')
+                results[name] = run_phase(sessions, mode, streams, args)
+    finally:
+        for session in (fms_video, vehicle_video, fms, vehicle):
+            session.close()
+
+    result = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': vars(args), 'phases': results}
+    output = Path(args.output) if args.output else RESULTS_DIR / f'control_latency-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+
+    for stream, title in (('control', 'Control latency (fms --> vehicle)'), ('telemetry', 'Telemetry latency (vehicle --> fms)')):
+        print(f'\n=== {title} ===')
+        for name, data in results.items():
+            latency = data[stream]['latency_ms']
+            print(
+                f'  {name}: p50 {latency["p50"]} ms, p99 {latency["p99"]} ms, max {latency["max"]} ms, '
+                f'received {data[stream]["received"]}/{data[stream]["sent"]}, {data["frames_per_s"]} frames/s'
+            )
+    print(f'Saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
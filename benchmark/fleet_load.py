@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark of the FMS API server with a simulated fleet.
+
+Starts a local zenoh peer with N simulated vehicles (see fleet_sim.py), optionally starts api_server.py, drives
+the HTTP polling endpoints and the WebSockets, and writes throughput, latency percentiles and CPU usage to a JSON
+file that can be compared with the results of another release.
+
+Usage:
+    python benchmark/fleet_load.py --vehicles 50 --duration 30 --start-server
+    python benchmark/fleet_load.py --vehicles 50 --compare benchmark/results/previous.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+import zenoh
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# fleet_sim publishes with the traffic classes of zenoh_app
+sys.path.insert(0, str(ROOT))
+
+from fleet_sim import SimulatedFleet  # noqa: E402
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(values[-1] * 1000, 3)}
+
+
+class ProcessCpu:
+    """CPU usage of a process (%), via psutil when it is available"""
+
+    def __init__(self, pid):
+        try:
+            import psutil
+
+            self.process = psutil.Process(pid)
+            self.process.cpu_percent(None)
+        except Exception:
+            self.process = None
+        self.start_cpu = time.process_time() if pid == os.getpid() else None
+        self.start_wall = time.perf_counter()
+
+    def percent(self):
+        if self.process is not None:
+            return round(self.process.cpu_percent(None), 1)
+        if self.start_cpu is not None:
+            return round((time.process_time() - self.start_cpu) / (time.perf_counter() - self.start_wall) * 100, 1)
+        return None
+
+
+def wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/health', timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.5)
+    return False
+
+
+def http_load(base_url, paths, concurrency, duration):
+    """Request the paths round-robin from concurrency threads, each with its own keep-alive connection"""
+    results = {path: {'latencies': [], 'errors': 0} for path in paths}
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def worker(offset):
+        http = requests.Session()
+        latencies = {path: [] for path in paths}
+        errors = {path: 0 for path in paths}
+        i = offset
+        while time.perf_counter() < end:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                response = http.get(base_url + path, timeout=10)
+                response.raise_for_status()
+                latencies[path].append(time.perf_counter() - start)
+            except requests.RequestException:
+                errors[path] += 1
+        with lock:
+            for path in paths:
+                results[path]['latencies'].extend(latencies[path])
+                results[path]['errors'] += errors[path]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        path: {
+            'requests': len(data['latencies']),
+            'errors': data['errors'],
+            'rps': round(len(data['latencies']) / duration, 1),
+            'latency_ms': percentiles(data['latencies']),
+        }
+        for path, data in results.items()
+    }
+
+
+def teleop_ws_load(ws_url, scope, duration, input_rate=50):
+    """Stream teleop inputs over /teleop/ws and measure the interval between status messages"""
+    from websockets.sync.client import connect
+
+    intervals = []
+    sent = 0
+    with connect(f'{ws_url}/teleop/ws?scope={scope}') as ws:
+        end = time.perf_counter() + duration
+        last_status = None
+        next_input = time.perf_counter()
+        while time.perf_counter() < end:
+            now = time.perf_counter()
+            if now >= next_input:
+                ws.send(json.dumps({'steering': 10 * ((sent % 20) - 10) / 10, 'velocity': 5}))
+                sent += 1
+                next_input += 1.0 / input_rate
+            try:
+                ws.recv(timeout=max(0.0, next_input - time.perf_counter()))
+                now = time.perf_counter()
+                if last_status is not None:
+                    intervals.append(now - last_status)
+                last_status = now
+            except TimeoutError:
+                pass
+    return {'inputs_sent': sent, 'status_received': len(intervals) + 1, 'status_interval_ms': percentiles(intervals)}
+
+
+def video_ws_load(ws_url, duration):
+    """Count JPEG frames received on /video"""
+    from websockets.sync.client import connect
+
+    frames = 0
+    size = 0
+    with connect(f'{ws_url}/video', max_size=None) as ws:
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            try:
+                data = ws.recv(timeout=1)
+                frames += 1
+                size += len(data)
+            except TimeoutError:
+                pass
+    return {'frames': frames, 'fps': round(frames / duration, 2), 'avg_frame_kb': round(size / frames / 1024, 1) if frames else None}
+
+
+def compare(current, previous_path):
+    previous = json.loads(Path(previous_path).read_text())
+    print(f'\n=== Compared with {previous_path} ({previous.get("version")}) ===')
+    for path, data in current['http'].items():
+        old = previous.get('http', {}).get(path)
+        if old is None:
+            continue
+        print(
+            f'  {path}: rps {old["rps"]} -> {data["rps"]}, '
+            f'p50 {old["latency_ms"]["p50"]} -> {data["latency_ms"]["p50"]} ms, '
+            f'p99 {old["latency_ms"]["p99"]} -> {data["latency_ms"]["p99"]} ms'
+        )
+    print(f'  server cpu: {previous.get("cpu", {}).get("server_percent")} -> {current["cpu"]["server_percent"]} %')
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=50, help='number of simulated vehicles')
+    parser.add_argument('--camera-vehicles', type=int, default=1, help='how many of them publish camera images')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load per phase')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='API server URL')
+    parser.add_argument('--connect', default='tcp/127.0.0.1:7887', help='zenoh endpoint of the FMS')
+    parser.add_argument('--start-server', action='store_true', help='start api_server.py with uvicorn')
+    parser.add_argument('--output', help='result file (default: benchmark/results/fleet_load-<time>.json)')
+    parser.add_argument('--compare', help='previous result file to compare with')
+    args = parser.parse_args()
+
+    server = None
+    if args.start_server:
+        server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'api_server:app', '--port', args.url.rsplit(':', 1)[-1]], cwd=ROOT)
+    try:
+        if not wait_for_server(args.url):
+            print(f'API server at {args.url} is not reachable')
+            sys.exit(1)
+
+        conf = zenoh.Config()
+        conf.insert_json5('mode', '"peer"')
+        conf.insert_json5('connect/endpoints', json.dumps([args.connect]))
+        session = zenoh.open(conf)
+
+        fleet = SimulatedFleet(session, args.vehicles, camera_vehicles=args.camera_vehicles)
+        fleet.start()
+        print(f'Simulating {args.vehicles} vehicles ({args.camera_vehicles} with camera)')
+
+        server_cpu = ProcessCpu(server.pid if server is not None else os.getpid())
+        harness_cpu = ProcessCpu(os.getpid())
+
+        ### Discovery: the FMS constructs one VehiclePose per vehicle found
+        start = time.perf_counter()
+        found = requests.get(args.url + '/map/list', timeout=120).json()
+        discovery = {'found': len(found), 'seconds': round(time.perf_counter() - start, 3)}
+        print(f'Discovery found {len(found)} vehicles in {discovery["seconds"]} s')
+
+        scopes = fleet.scopes
+        paths = ['/map/pose', '/map/goalPose', '/teleop/status'] + [f'/status/{scope}' for scope in scopes[: min(10, len(scopes))]]
+
+        published_before = fleet.published()
+        http = http_load(args.url, paths, args.concurrency, args.duration)
+        published = fleet.published() - published_before
+
+        ws_url = args.url.replace('http', 'ws', 1)
+        requests.get(args.url + '/teleop/startup', params={'scope': scopes[0]}, timeout=30)
+        websocket = {}
+        for name, load in (
+            ('teleop', lambda: teleop_ws_load(ws_url, scopes[0], args.duration)),
+            ('video', lambda: video_ws_load(ws_url, args.duration)),
+        ):
+            try:
+                websocket[name] = load()
+            except Exception as e:
+                websocket[name] = {'error': str(e)}
+        requests.get(args.url + '/teleop/stop', params={'scope': scopes[0]}, timeout=30)
+
+        result = {
+            'version': git_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': vars(args),
+            'discovery': discovery,
+            'zenoh': {'published': published, 'rate': round(published / args.duration, 1)},
+            'http': http,
+            'websocket': websocket,
+            'cpu': {'server_percent': server_cpu.percent(), 'harness_percent': harness_cpu.percent()},
+        }
+
+        fleet.stop()
+        session.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f'fleet_load-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+
+    print(f'\n=== Results ({result["version"]}) ===')
+    for path, data in http.items():
+        print(f'  {path}: {data["rps"]} req/s, p50 {data["latency_ms"]["p50"]} ms, p99 {data["latency_ms"]["p99"]} ms, errors {data["errors"]}')
+    print(f'  websocket: {json.dumps(websocket)}')
+    print(f'  cpu: {result["cpu"]}')
+    print(f'Saved to {output}')
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
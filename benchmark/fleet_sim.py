@@ -0,0 +1,243 @@
+"""
+Simulated Autoware fleet for benchmarking the FMS.
+
+Every simulated vehicle publishes the topics the FMS subscribes to at realistic rates, and answers the admin-space
+queries of zenoh-bridge-ros2dds (used by list_autoware and PoseServer.findVehicles) as well as the services the FMS
+calls when setting goals, engaging or starting teleop.
+"""
+
+import json
+import math
+import threading
+import time
+import uuid
+
+from zenoh_ros_type.autoware_adapi_msgs import (
+    ChangeOperationModeResponse,
+    ClearRouteResponse,
+    ResponseStatus,
+    SetRoutePointsResponse,
+    VehicleKinematics,
+)
+from zenoh_ros_type.autoware_auto_msgs import GearReport, SteeringReport, VelocityReport
+from zenoh_ros_type.common_interfaces import (
+    Accel,
+    AccelWithCovariance,
+    AccelWithCovarianceStamped,
+    Header,
+    Image,
+    Point,
+    Pose,
+    PoseWithCovariance,
+    PoseWithCovarianceStamped,
+    Quaternion,
+    Twist,
+    TwistWithCovariance,
+    TwistWithCovarianceStamped,
+    Vector3,
+)
+from zenoh_ros_type.rcl_interfaces import Time
+from zenoh_ros_type.tier4_autoware_msgs import CpuStatus, CpuUsage, TurnSignal, TurnSignalStamped
+
+from zenoh_app import qos
+
+TOPIC_KINEMATICS = '/api/vehicle/kinematics'
+TOPIC_GEAR = '/vehicle/status/gear_status'
+TOPIC_TURN = '/vehicle/status/turn_indicators_status'
+TOPIC_STEER = '/vehicle/status/steering_status'
+TOPIC_VELOCITY = '/vehicle/status/velocity_status'
+TOPIC_CPU = '/api/external/get/cpu_usage'
+TOPIC_IMAGE = '/sensing/camera/traffic_light/image_raw'
+
+SERVICES = (
+    '/api/routing/clear_route',
+    '/api/routing/set_route_points',
+    '/api/operation_mode/change_to_autonomous',
+    '/api/operation_mode/change_to_remote',
+)
+
+# Publish rate (Hz) of every topic, close to what Autoware produces
+RATES = {
+    TOPIC_KINEMATICS: 30,
+    TOPIC_VELOCITY: 50,
+    TOPIC_STEER: 50,
+    TOPIC_GEAR: 10,
+    TOPIC_TURN: 10,
+    TOPIC_CPU: 1,
+    TOPIC_IMAGE: 10,
+}
+
+IMAGE_WIDTH = 640
+IMAGE_HEIGHT = 480
+CPU_CORES = 8
+
+
+def now_stamp():
+    t = time.time()
+    return Time(sec=int(t), nanosec=int((t - int(t)) * 1e9))
+
+
+def covariance():
+    return [0.0] * 36
+
+
+def kinematics_message(x, y, yaw, speed):
+    header = Header(stamp=now_stamp(), frame_id='map')
+    orientation = Quaternion(x=0.0, y=0.0, z=math.sin(yaw / 2), w=math.cos(yaw / 2))
+    zero = Vector3(x=0.0, y=0.0, z=0.0)
+    return VehicleKinematics(
+        pose=PoseWithCovarianceStamped(
+            header=header,
+            pose=PoseWithCovariance(pose=Pose(position=Point(x=x, y=y, z=0.0), orientation=orientation), covariance=covariance()),
+        ),
+        twist=TwistWithCovarianceStamped(
+            header=header,
+            twist=TwistWithCovariance(twist=Twist(linear=Vector3(x=speed, y=0.0, z=0.0), angular=zero), covariance=covariance()),
+        ),
+        accel=AccelWithCovarianceStamped(
+            header=header,
+            accel=AccelWithCovariance(accel=Accel(linear=zero, angular=zero), covariance=covariance()),
+        ),
+    )
+
+
+def cpu_message(load):
+    def status(total):
+        return CpuStatus(status=0, total=total, usr=total * 0.7, nice=0.0, sys=total * 0.3, idle=100.0 - total)
+
+    return CpuUsage(stamp=now_stamp(), all=status(load), cpus=[status((load + 7 * i) % 100) for i in range(CPU_CORES)])
+
+
+def image_payload():
+    image = Image(
+        header=Header(stamp=now_stamp(), frame_id='camera'),
+        height=IMAGE_HEIGHT,
+        width=IMAGE_WIDTH,
+        encoding='bgra8',
+        is_bigendian=0,
+        step=IMAGE_WIDTH * 4,
+        data=bytes(IMAGE_WIDTH * IMAGE_HEIGHT * 4),
+    )
+    return image.serialize()
+
+
+def service_reply(key_expr):
+    status = ResponseStatus(success=True, code=0, message='')
+    if key_expr.endswith('clear_route'):
+        return ClearRouteResponse(status=status).serialize()
+    if key_expr.endswith('set_route_points'):
+        return SetRoutePointsResponse(status=status).serialize()
+    return ChangeOperationModeResponse(status=status).serialize()
+
+
+class SimulatedVehicle:
+    def __init__(self, session, scope, index, camera=False):
+        self.session = session
+        self.scope = scope
+        self.index = index
+        self.camera = camera
+        self.uuid = uuid.uuid4().hex
+        self.published = 0
+
+        topics = [TOPIC_KINEMATICS, TOPIC_GEAR, TOPIC_TURN, TOPIC_STEER, TOPIC_VELOCITY, TOPIC_CPU]
+        if camera:
+            topics.append(TOPIC_IMAGE)
+        self.publishers = {topic: qos.declare_publisher(session, scope + topic, qos.traffic_class(topic)) for topic in topics}
+
+        ### Answer the admin space like zenoh-bridge-ros2dds does
+        self.queryables = [
+            session.declare_queryable(f'@/{self.uuid}/ros2/config', self.reply_config),
+            session.declare_queryable(f'@/{self.uuid}/ros2/pub/{scope}{TOPIC_KINEMATICS}', self.reply_route),
+        ]
+        for service in SERVICES:
+            self.queryables.append(session.declare_queryable(scope + service, self.reply_service))
+
+    def reply_config(self, query):
+        query.reply(query.key_expr, json.dumps({'namespace': '/' + self.scope}))
+
+    def reply_route(self, query):
+        query.reply(query.key_expr, json.dumps({'name': self.scope + TOPIC_KINEMATICS}))
+
+    def reply_service(self, query):
+        query.reply(query.key_expr, service_reply(str(query.key_expr)))
+
+    def payload(self, topic, t, image=None):
+        # Drive around a circle of 50 m, each vehicle with its own phase
+        phase = t * 0.1 + self.index
+        if topic == TOPIC_KINEMATICS:
+            return kinematics_message(50 * math.cos(phase), 50 * math.sin(phase), phase + math.pi / 2, 5.0).serialize()
+        if topic == TOPIC_VELOCITY:
+            return VelocityReport(
+                header=Header(stamp=now_stamp(), frame_id='base_link'), longitudinal_velocity=5.0, lateral_velocity=0.0, heading_rate=0.1
+            ).serialize()
+        if topic == TOPIC_STEER:
+            return SteeringReport(stamp=now_stamp(), steering_tire_angle=0.05 * math.sin(phase)).serialize()
+        if topic == TOPIC_GEAR:
+            return GearReport(stamp=now_stamp(), report=2).serialize()
+        if topic == TOPIC_TURN:
+            return TurnSignalStamped(stamp=now_stamp(), turn_signal=TurnSignal(data=0)).serialize()
+        if topic == TOPIC_CPU:
+            return cpu_message(30 + 20 * math.sin(phase)).serialize()
+        return image
+
+    def publish(self, topic, t, image=None):
+        publisher = self.publishers.get(topic)
+        if publisher is None:
+            return
+        publisher.put(self.payload(topic, t, image))
+        self.published += 1
+
+    def close(self):
+        for publisher in self.publishers.values():
+            publisher.undeclare()
+        for queryable in self.queryables:
+            queryable.undeclare()
+
+
+class SimulatedFleet:
+    """N simulated vehicles; one thread per topic publishes for the whole fleet against fixed deadlines"""
+
+    def __init__(self, session, count, prefix='sim', camera_vehicles=1, rates=None):
+        self.session = session
+        self.rates = dict(RATES, **(rates or {}))
+        self.vehicles = [SimulatedVehicle(session, f'{prefix}{i}', i, camera=i < camera_vehicles) for i in range(count)]
+        self.end_event = threading.Event()
+        self.threads = []
+        # Every camera publishes the same frame, serialized once
+        self.image = image_payload() if camera_vehicles > 0 else None
+
+    @property
+    def scopes(self):
+        return [vehicle.scope for vehicle in self.vehicles]
+
+    def start(self):
+        for topic, rate in self.rates.items():
+            if rate <= 0:
+                continue
+            thread = threading.Thread(target=self.run_topic, args=(topic, rate), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def run_topic(self, topic, rate):
+        period = 1.0 / rate
+        deadline = time.perf_counter()
+        start = time.time()
+        while not self.end_event.is_set():
+            t = time.time() - start
+            for vehicle in self.vehicles:
+                try:
+                    vehicle.publish(topic, t, self.image)
+                except Exception as e:
+                    print(f'[sim] failed to publish {topic} for {vehicle.scope}: {e}')
+            deadline += period
+            self.end_event.wait(max(0.0, deadline - time.perf_counter()))
+
+    def published(self):
+        return sum(vehicle.published for vehicle in self.vehicles)
+
+    def stop(self):
+        self.end_event.set()
+        for thread in self.threads:
+            thread.join()
+        for vehicle in self.vehicles:
+            vehicle.close()
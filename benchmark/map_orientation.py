@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of OrientationParser across map sizes.
+
+Measures construction (load + initialize), initialize alone and genQuaternion_seg latency on Town01 and on
+synthetic maps made of a grid of Town01 copies (10x, 100x, 1000x its lanelet count by default). Generated maps are
+cached in benchmark/results/maps.
+
+Usage:
+    python benchmark/map_orientation.py
+    python benchmark/map_orientation.py --scales 1,10 --queries 200 --output result.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+TOWN01 = ROOT / 'frontend' / 'public' / 'carla_map' / 'Town01' / 'lanelet2_map.osm'
+
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('REACT_APP_MAP_FILE_PATH', '/carla_map/Town01/lanelet2_map.osm')
+os.environ.setdefault('REACT_APP_MAP_ORIGIN_LAT', '0')
+os.environ.setdefault('REACT_APP_MAP_ORIGIN_LON', '0')
+
+from zenoh_app.map_parser import OrientationParser  # noqa: E402
+
+# Gap between two copies, relative to the map extent
+TILE_MARGIN = 1.1
+
+
+def generate_map(source, scale, output):
+    """Write a map made of `scale` copies of source laid out on a grid, with ids and coordinates shifted"""
+    tree = ET.parse(source)
+    root = tree.getroot()
+    nodes = root.findall('node')
+    others = [e for e in root if e.tag in ('way', 'relation')]
+    max_id = max(abs(int(e.get('id'))) for e in root if e.get('id') is not None)
+
+    lats = [float(n.get('lat')) for n in nodes]
+    lons = [float(n.get('lon')) for n in nodes]
+    lat_step = (max(lats) - min(lats)) * TILE_MARGIN or 0.01
+    lon_step = (max(lons) - min(lons)) * TILE_MARGIN or 0.01
+    local_x = [float(t.get('v')) for n in nodes for t in n.findall('tag') if t.get('k') == 'local_x']
+    local_y = [float(t.get('v')) for n in nodes for t in n.findall('tag') if t.get('k') == 'local_y']
+    x_step = (max(local_x) - min(local_x)) * TILE_MARGIN if local_x else 0
+    y_step = (max(local_y) - min(local_y)) * TILE_MARGIN if local_y else 0
+
+    columns = math.ceil(math.sqrt(scale))
+    out = ET.Element(root.tag, root.attrib)
+    # Nodes first, then ways and relations, as in any OSM file
+    for k in range(scale):
+        row, column = divmod(k, columns)
+        for node in nodes:
+            copy = ET.SubElement(out, 'node', dict(node.attrib))
+            copy.set('id', str(int(node.get('id')) + k * (max_id + 1)))
+            copy.set('lat', repr(float(node.get('lat')) + row * lat_step))
+            copy.set('lon', repr(float(node.get('lon')) + column * lon_step))
+            for tag in node.findall('tag'):
+                value = tag.get('v')
+                if tag.get('k') == 'local_x':
+                    value = repr(float(value) + column * x_step)
+                elif tag.get('k') == 'local_y':
+                    value = repr(float(value) + row * y_step)
+                ET.SubElement(copy, 'tag', {'k': tag.get('k'), 'v': value})
+
+    for kind in ('way', 'relation'):
+        for k in range(scale):
+            id_offset = k * (max_id + 1)
+            for element in others:
+                if element.tag != kind:
+                    continue
+                copy = ET.SubElement(out, element.tag, dict(element.attrib))
+                copy.set('id', str(int(element.get('id')) + id_offset))
+                for child in element:
+                    attrib = dict(child.attrib)
+                    if child.tag == 'nd' or (child.tag == 'member' and 'ref' in attrib):
+                        attrib['ref'] = str(int(attrib['ref']) + id_offset)
+                    ET.SubElement(copy, child.tag, attrib)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    ET.ElementTree(out).write(output, encoding='utf-8', xml_declaration=True)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+def bench_map(path, origin_lat, origin_lon, queries, repeat, seed):
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+        start = time.perf_counter()
+        parser = OrientationParser(path=str(path), originX=origin_lat, originY=origin_lon)
+        construction = time.perf_counter() - start
+
+    initialize = []
+    for _ in range(repeat):
+        parser.points = {}
+        parser.ways = {}
+        start = time.perf_counter()
+        parser.initialize()
+        initialize.append(time.perf_counter() - start)
+
+    ### Query around the lanelets, where operators click goals
+    rng = random.Random(seed)
+    centers = [(p.x, p.y) for lanelet in parser.vmap.laneletLayer for p in lanelet.centerline]
+    lookup = []
+    for _ in range(queries):
+        x, y = rng.choice(centers)
+        x += rng.uniform(-3, 3)
+        y += rng.uniform(-3, 3)
+        with contextlib.redirect_stdout(quiet):
+            start = time.perf_counter()
+            parser.genQuaternion_seg(x, y)
+            lookup.append(time.perf_counter() - start)
+        quiet.seek(0)
+        quiet.truncate()
+
+    return {
+        'lanelets': len(parser.vmap.laneletLayer),
+        'points': len(parser.vmap.pointLayer),
+        'construction_s': round(construction, 3),
+        'initialize': summarize(initialize),
+        'genQuaternion_seg': summarize(lookup),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--map', default=str(TOWN01), help='base lanelet2 map (default: Town01)')
+    parser.add_argument('--origin', nargs=2, type=float, default=(0.0, 0.0), metavar=('LAT', 'LON'), help='map origin')
+    parser.add_argument('--scales', default='1,10,100,1000', help='comma separated multiples of the base map')
+    parser.add_argument('--queries', type=int, default=50, help='genQuaternion_seg calls per map')
+    parser.add_argument('--repeat', type=int, default=5, help='initialize calls per map')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='result file (default: benchmark/results/map_orientation-<time>.json)')
+    args = parser.parse_args()
+
+    base = Path(args.map)
+    results = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        path = base
+        if scale > 1:
+            path = RESULTS_DIR / 'maps' / f'{base.stem}_x{scale}.osm'
+            if not path.exists() or path.stat().st_mtime < base.stat().st_mtime:
+                print(f'Generating {path} ...')
+                generate_map(base, scale, path)
+        result = dict(scale=scale, **bench_map(path, *args.origin, args.queries, args.repeat, args.seed))
+        results.append(result)
+        print(
+            f'x{scale:<5} lanelets={result["lanelets"]:<8} construction={result["construction_s"]} s  '
+            f'initialize={result["initialize"]["p50_ms"]} ms  '
+            f'genQuaternion_seg p50={result["genQuaternion_seg"]["p50_ms"]} ms p99={result["genQuaternion_seg"]["p99_ms"]} ms'
+        )
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f'map_orientation-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({'map': str(base), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, indent=2))
+    print(f'Saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
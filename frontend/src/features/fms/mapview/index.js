@@ -195,6 +195,8 @@ function MapPanel() {
                             lat: e.lat,
                             lon: e.lon,
                             heading: (e.heading !== undefined && e.heading !== null) ? e.heading : 0,
+                            lanelet: e.lanelet,
+                            arc: e.arc,
                             valid: true
                         })
                     )
@@ -416,7 +416,7 @@ const MapViewer = (props) => {
                             props.currentMarker.map( (p, idx) => {
                                     // console.log(p)
                                     return (
-                                        <VehicleMarker key={`current-${p.scope}-${idx}`} pose={p} text={p.scope} type={"current"} zoom={props.zoomLevel}/>
+                                        <VehicleMarker key={`current-${p.scope}-${idx}`} pose={p} text={(p.lanelet !== undefined && p.lanelet !== null) ? `${p.scope} (lanelet ${p.lanelet}, ${p.arc} m)` : p.scope} type={"current"} zoom={props.zoomLevel}/>
                                     );
                                 }
 
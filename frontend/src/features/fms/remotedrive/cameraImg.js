@@ -31,6 +31,16 @@ export const CamImageWithStatus = (props) => {
                             <td>{(props.status)?props.status.steering: '0'}</td>
                             <td></td>
                         </tr>
+                         <tr className="border-b dark:bg-gray-800 dark:border-gray-700">
+                            <th scope="row" className="px-6 py-4 font-bold text-gray-900 whitespace-nowrap dark:text-white">
+                                Control
+                            </th>
+                            {/* The server zeroes the command when no input arrived within its deadman window */}
+                            <td className={(props.status && props.status.deadman)? "text-red-600" : ""}>
+                                {(props.status && props.status.deadman)? 'Released (deadman)' : 'Active'}
+                            </td>
+                            <td></td>
+                        </tr>
                     </tbody>
                 </table>
             </div>
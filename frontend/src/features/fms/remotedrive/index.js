@@ -65,65 +65,109 @@ function TeleopPnael() {
         return {
             velocity: '---',
             gear: '---',
-            steering: '---'
+            steering: '---',
+            deadman: false
         }
     })
     const [rotation, setRotation] = useState(0);
     const [cameraUrl, setCameraUrl] = useState("");
+    const teleopWs = useRef(null);
+    const rotationRef = useRef(0);
 
     const handleRotationChange = (newRotation) => {
         setRotation(newRotation);
     };
 
+    /* Send teleop inputs through the WebSocket, falling back to HTTP when it is not connected */
+    const sendTeleop = (message) => {
+        const ws = teleopWs.current
+        if(ws && ws.readyState === WebSocket.OPEN){
+            ws.send(JSON.stringify(message))
+            return true
+        }
+        return false
+    }
+
+    const handleGear = (scope, gear) => {
+        if(!sendTeleop({gear: gear})) setGear(scope, gear)
+    }
+
+    const handleVelocity = (scope, velocity) => {
+        if(!sendTeleop({velocity: parseFloat(velocity)})) setVelocity(scope, velocity)
+    }
+
     useEffect(() => {
         /* Connect to web socket serever */
         const ws = new WebSocket("ws://localhost:8000/video");
 
         /* Handle image sent by web socket */
         ws.onmessage = (event) => {
-            // if (event.data instanceof Blob) {
             // Convert the received data to a Blob
             const blob = event.data;
             // Create a data URL from the Blob
             const url = URL.createObjectURL(blob);
             // Update the state with the image source URL
             setCameraUrl(url);
-            console.log(url)
-            // }
         };
 
-        /* Get the status of vehicle */
-        const getTeleopStatus = async () => {
-            if(teleopScope === 'None') return;
-            const response = await axios.get('/teleop/status', {});
-            let newStatus = Object.assign({}, {
-                velocity: response.data.velocity,
-                gear: response.data.gear,
-                steering: response.data.steering
-            })
-            setTeleopStatus(newStatus)
+        return () => {
+            ws.close();
+        }
+    }, [])
+
+    useEffect(() => {
+        if(teleopScope === 'None') return;
+
+        /* Teleop channel: inputs go up as they happen, the status comes back as it changes */
+        const ws = new WebSocket(`ws://localhost:8000/teleop/ws?scope=${teleopScope}`);
+        teleopWs.current = ws
+
+        ws.onopen = () => {
+            sendTeleop({steering: (-1) * rotationRef.current})
         }
 
-        /* Set the steering of vehicle */
-        const setTeleopTurn = async () => {
-            if(teleopScope === 'None') return;
-            await setTurn(teleopScope, (-1) * rotation)
+        ws.onmessage = (event) => {
+            const data = JSON.parse(event.data)
+            if(data.error) return;
+            setTeleopStatus({
+                velocity: data.velocity,
+                gear: data.gear,
+                steering: data.steering,
+                deadman: Boolean(data.deadman)
+            })
         }
 
+        /* Heartbeat: the server stops the vehicle when it hears nothing within its deadman window */
+        const heartbeat_interval = setInterval(() => sendTeleop({}), 250)
 
-        /* Get status of vehicle every 1 sec after startup */
+        /* Get the status of vehicle over HTTP every 1 sec while the channel is not connected */
+        const getTeleopStatus = async () => {
+            if(teleopWs.current && teleopWs.current.readyState === WebSocket.OPEN) return;
+            const response = await axios.get(`/teleop/status?scope=${teleopScope}`, {});
+            setTeleopStatus({
+                velocity: response.data.velocity,
+                gear: response.data.gear,
+                steering: response.data.steering,
+                deadman: Boolean(response.data.deadman)
+            })
+        }
         const get_status_interval = setInterval(getTeleopStatus, 1000)
 
-        /* Set steering angle to the vehicle every 1 sec after startup */
-        const set_steering_interval = setInterval(setTeleopTurn, 1000)
-
-        /* Clear the timer when unmount */
+        /* Close the channel when unmount or switching vehicle */
         return () => {
+            clearInterval(heartbeat_interval)
             clearInterval(get_status_interval)
-            clearInterval(set_steering_interval)
+            teleopWs.current = null
             ws.close();
         }
 
+    }, [teleopScope])
+
+    useEffect(() => {
+        /* Send the steering angle as soon as the wheel moves */
+        rotationRef.current = rotation
+        if(teleopScope === 'None') return;
+        if(!sendTeleop({steering: (-1) * rotation})) setTurn(teleopScope, (-1) * rotation)
     }, [teleopScope, rotation])
 
     return (
@@ -151,7 +195,7 @@ function TeleopPnael() {
                         <div className="flex">
                             <StyleSelect options={["Parking", "Drive", "Reverse", "Neutral", "Low"]} ref={gearRef} />
                             <div className="inline-block w-1/4 p-2">
-                                <TeleopButton text="Set" handleClick={setGear} scope={teleopScope} refon={gearRef} reftype="select" />
+                                <TeleopButton text="Set" handleClick={handleGear} scope={teleopScope} refon={gearRef} reftype="select" />
                             </div>
                         </div>
                     </div>
@@ -161,7 +205,7 @@ function TeleopPnael() {
                         <div className="flex">
                             <StyleTextArea placeHolder="km/hr" ref={velocityRef} />
                             <div className="inline-block w-1/4 p-2">
-                                <TeleopButton text="Set" handleClick={setVelocity} scope={teleopScope} refon={velocityRef} reftype="textarea"/>
+                                <TeleopButton text="Set" handleClick={handleVelocity} scope={teleopScope} refon={velocityRef} reftype="textarea"/>
                             </div>
                         </div>
                     </div>
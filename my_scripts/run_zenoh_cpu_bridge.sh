@@ -1,6 +1,7 @@
 #!/bin/bash
-# Zenoh-based CPU bridge - runs in FMS environment using zenoh_ros_type
-# This directly publishes CPU usage to Zenoh (not through ROS2)
+# Zenoh-based telemetry bridge - runs in FMS environment using zenoh_ros_type
+# This directly publishes CPU, memory, temperature, disk and network usage to Zenoh (not through ROS2)
+# Arguments are passed to the bridge, see: python3 zenoh_cpu_bridge.py --help
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 BRIDGE_SCRIPT="$SCRIPT_DIR/zenoh_cpu_bridge.py"
@@ -26,7 +27,7 @@ echo "  FMS Directory: $FMS_DIR"
 echo "  FMS Virtual Env: $FMS_DIR/.venv"
 echo ""
 echo "This bridge uses zenoh_ros_type from FMS environment"
-echo "Publishing CPU usage directly to Zenoh at 172.30.10.52:7887"
+echo "Publishing telemetry directly to Zenoh at ${FMS_BRIDGE_CONNECT:-tcp/172.30.10.52:7887}"
 echo ""
 echo "Press Ctrl+C to stop"
 echo ""
@@ -43,4 +44,4 @@ fi
 
 # Run in FMS venv with zenoh_ros_type available
 source .venv/bin/activate
-python3 "$BRIDGE_SCRIPT"
+python3 "$BRIDGE_SCRIPT" "$@"
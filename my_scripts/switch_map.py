@@ -2,7 +2,9 @@
 """
 Map Switcher Tool
 
-This script helps you easily switch between different maps by updating the env.sh file.
+This script helps you easily switch between different maps by updating maps_config.json.
+A running API server lists the new current map right away, but keeps the origin and projection of the map it applied
+at startup: restart it, or switch with /map/switch, which also re-applies the map in-process.
 
 Usage:
     python switch_map.py list                    # List all available maps
@@ -11,43 +13,37 @@ Usage:
     python switch_map.py add <key> <path> <lat> <lon>  # Add a new map configuration
 """
 
-import json
 import sys
-import os
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zenoh_app.map_registry import MapRegistry  # noqa: E402
 
 CONFIG_FILE = Path(__file__).parent / "maps_config.json"
-ENV_FILE = Path(__file__).parent.parent / "env.sh"
 
 
-def load_config():
-    """Load the maps configuration file."""
+def load_registry():
+    """Open the maps configuration file."""
     if not CONFIG_FILE.exists():
         print(f"Error: Configuration file not found at {CONFIG_FILE}")
         sys.exit(1)
-    
-    with open(CONFIG_FILE, 'r') as f:
-        return json.load(f)
-
-
-def save_config(config):
-    """Save the maps configuration file."""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
-    print(f"Configuration saved to {CONFIG_FILE}")
+    return MapRegistry(CONFIG_FILE)
 
 
+def print_map(map_info):
+    print(f"  Path: {map_info['path']}")
+    print(f"  Origin: ({map_info['origin_lat']}, {map_info['origin_lon']})")
 
 
 def list_maps():
     """List all available maps."""
-    config = load_config()
-    current_map = config.get('current_map', 'unknown')
-    
+    registry = load_registry()
+    current_map, _ = registry.current()
+
     print("\n=== Available Maps ===\n")
-    
-    for key, map_info in config['maps'].items():
+
+    for key, map_info in registry.maps().items():
         current_marker = " (CURRENT)" if key == current_map else ""
         print(f"  {key}{current_marker}")
         print(f"    Name: {map_info['name']}")
@@ -59,60 +55,45 @@ def list_maps():
 
 def set_map(map_key):
     """Switch to the specified map."""
-    config = load_config()
-    
-    if map_key not in config['maps']:
+    registry = load_registry()
+    try:
+        map_info = registry.set_current(map_key)
+    except KeyError:
         print(f"Error: Map '{map_key}' not found in configuration.")
-        print(f"\nAvailable maps: {', '.join(config['maps'].keys())}")
+        print(f"\nAvailable maps: {', '.join(registry.maps().keys())}")
         sys.exit(1)
-    
-    map_info = config['maps'][map_key]
-    
-    # Update current map in config
-    config['current_map'] = map_key
-    save_config(config)
-    
+    print(f"Configuration saved to {CONFIG_FILE}")
+
     print(f"\n✓ Switched to map: {map_info['name']}")
-    print(f"  Path: {map_info['path']}")
-    print(f"  Origin: ({map_info['origin_lat']}, {map_info['origin_lon']})")
+    print_map(map_info)
+    print("\nRestart the API server (or use /map/switch) to apply it to a running server.")
 
 
 def show_current():
     """Show the current map configuration."""
-    config = load_config()
-    current_map = config.get('current_map', 'unknown')
-    
-    if current_map == 'unknown' or current_map not in config['maps']:
+    current_map, map_info = load_registry().current()
+
+    if map_info is None:
         print("No current map set or map not found in configuration.")
         return
-    
-    map_info = config['maps'][current_map]
-    
+
     print("\n=== Current Map Configuration ===\n")
     print(f"  Key: {current_map}")
     print(f"  Name: {map_info['name']}")
-    print(f"  Path: {map_info['path']}")
-    print(f"  Origin: ({map_info['origin_lat']}, {map_info['origin_lon']})")
+    print_map(map_info)
     print(f"  Description: {map_info['description']}")
     print()
 
 
 def add_map(key, path, lat, lon, name=None, description=None):
     """Add a new map to the configuration."""
-    config = load_config()
-    
-    if key in config['maps']:
+    registry = load_registry()
+
+    if key in registry.maps():
         print(f"Warning: Map '{key}' already exists. Overwriting...")
-    
-    config['maps'][key] = {
-        'name': name or key,
-        'path': path,
-        'origin_lat': float(lat),
-        'origin_lon': float(lon),
-        'description': description or f"Map {key}"
-    }
-    
-    save_config(config)
+
+    registry.add(key, path, lat, lon, name, description)
+    print(f"Configuration saved to {CONFIG_FILE}")
     print(f"\n✓ Added map: {key}")
 
 
@@ -120,22 +101,22 @@ def main():
     if len(sys.argv) < 2:
         print(__doc__)
         sys.exit(1)
-    
+
     command = sys.argv[1].lower()
-    
+
     if command == 'list':
         list_maps()
-    
+
     elif command == 'set':
         if len(sys.argv) < 3:
             print("Error: Please specify a map key")
             print("Usage: python switch_map.py set <map_key>")
             sys.exit(1)
         set_map(sys.argv[2])
-    
+
     elif command == 'current':
         show_current()
-    
+
     elif command == 'add':
         if len(sys.argv) < 6:
             print("Error: Insufficient arguments")
@@ -148,7 +129,7 @@ def main():
         name = sys.argv[6] if len(sys.argv) > 6 else None
         description = sys.argv[7] if len(sys.argv) > 7 else None
         add_map(key, path, lat, lon, name, description)
-    
+
     else:
         print(f"Error: Unknown command '{command}'")
         print(__doc__)
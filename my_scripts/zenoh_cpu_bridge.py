@@ -1,133 +1,279 @@
 #!/usr/bin/env python3
 """
-Bridge that publishes CPU usage to Zenoh using zenoh_ros_type serialization.
+Bridge that publishes vehicle telemetry to Zenoh using zenoh_ros_type serialization.
 
 This bridge:
-1. Reads CPU usage from psutil
-2. Creates zenoh_ros_type.tier4_autoware_msgs.CpuUsage messages
-3. Publishes directly to Zenoh (not ROS2)
+1. Samples CPU, memory, temperatures, disk and network usage from psutil
+2. Publishes the CPU usage as zenoh_ros_type.tier4_autoware_msgs.CpuUsage, the message the FMS reads
+3. Publishes the other metrics as JSON on <vehicle>/fms/system/<metric>, or all in one put on
+   <vehicle>/fms/system with --batch
 
-This bypasses the need for tier4_external_api_msgs and works with FMS directly.
+Sampling never blocks: CPU, disk and network figures are computed from the deltas of psutil's cumulative counters
+between two ticks, so the publish rate alone sets the pace. With --simulate N, the bridge publishes for N vehicles
+(sim0, sim1, ...) with per-vehicle variations of the local figures, to load test the FMS.
+
+Usage:
+    python3 zenoh_cpu_bridge.py --vehicle v1 --connect tcp/172.30.10.52:7887
+    python3 zenoh_cpu_bridge.py --rate 5 --batch
+    python3 zenoh_cpu_bridge.py --simulate 200 --rate 2 --batch
+
+The defaults come from FMS_BRIDGE_VEHICLE, FMS_BRIDGE_CONNECT and FMS_BRIDGE_RATE_HZ.
 """
 
+import argparse
 import json
-import psutil
-import time
+import os
+import random
 import sys
+import time
 
+import psutil
 import zenoh
 
 # Import the EXACT message types that FMS expects
-from zenoh_ros_type.tier4_autoware_msgs import CpuUsage, CpuStatus
 from zenoh_ros_type.rcl_interfaces import Time
+from zenoh_ros_type.tier4_autoware_msgs import CpuStatus, CpuUsage
+
+CPU_KEY_EXPR = '/api/external/get/cpu_usage'
+SYSTEM_KEY_EXPR = '/fms/system'
+METRICS = ('memory', 'temperatures', 'disk', 'network')
+# The 'telemetry' traffic class of zenoh_app/qos.py; this script runs on the vehicle, without the FMS package
+TELEMETRY_QOS = {'priority': zenoh.Priority.DATA, 'congestion_control': zenoh.CongestionControl.DROP}
+
+DEFAULT_VEHICLE = os.environ.get('FMS_BRIDGE_VEHICLE', 'v1')
+DEFAULT_CONNECT = os.environ.get('FMS_BRIDGE_CONNECT', 'tcp/172.30.10.52:7887')
+DEFAULT_RATE_HZ = float(os.environ.get('FMS_BRIDGE_RATE_HZ', 1))
+# Log a summary every this many ticks
+LOG_EVERY = 10
+MB = 1024 * 1024
+
+
+def cpu_percent(previous, current):
+    """user/nice/system/idle/total percentages of a CPU between two psutil.cpu_times() samples"""
+    delta = {field: max(0.0, getattr(current, field) - getattr(previous, field)) for field in current._fields}
+    # Linux already counts guest time in user and guest_nice in nice
+    elapsed = sum(value for field, value in delta.items() if field not in ('guest', 'guest_nice'))
+    if elapsed <= 0:
+        return {'total': 0.0, 'usr': 0.0, 'nice': 0.0, 'sys': 0.0, 'idle': 100.0}
+    idle = 100.0 * delta['idle'] / elapsed
+    return {
+        'total': 100.0 - idle,
+        'usr': 100.0 * delta['user'] / elapsed,
+        'nice': 100.0 * delta.get('nice', 0.0) / elapsed,
+        'sys': 100.0 * delta['system'] / elapsed,
+        'idle': idle,
+    }
+
+
+def rates(previous, current, elapsed, fields):
+    """Per-second rate of the given fields between two psutil counter samples"""
+    if previous is None or current is None or elapsed <= 0:
+        return {f'{field}_s': 0.0 for field in fields}
+    return {f'{field}_s': max(0, getattr(current, field) - getattr(previous, field)) / elapsed for field in fields}
+
+
+class SystemSampler:
+    """Samples the local system; counters are read without waiting and compared with the previous sample"""
+
+    def __init__(self, disk_path='/'):
+        self.disk_path = disk_path
+        self.time = time.monotonic()
+        self.cpu_all = psutil.cpu_times()
+        self.cpus = psutil.cpu_times(percpu=True)
+        self.disk_io = self._disk_io()
+        self.net_io = psutil.net_io_counters()
+
+    def _disk_io(self):
+        try:
+            return psutil.disk_io_counters()
+        except Exception:
+            return None
+
+    def _temperatures(self):
+        if not hasattr(psutil, 'sensors_temperatures'):
+            return {}
+        try:
+            sensors = psutil.sensors_temperatures()
+        except Exception:
+            return {}
+        return {
+            f'{name}/{entry.label or i}': entry.current
+            for name, entries in sensors.items()
+            for i, entry in enumerate(entries)
+        }
+
+    def sample(self):
+        now = time.monotonic()
+        elapsed = now - self.time
+        cpu_all = psutil.cpu_times()
+        cpus = psutil.cpu_times(percpu=True)
+        disk_io = self._disk_io()
+        net_io = psutil.net_io_counters()
+        memory = psutil.virtual_memory()
+        try:
+            disk_usage = psutil.disk_usage(self.disk_path).percent
+        except Exception:
+            disk_usage = None
+
+        sample = {
+            'cpu': {
+                'all': cpu_percent(self.cpu_all, cpu_all),
+                'cpus': [cpu_percent(previous, current) for previous, current in zip(self.cpus, cpus)],
+            },
+            'memory': {
+                'total_mb': memory.total / MB,
+                'used_mb': memory.used / MB,
+                'available_mb': memory.available / MB,
+                'percent': memory.percent,
+                'swap_percent': psutil.swap_memory().percent,
+            },
+            'temperatures': self._temperatures(),
+            'disk': dict(
+                rates(self.disk_io, disk_io, elapsed, ('read_bytes', 'write_bytes', 'read_count', 'write_count')),
+                usage_percent=disk_usage,
+            ),
+            'network': dict(
+                rates(self.net_io, net_io, elapsed, ('bytes_recv', 'bytes_sent', 'packets_recv', 'packets_sent')),
+                errors=net_io.errin + net_io.errout,
+                drops=net_io.dropin + net_io.dropout,
+            ),
+        }
+        self.time, self.cpu_all, self.cpus, self.disk_io, self.net_io = now, cpu_all, cpus, disk_io, net_io
+        return sample
+
+
+def vary(sample, rng):
+    """A copy of sample with the load figures of a simulated vehicle: scaled and jittered, kept in range"""
 
+    def cpu(status):
+        total = min(100.0, max(0.0, status['total'] * rng.uniform(0.5, 1.5) + rng.uniform(-5, 5)))
+        busy = status['usr'] + status['nice'] + status['sys'] or 1.0
+        scale = total / busy
+        return {'total': total, 'usr': status['usr'] * scale, 'nice': status['nice'] * scale, 'sys': status['sys'] * scale, 'idle': 100.0 - total}
 
-def create_cpu_usage_message():
+    varied = json.loads(json.dumps(sample))
+    varied['cpu'] = {'all': cpu(sample['cpu']['all']), 'cpus': [cpu(status) for status in sample['cpu']['cpus']]}
+    varied['memory']['percent'] = min(100.0, max(0.0, sample['memory']['percent'] + rng.uniform(-10, 10)))
+    varied['temperatures'] = {name: value + rng.uniform(-3, 3) for name, value in sample['temperatures'].items()}
+    for metric in ('disk', 'network'):
+        for field, value in sample[metric].items():
+            if field.endswith('_s'):
+                varied[metric][field] = value * rng.uniform(0.5, 1.5)
+    return varied
+
+
+def create_cpu_usage_message(cpu):
     """Create a CpuUsage message matching FMS expectations."""
-    
+
     # Get current time
     current_time = time.time()
     sec = int(current_time)
     nanosec = int((current_time - sec) * 1e9)
     stamp = Time(sec=sec, nanosec=nanosec)
-    
-    # Get per-CPU and aggregate CPU stats
-    cpu_times_percent = psutil.cpu_times_percent(interval=0.1, percpu=True)
-    cpu_times_all = psutil.cpu_times_percent(interval=0, percpu=False)
-    
-    # Create aggregate CpuStatus
-    all_cpu = CpuStatus(
-        status=0,  # STATUS_OK
-        total=float(100.0 - cpu_times_all.idle),
-        usr=float(cpu_times_all.user),
-        nice=float(cpu_times_all.nice if hasattr(cpu_times_all, 'nice') else 0.0),
-        sys=float(cpu_times_all.system),
-        idle=float(cpu_times_all.idle)
-    )
-    
-    # Create per-CPU CpuStatus list
-    cpus = []
-    for cpu_time in cpu_times_percent:
-        cpu_status = CpuStatus(
-            status=0,  # STATUS_OK
-            total=float(100.0 - cpu_time.idle),
-            usr=float(cpu_time.user),
-            nice=float(cpu_time.nice if hasattr(cpu_time, 'nice') else 0.0),
-            sys=float(cpu_time.system),
-            idle=float(cpu_time.idle)
-        )
-        cpus.append(cpu_status)
-    
-    # Create CpuUsage message
-    cpu_usage = CpuUsage(
-        stamp=stamp,
-        all=all_cpu,
-        cpus=cpus
-    )
-    
-    return cpu_usage
+
+    def status(percent):
+        # status 0 is STATUS_OK
+        return CpuStatus(status=0, **{field: float(value) for field, value in percent.items()})
+
+    return CpuUsage(stamp=stamp, all=status(cpu['all']), cpus=[status(percent) for percent in cpu['cpus']])
+
+
+class VehiclePublisher:
+    """Publishers of one (real or simulated) vehicle"""
+
+    def __init__(self, session, vehicle, batch):
+        self.vehicle = vehicle
+        self.batch = batch
+        self.cpu = session.declare_publisher(vehicle + CPU_KEY_EXPR, **TELEMETRY_QOS)
+        if batch:
+            self.system = {None: session.declare_publisher(vehicle + SYSTEM_KEY_EXPR, **TELEMETRY_QOS)}
+        else:
+            self.system = {metric: session.declare_publisher(f'{vehicle}{SYSTEM_KEY_EXPR}/{metric}', **TELEMETRY_QOS) for metric in METRICS}
+
+    def publish(self, sample):
+        """Publish a sample; return the number of zenoh puts"""
+        self.cpu.put(create_cpu_usage_message(sample['cpu']).serialize())
+        if self.batch:
+            self.system[None].put(json.dumps({metric: sample[metric] for metric in METRICS}, separators=(',', ':')))
+            return 2
+        for metric, publisher in self.system.items():
+            publisher.put(json.dumps(sample[metric], separators=(',', ':')))
+        return 1 + len(self.system)
+
+    def close(self):
+        self.cpu.undeclare()
+        for publisher in self.system.values():
+            publisher.undeclare()
 
 
 def main():
     """Main bridge loop."""
-    
-    # Configuration
-    vehicle_name = 'v1'  # Your vehicle name from Autoware
-    fms_endpoint = 'tcp/172.30.10.52:7887'  # FMS Zenoh endpoint
-    publish_key = f'{vehicle_name}/api/external/get/cpu_usage'
-    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicle', default=DEFAULT_VEHICLE, help='vehicle name (zenoh key prefix)')
+    parser.add_argument('--connect', default=DEFAULT_CONNECT, help='zenoh endpoint of the FMS')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE_HZ, help='publications per second')
+    parser.add_argument('--batch', action='store_true', help='publish memory, temperatures, disk and network in one put')
+    parser.add_argument('--simulate', type=int, default=0, metavar='N', help='publish for N simulated vehicles instead')
+    parser.add_argument('--prefix', default='sim', help='name prefix of the simulated vehicles')
+    parser.add_argument('--disk', default='/', help='path whose file system usage is reported')
+    args = parser.parse_args()
+
+    vehicles = [f'{args.prefix}{i}' for i in range(args.simulate)] if args.simulate > 0 else [args.vehicle]
+
     print(f"[Zenoh CPU Bridge] Starting...")
-    print(f"  Vehicle: {vehicle_name}")
-    print(f"  FMS Endpoint: {fms_endpoint}")
-    print(f"  Publishing to: {publish_key}")
+    print(f"  Vehicles: {', '.join(vehicles) if len(vehicles) <= 5 else f'{len(vehicles)} simulated ({vehicles[0]}...)'}")
+    print(f"  FMS Endpoint: {args.connect}")
+    print(f"  Rate: {args.rate} Hz, {'batched' if args.batch else 'one put per metric'}")
     print()
-    
+
     try:
         # Connect to Zenoh (as a peer connecting to FMS)
         conf = zenoh.Config()
-        endpoints = [fms_endpoint]
-        conf.insert_json5('connect/endpoints', json.dumps(endpoints))
-        
+        conf.insert_json5('connect/endpoints', json.dumps([args.connect]))
+
         session = zenoh.open(conf)
-        print(f"[Zenoh CPU Bridge] Connected to Zenoh at {fms_endpoint}")
-        
-        # Create publisher
-        publisher = session.declare_publisher(publish_key)
-        print(f"[Zenoh CPU Bridge] Publisher declared for: {publish_key}")
-        print(f"[Zenoh CPU Bridge] Starting to publish CPU usage...\n")
-        
-        # Publish loop
+        print(f"[Zenoh CPU Bridge] Connected to Zenoh at {args.connect}")
+
+        publishers = [VehiclePublisher(session, vehicle, args.batch) for vehicle in vehicles]
+        sampler = SystemSampler(args.disk)
+        # One random walk per simulated vehicle, reproducible between runs
+        generators = [random.Random(i) for i in range(len(vehicles))]
+        print(f"[Zenoh CPU Bridge] Starting to publish telemetry...\n")
+
+        period = 1.0 / args.rate
+        deadline = time.monotonic() + period
         iteration = 0
+        puts = 0
         while True:
             try:
-                # Create message
-                cpu_usage = create_cpu_usage_message()
-                
-                # Serialize to CDR format
-                payload = cpu_usage.serialize()
-                
-                # Publish
-                publisher.put(payload)
-                
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                deadline += period
+                sample = sampler.sample()
+                for publisher, rng in zip(publishers, generators):
+                    puts += publisher.publish(vary(sample, rng) if args.simulate > 0 else sample)
+
                 iteration += 1
-                if iteration % 10 == 0:  # Log every 10 iterations
-                    print(f"[{iteration}] Published CPU usage: all={cpu_usage.all.total:.1f}% "
-                          f"(usr={cpu_usage.all.usr:.1f}%, sys={cpu_usage.all.sys:.1f}%, idle={cpu_usage.all.idle:.1f}%), "
-                          f"cores={len(cpu_usage.cpus)}")
-                
-                time.sleep(1)
-                
+                if iteration % LOG_EVERY == 0:  # Log every LOG_EVERY iterations
+                    cpu = sample['cpu']['all']
+                    print(f"[{iteration}] Published telemetry of {len(publishers)} vehicle(s), {puts} puts: "
+                          f"cpu={cpu['total']:.1f}% (usr={cpu['usr']:.1f}%, sys={cpu['sys']:.1f}%), "
+                          f"mem={sample['memory']['percent']:.1f}%, "
+                          f"net rx={sample['network']['bytes_recv_s'] / 1024:.1f} KiB/s")
+                    puts = 0
+
             except KeyboardInterrupt:
                 break
             except Exception as e:
-                print(f"[ERROR] Failed to publish CPU usage: {e}")
-                time.sleep(1)
-        
+                print(f"[ERROR] Failed to publish telemetry: {e}")
+                # Do not catch up on the ticks missed meanwhile
+                deadline = time.monotonic() + period
+
         print("\n[Zenoh CPU Bridge] Shutting down...")
-        publisher.undeclare()
+        for publisher in publishers:
+            publisher.close()
         session.close()
         print("[Zenoh CPU Bridge] Closed")
-        
+
     except Exception as e:
         print(f"[FATAL ERROR] {e}")
         sys.exit(1)
@@ -1,9 +1,16 @@
+import logging
 import threading
+import time
 
 import numpy as np
 import zenoh
 from zenoh_ros_type.common_interfaces import Image
 
+from .log_pipeline import throttle
+from .metrics import CAMERA_FRAME_SECONDS, CAMERA_FRAMES
+
+logger = logging.getLogger(__name__)
+
 IMAGE_RAW_KEY_EXPR = '/sensing/camera/traffic_light/image_raw'
 
 # At 20 FPS, 10 frames represent 0.5 second of video data
@@ -59,15 +66,18 @@ class MJPEG_server:
                 if sample is None:
                     continue
 
+                start = time.perf_counter()
                 data = sample.payload.to_bytes()
 
                 # Each pixel is 4 bytes (RGBA), total bytes = Height x Width x 4.
                 # Extract the last part of the ROS message as image data.
                 np_image = np.frombuffer(data[-(self.height * self.width * 4) :], dtype=np.uint8)
                 self.camera_image = np_image.reshape((self.height, self.width, 4))
+                CAMERA_FRAMES.inc()
+                CAMERA_FRAME_SECONDS.observe(time.perf_counter() - start)
 
             except Exception as e:
-                print(f'Error processing frame: {e}')
+                logger.error(f'Error processing frame: {e}', extra=throttle(5))
 
 
 if __name__ == '__main__':
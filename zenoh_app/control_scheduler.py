@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_HZ = float(os.environ.get('FMS_CONTROL_RATE_HZ', 30))
+
+# Number of recent ticks kept for the jitter percentiles
+JITTER_WINDOW = 1000
+
+
+class ControlScheduler:
+    """
+    Tick every registered teleop controller from one thread at a fixed rate.
+
+    Ticks are scheduled against absolute deadlines (start + n * period), so the rate does not drift with the
+    time spent publishing. A tick that finishes after the next deadline counts as an overrun, and the missed
+    deadlines are skipped instead of being replayed in a burst.
+    """
+
+    def __init__(self, rate_hz=DEFAULT_RATE_HZ):
+        self.rate_hz = float(rate_hz)
+        self.period = 1.0 / self.rate_hz
+
+        self.controllers = {}
+        self.lock = Lock()
+        # Held while the controllers tick, so that unregister can wait for a tick in flight
+        self.tick_lock = Lock()
+        self.end_event = Event()
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_jitter = 0.0
+        self.max_tick_duration = 0.0
+        self.jitters = deque(maxlen=JITTER_WINDOW)
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def register(self, key, controller):
+        with self.lock:
+            self.controllers[key] = controller
+
+    def unregister(self, key):
+        """Remove a controller; once this returns, the scheduler does not tick it anymore"""
+        with self.lock:
+            controller = self.controllers.pop(key, None)
+        # The run loop may still be ticking it from the list it copied before
+        with self.tick_lock:
+            return controller
+
+    def stop(self):
+        self.end_event.set()
+        self.thread.join()
+
+    def run(self):
+        deadline = time.perf_counter()
+        while not self.end_event.is_set():
+            start = time.perf_counter()
+            jitter = start - deadline
+
+            with self.lock:
+                controllers = list(self.controllers.items())
+            with self.tick_lock:
+                for key, controller in controllers:
+                    try:
+                        controller.tick()
+                    except Exception as e:
+                        logger.error(f'Control tick failed for {key}: {e}')
+
+            end = time.perf_counter()
+            self.ticks += 1
+            self.jitters.append(jitter)
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.max_tick_duration = max(self.max_tick_duration, end - start)
+
+            deadline += self.period
+            if end > deadline:
+                ### Overrun: skip the deadlines we already missed
+                self.overruns += 1
+                missed = int((end - deadline) / self.period) + 1
+                self.skipped += missed
+                deadline += missed * self.period
+
+            self.end_event.wait(max(0.0, deadline - time.perf_counter()))
+
+    def stats(self):
+        jitters = sorted(self.jitters)
+
+        def percentile(p):
+            if not jitters:
+                return 0.0
+            return jitters[min(len(jitters) - 1, int(len(jitters) * p))]
+
+        with self.lock:
+            active = list(self.controllers.keys())
+        return {
+            'rate_hz': self.rate_hz,
+            'active': active,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter_ms': {
+                'p50': round(percentile(0.5) * 1000, 3),
+                'p99': round(percentile(0.99) * 1000, 3),
+                'max': round(self.max_jitter * 1000, 3),
+            },
+            'max_tick_ms': round(self.max_tick_duration * 1000, 3),
+        }
@@ -0,0 +1,96 @@
+"""
+Response encoding of the polling endpoints.
+
+JSON is encoded with orjson when it is installed; clients may ask for MessagePack or CBOR through the Accept
+header instead. Encoded bodies are cached per endpoint and media type together with the version of the state they
+were made from, so that polls between two state changes cost a dictionary lookup.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+
+# Accepted media type --> media type of the response
+MEDIA_TYPES = {JSON: JSON}
+if msgpack is not None:
+    MEDIA_TYPES.update({MSGPACK: MSGPACK, 'application/x-msgpack': MSGPACK})
+if cbor2 is not None:
+    MEDIA_TYPES[CBOR] = CBOR
+
+CACHE_SIZE = 1024
+
+
+def negotiate(accept):
+    """Media type to answer with for an Accept header, by order of preference; JSON unless a binary type comes first"""
+    if not accept:
+        return JSON
+    ranges = []
+    for i, part in enumerate(accept.split(',')):
+        media_type, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, i, media_type.strip().lower()))
+    for quality, _, media_type in sorted(ranges):
+        if quality < 0 and media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+    return JSON
+
+
+def encode(data, media_type=JSON):
+    if media_type == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    if media_type == CBOR:
+        return cbor2.dumps(data)
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+class EncodedCache:
+    """Encoded bodies by (key, media type), valid as long as the version they were made from"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version, media_type, produce):
+        """Cached body of key, or encode(produce()) when the version changed"""
+        cache_key = (key, media_type)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(cache_key)
+                return entry[1]
+        body = encode(produce(), media_type)
+        with self.lock:
+            self.entries[cache_key] = (version, body)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return body
@@ -0,0 +1,215 @@
+"""
+Fleet proximity and geofence monitor.
+
+On a fixed tick, the positions of every vehicle are gathered into arrays and checked in one pass of NumPy:
+pairs closer than the minimum distance (all pairs for small fleets, a uniform grid of cells for large ones) and
+containment in the geofences of GEOFENCE_FILE. Alerts are edge-triggered: an alert is raised when a condition
+starts and cleared when it ends, both logged and kept in a bounded list of recent events.
+
+Geofences file (JSON), lat/lon polygons; vehicles must stay inside at least one 'allowed' zone (if there is any)
+and outside every 'forbidden' zone:
+    {"zones": [{"name": "site", "type": "allowed", "polygon": [[35.238, 139.900], [35.239, 139.900], ...]}]}
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from .metrics import FLEET_ALERTS, FLEET_MONITOR_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+GEOFENCE_FILE = Path(os.environ.get('FMS_GEOFENCE_FILE', ROOT / 'my_scripts' / 'geofences.json'))
+DEFAULT_RATE_HZ = float(os.environ.get('FMS_MONITOR_RATE_HZ', 2))
+# Vehicles closer than this (m) raise a proximity alert
+DEFAULT_MIN_DISTANCE = float(os.environ.get('FMS_MIN_VEHICLE_DISTANCE', 5.0))
+# Above this many vehicles, pairs are searched in grid cells instead of the full distance matrix
+GRID_THRESHOLD = 256
+RECENT_ALERTS = 200
+
+
+def load_geofences(path=GEOFENCE_FILE):
+    """Return [(name, type, (n, 2) lat/lon array)], empty when the file does not exist"""
+    if not Path(path).exists():
+        return []
+    with open(path, 'r') as f:
+        zones = json.load(f).get('zones', [])
+    return [(zone['name'], zone.get('type', 'allowed'), np.asarray(zone['polygon'], dtype=np.float64)) for zone in zones]
+
+
+def close_pairs_dense(xy, min_distance):
+    """(i, j, distance) arrays of the pairs i < j closer than min_distance, from the full distance matrix"""
+    diff = xy[:, None, :] - xy[None, :, :]
+    dist = np.hypot(diff[..., 0], diff[..., 1])
+    i, j = np.triu_indices(len(xy), k=1)
+    close = dist[i, j] < min_distance
+    return i[close], j[close], dist[i, j][close]
+
+
+def close_pairs_grid(xy, min_distance):
+    """
+    Same as close_pairs_dense, only comparing the points of neighbouring cells of a min_distance grid.
+    Candidate pairs are expanded with repeat/cumsum over the sorted cell keys, without a Python loop per pair.
+    """
+    cells = np.floor(xy / min_distance).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    pairs_i, pairs_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour = keys + dx * width + dy
+            start = np.searchsorted(sorted_keys, neighbour, side='left')
+            count = np.searchsorted(sorted_keys, neighbour, side='right') - start
+            total = count.sum()
+            if total == 0:
+                continue
+            i = np.repeat(np.arange(len(xy)), count)
+            # Position of every candidate inside the range of its point
+            offset = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+            j = order[np.repeat(start, count) + offset]
+            keep = i < j
+            pairs_i.append(i[keep])
+            pairs_j.append(j[keep])
+    if not pairs_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    dist = np.hypot(*(xy[i] - xy[j]).T)
+    close = dist < min_distance
+    return i[close], j[close], dist[close]
+
+
+def points_in_polygon(points, polygon):
+    """Boolean array: which (lat, lon) points are inside the polygon (ray casting on all edges at once)"""
+    a = polygon
+    b = np.roll(polygon, -1, axis=0)
+    px = points[:, 0][:, None]
+    py = points[:, 1][:, None]
+    straddles = (a[:, 1] > py) != (b[:, 1] > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = a[:, 0] + (py - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    crossings = straddles & (px < x_cross)
+    return (crossings.sum(axis=1) % 2) == 1
+
+
+class FleetMonitor:
+    def __init__(self, pose_service, rate_hz=DEFAULT_RATE_HZ, min_distance=DEFAULT_MIN_DISTANCE, geofence_file=GEOFENCE_FILE):
+        self.pose_service = pose_service
+        self.period = 1.0 / rate_hz
+        self.min_distance = min_distance
+        self.geofences = load_geofences(geofence_file)
+
+        # alert key --> alert of the conditions in progress
+        self.active = {}
+        self.recent = deque(maxlen=RECENT_ALERTS)
+        self.lock = threading.Lock()
+        self.last_check_ms = 0.0
+
+        self.end_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.end_event.set()
+        self.thread.join()
+
+    def run(self):
+        deadline = time.perf_counter()
+        while not self.end_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f'Fleet monitor check failed: {e}')
+            deadline += self.period
+            self.end_event.wait(max(0.0, deadline - time.perf_counter()))
+
+    def positions(self):
+        """Scopes, map (x, y) array and (lat, lon) array of the vehicles that reported a position"""
+        # One read of the slot per vehicle, so that xy and latlon come from the same sample
+        poses = [(scope, v.pose) for scope, v in list(self.pose_service.vehicles.items()) if v is not None]
+        poses = [(scope, pose) for scope, pose in poses if pose is not None]
+        scopes = [scope for scope, _ in poses]
+        xy = np.array([(pose.x, pose.y) for _, pose in poses], dtype=np.float64).reshape(-1, 2)
+        latlon = np.array([(pose.lat, pose.lon) for _, pose in poses], dtype=np.float64).reshape(-1, 2)
+        return scopes, xy, latlon
+
+    def check(self):
+        start = time.perf_counter()
+        scopes, xy, latlon = self.positions()
+        conditions = {}
+
+        if len(scopes) > 1:
+            pairs = close_pairs_grid if len(scopes) > GRID_THRESHOLD else close_pairs_dense
+            for i, j, dist in zip(*pairs(xy, self.min_distance)):
+                a, b = sorted((scopes[i], scopes[j]))
+                conditions[('proximity', a, b)] = {
+                    'kind': 'proximity',
+                    'vehicles': [a, b],
+                    'message': f'{a} and {b} are {dist:.1f} m apart',
+                }
+
+        if self.geofences and scopes:
+            allowed = np.zeros(len(scopes), dtype=bool)
+            has_allowed = False
+            for name, kind, polygon in self.geofences:
+                inside = points_in_polygon(latlon, polygon)
+                if kind == 'allowed':
+                    has_allowed = True
+                    allowed |= inside
+                else:
+                    for i in np.flatnonzero(inside):
+                        conditions[('geofence', scopes[i], name)] = {
+                            'kind': 'geofence',
+                            'vehicles': [scopes[i]],
+                            'message': f'{scopes[i]} entered forbidden zone {name}',
+                        }
+            if has_allowed:
+                for i in np.flatnonzero(~allowed):
+                    conditions[('geofence', scopes[i], None)] = {
+                        'kind': 'geofence',
+                        'vehicles': [scopes[i]],
+                        'message': f'{scopes[i]} left the allowed zones',
+                    }
+
+        self.update(conditions)
+        self.last_check_ms = (time.perf_counter() - start) * 1000
+        FLEET_MONITOR_SECONDS.observe(self.last_check_ms / 1000)
+
+    def update(self, conditions):
+        now = time.time()
+        with self.lock:
+            for key in list(self.active):
+                if key not in conditions:
+                    alert = self.active.pop(key)
+                    self.recent.append(dict(alert, state='cleared', time=now))
+                    logger.info(f'Alert cleared: {alert["message"]}')
+            for key, alert in conditions.items():
+                if key in self.active:
+                    # Keep the raise time, refresh the message (e.g. the distance)
+                    self.active[key]['message'] = alert['message']
+                    continue
+                alert = dict(alert, state='raised', since=now)
+                self.active[key] = alert
+                self.recent.append(dict(alert, time=now))
+                FLEET_ALERTS.labels(alert['kind']).inc()
+                logger.warning(f'Alert raised: {alert["message"]}')
+
+    def alerts(self):
+        with self.lock:
+            return {
+                'active': [dict(alert) for alert in self.active.values()],
+                'recent': list(self.recent),
+                'last_check_ms': round(self.last_check_ms, 3),
+            }
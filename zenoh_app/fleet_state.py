@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+from pathlib import Path
+
+from . import status_autoware, telemetry_history, telemetry_table, versions
+from .control_scheduler import ControlScheduler
+from .fleet_monitor import FleetMonitor
+from .list_autoware import list_autoware
+from .metrics import JPEG_ENCODE_SECONDS
+from .pose_service import PoseServer
+from .teleop_autoware import ManualController
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TELEOP_NOT_STARTED = 'Please startup the teleop first'
+
+
+class FleetState:
+    """
+    Owner of all live fleet state: the zenoh session, the vehicle poses and status, and the teleop controllers.
+
+    The API server uses it directly in single-process mode. With several workers, the ingest process owns the
+    FleetState and shares it through a state hub (see state_hub.py), whose HubClient has the same interface.
+    """
+
+    def __init__(self, session, use_bridge_ros2dds=True, video_session=None):
+        self.session = session
+        # Camera frames may travel on a session of their own, see qos.open_video_session
+        self.video_session = video_session or session
+        self.use_bridge_ros2dds = use_bridge_ros2dds
+        self.epoch = versions.BOOT_ID
+        # Let other local processes read the fleet telemetry straight from shared memory
+        telemetry_table.create()
+        self.control_scheduler = ControlScheduler()
+        self.pose_service = PoseServer(session, use_bridge_ros2dds)
+        self.fleet_monitor = FleetMonitor(self.pose_service)
+        # scope --> ManualController of every vehicle under teleop
+        self.manual_controllers = {}
+        # The vehicle started last, used by clients that do not pass a scope
+        self.teleop_scope = None
+        self.mjpeg_server = None
+        self.map_ready = False
+        # Last encoded frame, shared by every viewer until the camera delivers a new one
+        self.jpeg_source = None
+        self.jpeg_frame_bytes = None
+
+    def version(self, kind, scope=None):
+        """Change counter of a part of the state: 'pose', 'goal', 'teleop', or 'status' of a scope"""
+        return versions.get(kind if scope is None else (kind, scope))
+
+    def close(self):
+        for manual_controller in self.manual_controllers.values():
+            manual_controller.stop_teleop()
+        self.manual_controllers.clear()
+        self.control_scheduler.stop()
+        self.fleet_monitor.stop()
+        self.pose_service.close()
+        telemetry_table.close()
+
+    ### Map
+    def apply_map(self, map_info):
+        if not map_info:
+            return
+        origin_lat = map_info['origin_lat']
+        origin_lon = map_info['origin_lon']
+        map_path = ROOT / 'frontend' / 'public' / map_info['path'].lstrip('/')
+        os.environ['REACT_APP_MAP_ORIGIN_LAT'] = str(origin_lat)
+        os.environ['REACT_APP_MAP_ORIGIN_LON'] = str(origin_lon)
+        os.environ['REACT_APP_MAP_FILE_PATH'] = map_info['path']
+        self.pose_service.update_map(str(map_path), origin_lat, origin_lon)
+
+    def preload_map(self):
+        self.pose_service.preload_map()
+        self.map_ready = True
+
+    ### Vehicles
+    def list_autoware(self):
+        return list_autoware(self.session, self.use_bridge_ros2dds)
+
+    def status(self, scope):
+        return {
+            'cpu': status_autoware.get_cpu_status(self.session, scope, self.use_bridge_ros2dds),
+            'vehicle': status_autoware.get_vehicle_status(self.session, scope, self.use_bridge_ros2dds),
+        }
+
+    def status_history(self, scope, res=telemetry_history.DEFAULT_RESOLUTION, since=None):
+        return telemetry_history.query(scope, res, since)
+
+    def status_scopes(self):
+        return list(status_autoware.ACTIVE_SUBSCRIBERS.keys())
+
+    def find_vehicles(self):
+        self.pose_service.findVehicles()
+        return self.vehicles()
+
+    def vehicles(self):
+        return list(self.pose_service.vehicles.keys())
+
+    def pose(self):
+        return self.pose_service.returnPose()
+
+    def goal_pose(self):
+        return self.pose_service.returnGoalPose()
+
+    def set_goal(self, scope, lat, lon, snap=False):
+        self.pose_service.setGoal(scope, lat, lon, snap)
+
+    def snap_goals(self, points):
+        return self.pose_service.snapGoals(points)
+
+    def route_preview(self, scope, lat, lon):
+        return self.pose_service.previewRoute(scope, lat, lon)
+
+    def engage(self, scope):
+        self.pose_service.engage(scope)
+
+    def set_goals(self, goals, snap=False):
+        return self.pose_service.setGoals(goals, snap)
+
+    def engage_all(self, scopes):
+        return self.pose_service.engageAll(scopes)
+
+    ### Teleop
+    def teleop_startup(self, scope):
+        from .camera_autoware import MJPEG_server
+
+        if scope in self.manual_controllers:
+            self.manual_controllers.pop(scope).stop_teleop()
+        self.manual_controllers[scope] = ManualController(self.session, scope, self.use_bridge_ros2dds, scheduler=self.control_scheduler)
+        self.teleop_scope = scope
+        versions.bump('teleop')
+
+        if self.mjpeg_server is not None:
+            self.mjpeg_server.change_vehicle(scope)
+        else:
+            self.mjpeg_server = MJPEG_server(self.video_session, scope, self.use_bridge_ros2dds)
+
+    def teleop_stop(self, scope):
+        manual_controller = self.manual_controllers.pop(scope, None)
+        if manual_controller is None:
+            return f'{scope} is not under teleop.'
+        manual_controller.stop_teleop()
+        if self.teleop_scope == scope:
+            self.teleop_scope = next(iter(self.manual_controllers), None)
+        versions.bump('teleop')
+        return f'Stop manual control on {scope}.'
+
+    def teleop_gear(self, scope, gear):
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is None:
+            return TELEOP_NOT_STARTED
+        manual_controller.pub_gear(gear)
+        return f'Set gear {gear} to {scope}.'
+
+    def teleop_velocity(self, scope, velocity):
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is None:
+            return TELEOP_NOT_STARTED
+        manual_controller.update_control_command(float(velocity) * 1000 / 3600, None)
+        return f'Set speed {velocity} to {scope}.'
+
+    def teleop_turn(self, scope, angle):
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is None:
+            return TELEOP_NOT_STARTED
+        manual_controller.update_control_command(None, float(angle) * math.pi / 180)
+        return f'Set steering angle {angle}.'
+
+    def teleop_input(self, scope, message):
+        """
+        Apply one teleop WebSocket message {"steering": deg, "velocity": km/h, "gear": name}, all optional.
+        Returns an error string, or None.
+        """
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is None:
+            return TELEOP_NOT_STARTED
+        manual_controller.feed_deadman()
+        velocity = message.get('velocity')
+        angle = message.get('steering')
+        manual_controller.update_control_command(
+            None if velocity is None else float(velocity) * 1000 / 3600,
+            None if angle is None else float(angle) * math.pi / 180,
+        )
+        if message.get('gear'):
+            try:
+                manual_controller.pub_gear(message['gear'])
+            except KeyError:
+                return f'Unknown gear {message["gear"]}'
+        return None
+
+    def teleop_attach(self, scope, deadman_timeout):
+        """Arm the deadman of a controller for one more client; returns the token for teleop_detach, or None if the vehicle is not under teleop"""
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is None:
+            return None
+        return manual_controller.attach_client(deadman_timeout)
+
+    def teleop_detach(self, scope, token):
+        """Detach a client; the deadman is disarmed and the targets zeroed once no client is attached anymore"""
+        manual_controller = self.manual_controllers.get(scope)
+        if manual_controller is not None:
+            manual_controller.detach_client(token)
+
+    def teleop_status(self, scope=None):
+        manual_controller = self.manual_controllers.get(scope or self.teleop_scope)
+        if manual_controller is None:
+            return {'velocity': '---', 'gear': '---', 'steering': '---'}
+        return {
+            'velocity': round(manual_controller.current_velocity * 3600 / 1000, 2),
+            'gear': manual_controller.current_gear,
+            'steering': manual_controller.current_steer * 180 / math.pi,
+            'deadman': manual_controller.deadman_tripped,
+        }
+
+    def scheduler_stats(self):
+        return self.control_scheduler.stats()
+
+    def alerts(self):
+        return self.fleet_monitor.alerts()
+
+    def jpeg_frame(self):
+        """Latest camera frame of the teleop vehicle as JPEG bytes, or None"""
+        if self.mjpeg_server is None or self.mjpeg_server.camera_image is None:
+            return None
+        image = self.mjpeg_server.camera_image
+        if image is not self.jpeg_source:
+            import cv2
+
+            with JPEG_ENCODE_SECONDS.time():
+                _, buffer = cv2.imencode('.jpg', image)
+            self.jpeg_frame_bytes = buffer.tobytes()
+            self.jpeg_source = image
+        return self.jpeg_frame_bytes
+
+    def snapshot(self):
+        """Everything the read endpoints serve, as plain data"""
+        # Versions first, so that the data is never older than the version it is served under
+        scopes = self.status_scopes()
+        versions_ = {
+            'pose': self.version('pose'),
+            'goal': self.version('goal'),
+            'teleop': self.version('teleop'),
+            'status': {scope: self.version('status', scope) for scope in scopes},
+        }
+        return {
+            'versions': versions_,
+            'vehicles': self.vehicles(),
+            'pose': self.pose(),
+            'goalPose': self.goal_pose(),
+            'status': {scope: self.status(scope) for scope in scopes},
+            'teleop': {scope: self.teleop_status(scope) for scope in list(self.manual_controllers)},
+            'teleop_scope': self.teleop_scope,
+            'scheduler': self.scheduler_stats(),
+            'alerts': self.alerts(),
+            'map_ready': self.map_ready,
+            'epoch': self.epoch,
+        }
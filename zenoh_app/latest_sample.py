@@ -0,0 +1,49 @@
+"""
+Latest-value slots for telemetry topics.
+
+The subscriber callback only keeps a reference to the payload of the newest sample; it is deserialized when a
+reader asks for the value, and the result is cached until the next sample. A 50 Hz topic read once a second is
+then decoded once a second instead of 50 times, and samples nobody read in between are never decoded.
+"""
+
+import threading
+
+from .metrics import ZENOH_DECODES
+
+
+class LatestSample:
+    def __init__(self, topic, decode):
+        """decode(payload bytes) --> value, called on read for the newest sample only"""
+        self.decode = decode
+        self.decodes = ZENOH_DECODES.labels(topic)
+        # (sequence number, payload), replaced as a whole so that readers never see a torn pair
+        self.latest = (0, None)
+        self.decoded_seq = 0
+        self.value = None
+        self.lock = threading.Lock()
+
+    @property
+    def seq(self):
+        """Number of samples received, 0 until the first one"""
+        return self.latest[0]
+
+    def put(self, sample):
+        """Subscriber callback: keep the payload, do not decode it"""
+        self.latest = (self.latest[0] + 1, sample.payload)
+
+    def get(self, default=None):
+        """Value of the newest sample, default until the first sample arrived; raises what decode raises"""
+        seq, payload = self.latest
+        if seq != self.decoded_seq:
+            with self.lock:
+                if seq != self.decoded_seq:
+                    # A sample that fails to decode is not retried, readers keep the previous value
+                    self.decoded_seq = seq
+                    self.decodes.inc()
+                    self.value = self.decode(payload.to_bytes())
+        return default if self.value is None else self.value
+
+    def invalidate(self):
+        """Decode the newest sample again on the next read, e.g. after decode changed"""
+        with self.lock:
+            self.decoded_seq = -1 if self.latest[0] else 0
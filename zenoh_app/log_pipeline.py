@@ -0,0 +1,132 @@
+"""
+Non-blocking logging for the zenoh callbacks and the event loop.
+
+setup() puts a QueueHandler on the root logger: a log call only enqueues the record, and a background
+QueueListener formats and writes it to the console and the log file. Noisy call sites opt into rate limiting by
+passing extra=throttle(seconds) (at most one record per interval, with a count of the suppressed ones) or
+extra=sample(n) (one record out of n). Call sites are told apart by file and line, so one throttled line does not
+silence the others.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+QUEUE_SIZE = 10000
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def throttle(seconds):
+    """extra= of a call site that logs at most once every seconds"""
+    return {'throttle': seconds}
+
+
+def sample(n):
+    """extra= of a call site that logs one call out of n"""
+    return {'sample': n}
+
+
+class CallSiteLimiter(logging.Filter):
+    """Applies the throttle/sample of the records that carry one, per (file, line)"""
+
+    def __init__(self):
+        super().__init__()
+        # (pathname, lineno) --> [time of the last record let through, calls since, suppressed since]
+        self.sites = {}
+
+    def filter(self, record):
+        seconds = getattr(record, 'throttle', None)
+        every = getattr(record, 'sample', None)
+        if seconds is None and every is None:
+            return True
+        site = self.sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self.sites[(record.pathname, record.lineno)] = [0.0, 0, 0]
+        site[1] += 1
+        now = time.monotonic()
+        if seconds is not None and now - site[0] < seconds:
+            site[2] += 1
+            return False
+        if every is not None and (site[1] - 1) % every:
+            site[2] += 1
+            return False
+        if site[2]:
+            record.msg = f'{record.getMessage()} ({site[2]} similar messages suppressed)'
+            record.args = None
+        site[0] = now
+        site[2] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records rather than block the caller when the writer falls behind"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue stays in the process: leave the formatting to the writer thread, with the record untouched
+        # for formatters that read its args (uvicorn's access log)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _start(handlers):
+    log_queue = queue.Queue(QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(CallSiteLimiter())
+    return handler
+
+
+def setup(level=logging.INFO, log_file=None, fmt=FORMAT):
+    """Route the root logger through the queue, to stderr and optionally log_file; only the first call counts"""
+    with _lock:
+        root = logging.getLogger()
+        if any(isinstance(handler, DroppingQueueHandler) for handler in root.handlers):
+            return
+        formatter = logging.Formatter(fmt)
+        handlers = [logging.StreamHandler()]
+        if log_file is not None:
+            handlers.append(logging.FileHandler(log_file, mode='a'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_start(handlers))
+        root.setLevel(level)
+        if len(_listeners) == 1:
+            atexit.register(stop)
+
+
+def detach(name):
+    """Move the handlers already configured on logger name (e.g. by uvicorn) behind a queue of their own"""
+    with _lock:
+        logger = logging.getLogger(name)
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, DroppingQueueHandler)]
+        if not handlers:
+            return
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(_start(handlers))
+
+
+def stop():
+    """Flush and stop the writers"""
+    with _lock:
+        while _listeners:
+            _listeners.pop().stop()
@@ -1,17 +1,35 @@
+import logging
 import math
 import os
 
 import lanelet2
 import numpy as np
-
-# from lanelet2.core import BasicPoint3d, GPSPoint
-import lanelet2
-import numpy as np
-
+from lanelet2.core import BasicPoint2d, Point3d
+from lanelet2.geometry import distance, findNearest, inside, length2d, to2D, toArcCoordinates
 from lanelet2.io import Origin
 from lanelet2.projection import UtmProjector
-from lanelet2.core import Point3d
-from lanelet2.geometry import distance
+from lanelet2.routing import RoutingGraph
+from lanelet2.traffic_rules import Locations, Participants
+from lanelet2.traffic_rules import create as create_traffic_rules
+from scipy.spatial import cKDTree
+
+from .metrics import ORIENTATION_LOOKUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Goals farther than this from every lanelet (m) cannot be routed to
+ROUTE_MAX_GOAL_DISTANCE = 10.0
+# Vehicles farther than this from every lanelet (m), e.g. in a depot, are not routed from
+ROUTE_MAX_START_DISTANCE = 10.0
+# Lanelets at most this much farther (m) than the nearest one are matched too, e.g. overlapping lanelets at
+# intersections and merges, which are all at distance 0
+ROUTE_MATCH_TOLERANCE = 0.5
+# Lanelets looked up around a start or goal point
+ROUTE_MATCH_CANDIDATES = 8
+# Spacing of the centerline samples indexed for goal snapping (m)
+SNAP_SAMPLE_SPACING = 0.5
+# Goals are not snapped by more than this (m)
+SNAP_MAX_DISTANCE = ROUTE_MAX_GOAL_DISTANCE
 
 
 def proj_between(p1, p2, p3):
@@ -37,17 +55,23 @@ def vec2degree(v1, v2):
 
 
 class OrientationParser:
-    def __init__(
-        self,
-        path=f'frontend/public{os.environ["REACT_APP_MAP_FILE_PATH"]}',
-        originX=os.environ['REACT_APP_MAP_ORIGIN_LAT'],
-        originY=os.environ['REACT_APP_MAP_ORIGIN_LON'],
-    ):
+    def __init__(self, path=None, originX=None, originY=None):
+        # Default to the map selected through the REACT_APP_MAP_* environment variables
+        if path is None:
+            path = f'frontend/public{os.environ["REACT_APP_MAP_FILE_PATH"]}'
+        if originX is None:
+            originX = os.environ['REACT_APP_MAP_ORIGIN_LAT']
+        if originY is None:
+            originY = os.environ['REACT_APP_MAP_ORIGIN_LON']
         self.mapPath = path
         self.proj = UtmProjector(Origin(float(originX), float(originY)))
         self.vmap = lanelet2.io.load(path, self.proj)
         self.points = {}
         self.ways = {}
+        self.routingGraph = None
+        self.centerlineIndex = None
+        # lanelet id --> (lanelet, centerline 2d, ids of the following and adjacent lanelets), filled by matchPose
+        self.matchCandidates = {}
         self.initialize()
 
     def initialize(self):
@@ -57,6 +81,7 @@ class OrientationParser:
         for line in self.vmap.lineStringLayer:
             self.ways[line.id] = [point for point in line]
 
+    @ORIENTATION_LOOKUP_SECONDS.timed
     def genQuaternion_seg(self, x, y):
         """
         Find the closest lanelet and return quaternion based on lane direction.
@@ -108,27 +133,238 @@ class OrientationParser:
                 closest_yaw = lanelet_best_yaw
 
         except Exception as e:
-            print(f"Error finding lanelet: {e}")
+            logger.error(f"Error finding lanelet: {e}")
             return [0, 0, 0, 1]
         
         if closest_lanelet is None:
-            print("No lanelet found")
+            logger.warning("No lanelet found")
             return [0, 0, 0, 1]
         
         # Step 2: Use the direction of the closest lane segment
         try:
             if closest_yaw is None:
-                print("No valid lanelet segment found")
+                logger.warning("No valid lanelet segment found")
                 return [0, 0, 0, 1]
 
-            print(f"Lanelet {closest_lanelet.id}, yaw: {closest_yaw:.2f} rad, distance: {closest_distance:.2f}")
+            logger.debug(f"Lanelet {closest_lanelet.id}, yaw: {closest_yaw:.2f} rad, distance: {closest_distance:.2f}")
 
             return [0, 0, math.sin(closest_yaw / 2), math.cos(closest_yaw / 2)]
 
         except Exception as e:
-            print(f"Error generating quaternion: {e}")
+            logger.error(f"Error generating quaternion: {e}")
             return [0, 0, 0, 1]
 
+    def getRoutingGraph(self):
+        """Routing graph of the map, built on first use and kept with the parsed map"""
+        if self.routingGraph is None:
+            rules = create_traffic_rules(Locations.Germany, Participants.Vehicle)
+            self.routingGraph = RoutingGraph(self.vmap, rules)
+        return self.routingGraph
+
+    def getCenterlineIndex(self):
+        """KD-tree over the lanelet centerlines, built on first use and kept with the parsed map"""
+        if self.centerlineIndex is None:
+            self.centerlineIndex = CenterlineIndex(self.vmap.laneletLayer)
+        return self.centerlineIndex
+
+    def _matchCandidate(self, lanelet_id):
+        candidate = self.matchCandidates.get(lanelet_id)
+        if candidate is None:
+            lanelet = self.vmap.laneletLayer.get(lanelet_id)
+            graph = self.getRoutingGraph()
+            neighbours = [following.id for following in graph.following(lanelet)]
+            for side in (graph.left(lanelet), graph.right(lanelet)):
+                if side is not None:
+                    neighbours.append(side.id)
+            candidate = (lanelet, to2D(lanelet.centerline), neighbours)
+            self.matchCandidates[lanelet_id] = candidate
+        return candidate
+
+    def matchPose(self, x, y, previous=None):
+        """
+        Lanelet of a vehicle at (x, y), given the lanelet it was matched to before.
+        The previous lanelet, then its following and adjacent lanelets are tried first, so the cost of a match does
+        not depend on the map size; the centerline KD-tree is only queried when the vehicle left all of them.
+        Returns (lanelet id, arc length along the centerline in m) or None when the vehicle is off the lanelets.
+        """
+        point = BasicPoint2d(x, y)
+        if previous is not None:
+            _, _, neighbours = self._matchCandidate(previous)
+            for candidate_id in [previous] + neighbours:
+                lanelet, centerline, _ = self._matchCandidate(candidate_id)
+                if inside(lanelet, point):
+                    return candidate_id, max(0.0, toArcCoordinates(centerline, point).length)
+        _, _, lanelet_id, _, moved = self.getCenterlineIndex().snap([(x, y)])[0]
+        if moved > ROUTE_MAX_START_DISTANCE:
+            return None
+        _, centerline, _ = self._matchCandidate(lanelet_id)
+        return lanelet_id, max(0.0, toArcCoordinates(centerline, point).length)
+
+    def nearestLanelets(self, x, y, tolerance=ROUTE_MATCH_TOLERANCE):
+        """
+        Lanelets at most tolerance m farther from (x, y) than the nearest one, closest first, as
+        (lanelet, distance in m, arc length of the projection on its centerline); empty on empty maps.
+        """
+        point = BasicPoint2d(x, y)
+        nearest = findNearest(self.vmap.laneletLayer, point, ROUTE_MATCH_CANDIDATES)
+        if not nearest:
+            return []
+        limit = nearest[0][0] + tolerance
+        matched = []
+        for dist, lanelet in nearest:
+            if dist > limit:
+                break
+            arc = toArcCoordinates(to2D(lanelet.centerline), point).length
+            matched.append((lanelet, dist, min(max(arc, 0.0), length2d(lanelet))))
+        return matched
+
+    def nearestLanelet(self, x, y):
+        """Return (lanelet, distance in m, arc length of the projection on its centerline), or None on empty maps"""
+        matched = self.nearestLanelets(x, y)
+        return matched[0] if matched else None
+
+    def matchGoal(self, x, y):
+        """nearestLanelets of a goal; raises ValueError when it is too far from every lanelet"""
+        matched = self.nearestLanelets(x, y)
+        if not matched:
+            raise ValueError('The map has no lanelet')
+        if matched[0][1] > ROUTE_MAX_GOAL_DISTANCE:
+            raise ValueError(f'Goal is {matched[0][1]:.1f} m away from the nearest lanelet')
+        return matched
+
+    def _lanelet_path(self, start_lanelet, start_arc, goal_lanelet, goal_arc):
+        """Shortest lanelet sequence from a point on start_lanelet to a point on goal_lanelet, or None"""
+        graph = self.getRoutingGraph()
+        if start_lanelet.id == goal_lanelet.id and goal_arc >= start_arc:
+            return [start_lanelet]
+        # A goal behind the vehicle on its own lanelet needs a loop, through one of the following lanelets
+        candidates = [[start_lanelet] + list(graph.shortestPath(following, goal_lanelet) or []) for following in graph.following(start_lanelet)]
+        if start_lanelet.id != goal_lanelet.id:
+            candidates.append(list(graph.shortestPath(start_lanelet, goal_lanelet) or []))
+        candidates = [c for c in candidates if len(c) > 1 and c[-1].id == goal_lanelet.id]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: sum(length2d(lanelet) for lanelet in c))
+
+    def shortestRoute(self, start, goal):
+        """
+        Shortest path from start to goal, both (x, y) in map coordinates.
+        Where lanelets overlap, every lanelet matched at the start and at the goal is tried.
+        Returns {'lanelets', 'length', 'points'}, None when start is not on a lanelet, or raises ValueError when the
+        goal cannot be reached.
+        """
+        goals = self.matchGoal(*goal)
+        starts = self.nearestLanelets(*start)
+        if not starts or starts[0][1] > ROUTE_MAX_START_DISTANCE:
+            return None
+
+        best = None
+        for start_lanelet, _, start_arc in starts:
+            for goal_lanelet, _, goal_arc in goals:
+                path = self._lanelet_path(start_lanelet, start_arc, goal_lanelet, goal_arc)
+                if path is None:
+                    continue
+                length = sum(length2d(lanelet) for lanelet in path) - start_arc - (length2d(path[-1]) - goal_arc)
+                if best is None or length < best[0]:
+                    best = (length, path, start_arc, goal_arc)
+        if best is None:
+            start_ids = ', '.join(str(lanelet.id) for lanelet, _, _ in starts)
+            goal_ids = ', '.join(str(lanelet.id) for lanelet, _, _ in goals)
+            raise ValueError(f'No route from lanelet {start_ids} to lanelet {goal_ids}')
+        length, path, start_arc, goal_arc = best
+
+        points = []
+        for i, lanelet in enumerate(path):
+            begin = start_arc if i == 0 else None
+            end = goal_arc if i == len(path) - 1 else None
+            for point in centerline_slice(lanelet, begin, end):
+                # Consecutive lanelets share their boundary point
+                if not points or point != points[-1]:
+                    points.append(point)
+        return {'lanelets': [lanelet.id for lanelet in path], 'length': length, 'points': points}
+
+
+class CenterlineIndex:
+    """
+    Points sampled every SNAP_SAMPLE_SPACING along every lanelet centerline, in a KD-tree.
+    A query is snapped to the nearest sample, then projected on the centerline segments around it.
+    """
+
+    def __init__(self, lanelets, spacing=SNAP_SAMPLE_SPACING):
+        xy, ids, yaws = [], [], []
+        for lanelet in lanelets:
+            centerline = np.array([(p.x, p.y) for p in lanelet.centerline], dtype=np.float64)
+            # Degenerate centerlines (one point, or repeated points only) have no segment to take a heading from
+            if len(centerline) < 2 or not (np.diff(centerline, axis=0) != 0).any():
+                continue
+            for p1, p2 in zip(centerline[:-1], centerline[1:]):
+                seg = np.linalg.norm(p2 - p1)
+                if seg == 0:
+                    continue
+                steps = max(1, int(math.ceil(seg / spacing)))
+                t = np.arange(steps)[:, None] / steps
+                xy.append(p1 + (p2 - p1) * t)
+                ids.append(np.full(steps, lanelet.id, dtype=np.int64))
+                yaws.append(np.full(steps, math.atan2(p2[1] - p1[1], p2[0] - p1[0])))
+            # Close the centerline with its last point, heading like the last segment
+            xy.append(centerline[-1:])
+            ids.append(np.array([lanelet.id], dtype=np.int64))
+            yaws.append(yaws[-1][-1:])
+        self.xy = np.concatenate(xy) if xy else np.zeros((0, 2))
+        self.ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        self.yaws = np.concatenate(yaws) if yaws else np.zeros(0)
+        self.tree = cKDTree(self.xy) if len(self.xy) else None
+
+    def snap(self, points):
+        """
+        Snap (x, y) points in map coordinates to the nearest centerline.
+        Returns one (x, y, lanelet id, yaw in rad, distance moved in m) per point.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.tree is None:
+            raise ValueError('The map has no lanelet')
+        _, nearest = self.tree.query(points)
+        results = []
+        for point, i in zip(points, nearest):
+            best = (self.xy[i], self.yaws[i])
+            best_distance = np.linalg.norm(point - self.xy[i])
+            # Refine on the two segments between the neighbouring samples of the same lanelet
+            for j, k in ((i - 1, i), (i, i + 1)):
+                if j < 0 or k >= len(self.xy) or self.ids[j] != self.ids[k]:
+                    continue
+                p1, p2 = self.xy[j], self.xy[k]
+                seg = p2 - p1
+                length = seg.dot(seg)
+                if length == 0:
+                    continue
+                t = min(1.0, max(0.0, (point - p1).dot(seg) / length))
+                projected = p1 + seg * t
+                distance = np.linalg.norm(point - projected)
+                if distance < best_distance:
+                    best, best_distance = (projected, self.yaws[j]), distance
+            (x, y), yaw = best
+            results.append((float(x), float(y), int(self.ids[i]), float(yaw), float(best_distance)))
+        return results
+
+
+def centerline_slice(lanelet, begin=None, end=None):
+    """(x, y) points of a lanelet centerline between two arc lengths, interpolating at both ends"""
+    centerline = [(p.x, p.y) for p in lanelet.centerline]
+    begin = 0.0 if begin is None else begin
+    end = float('inf') if end is None else end
+    points = []
+    arc = 0.0
+    for (x1, y1), (x2, y2) in zip(centerline, centerline[1:]):
+        seg = math.hypot(x2 - x1, y2 - y1)
+        if seg > 0 and arc + seg > begin and arc < end:
+            t0 = max(0.0, (begin - arc) / seg)
+            t1 = min(1.0, (end - arc) / seg)
+            if not points:
+                points.append((x1 + (x2 - x1) * t0, y1 + (y2 - y1) * t0))
+            points.append((x1 + (x2 - x1) * t1, y1 + (y2 - y1) * t1))
+        arc += seg
+    return points
+
 
 if __name__ == '__main__':
     op = OrientationParser('lanelet2_map.osm', originX=35.23808753540768, originY=139.9009591876285)
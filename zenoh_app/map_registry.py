@@ -0,0 +1,92 @@
+"""
+Registry of the maps in my_scripts/maps_config.json.
+
+The file is parsed once and again only when its mtime changes, so that the API server, the state hub and the
+switch_map.py CLI can all edit it. Updates are written to a temporary file and renamed over the original, so a
+reader never sees a partially written file.
+"""
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MAPS_CONFIG_FILE = ROOT / 'my_scripts' / 'maps_config.json'
+
+
+class MapRegistry:
+    def __init__(self, path=MAPS_CONFIG_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.data = None
+
+    def config(self):
+        """The parsed configuration; callers must not modify it"""
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self.stamp:
+            with self.lock:
+                if stamp != self.stamp:
+                    with open(self.path, 'r') as f:
+                        self.data = json.load(f)
+                    self.stamp = stamp
+        return self.data
+
+    def maps(self):
+        return self.config().get('maps', {})
+
+    def current(self):
+        """Return (key, info) of the current map; info is None if the key is not configured"""
+        config = self.config()
+        map_key = config.get('current_map', None)
+        return map_key, config.get('maps', {}).get(map_key)
+
+    def update(self, change):
+        """Apply change(config) to a copy of the configuration and write it atomically"""
+        with self.lock:
+            with open(self.path, 'r') as f:
+                config = json.load(f)
+            change(config)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix='.tmp')
+            try:
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(config, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            stat = os.stat(self.path)
+            self.data = copy.deepcopy(config)
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            return config
+
+    def set_current(self, map_key):
+        """Make map_key the current map and return its info; raises KeyError for unknown maps"""
+
+        def change(config):
+            if map_key not in config.get('maps', {}):
+                raise KeyError(f"Map '{map_key}' not found in configuration")
+            config['current_map'] = map_key
+
+        return self.update(change)['maps'][map_key]
+
+    def add(self, key, path, lat, lon, name=None, description=None):
+        info = {
+            'name': name or key,
+            'path': path,
+            'origin_lat': float(lat),
+            'origin_lon': float(lon),
+            'description': description or f'Map {key}',
+        }
+        self.update(lambda config: config.setdefault('maps', {}).__setitem__(key, info))
+        return info
+
+
+REGISTRY = MapRegistry()
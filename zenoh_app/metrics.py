@@ -0,0 +1,232 @@
+"""
+Prometheus-style counters and latency histograms for the hot paths.
+
+Every thread records into its own cells, so recording never takes a lock: the lock is only taken the first time
+a thread touches a series, and readers sum the cells of all threads when rendering /metrics. The cell of a thread
+that ended is folded into a per-series total, so short-lived threads do not make the series grow.
+"""
+
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import wraps
+
+# Latency buckets in seconds, from 100 us to 5 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class _CellOwner:
+    """Kept in a thread-local of its thread only, so it is collected when the thread ends"""
+
+    __slots__ = ('__weakref__',)
+
+
+class _Series:
+    """One label combination; each thread owns a cell (a list) that only it writes to"""
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        # Cells of the live threads by id, and the sum of the cells of the threads that ended
+        self.cells = {}
+        self.retired = [0] * size
+        # Reentrant: a thread can end, and its cell be retired, while the collecting thread holds the lock
+        self.lock = threading.RLock()
+
+    def cell(self):
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = [0] * self.size
+            owner = _CellOwner()
+            with self.lock:
+                self.cells[id(cell)] = cell
+            weakref.finalize(owner, self._retire, cell)
+            self.local.cell = cell
+            self.local.owner = owner
+        return cell
+
+    def _retire(self, cell):
+        with self.lock:
+            self.cells.pop(id(cell), None)
+            for i, value in enumerate(cell):
+                self.retired[i] += value
+
+    def collect(self):
+        with self.lock:
+            cells = list(self.cells.values())
+            total = list(self.retired)
+        for cell in cells:
+            for i, value in enumerate(cell):
+                total[i] += value
+        return total
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self.children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild(_Series):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self.cell()[0] += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {child.collect()[0]}']
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class _HistogramChild(_Series):
+    def __init__(self, buckets):
+        # One slot per bucket, one for +Inf, then the sum
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value):
+        cell = self.cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def timed(self, func):
+        """Decorator observing the duration of every call"""
+        child = self.labels()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    def _render_child(self, values, child):
+        data = child.collect()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), data[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, [("le", le)])} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {data[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+### Hot-path metrics
+ZENOH_SAMPLES = Counter('fms_zenoh_samples_total', 'Zenoh samples received', ('topic',))
+ZENOH_CALLBACK_SECONDS = Histogram('fms_zenoh_callback_seconds', 'Time to deserialize and handle a zenoh sample', ('topic',))
+ZENOH_DECODES = Counter('fms_zenoh_decodes_total', 'Zenoh samples of latest-value topics deserialized on read', ('topic',))
+CAMERA_FRAMES = Counter('fms_camera_frames_total', 'Camera frames received')
+CAMERA_FRAME_SECONDS = Histogram('fms_camera_frame_seconds', 'Time to receive and decode a camera frame')
+JPEG_ENCODE_SECONDS = Histogram('fms_jpeg_encode_seconds', 'Time to encode a camera frame as JPEG')
+ORIENTATION_LOOKUP_SECONDS = Histogram('fms_orientation_lookup_seconds', 'Time of a genQuaternion_seg lanelet lookup')
+HTTP_REQUEST_SECONDS = Histogram('fms_http_request_seconds', 'HTTP handler latency', ('method', 'route'))
+FLEET_MONITOR_SECONDS = Histogram('fms_fleet_monitor_seconds', 'Time of a fleet proximity and geofence check')
+FLEET_ALERTS = Counter('fms_fleet_alerts_total', 'Fleet monitor alerts raised', ('kind',))
+
+
+def instrument_callback(topic, callback):
+    """Wrap a zenoh subscriber callback to count its samples and time its handling"""
+    samples = ZENOH_SAMPLES.labels(topic)
+    latency = ZENOH_CALLBACK_SECONDS.labels(topic)
+
+    @wraps(callback)
+    def wrapper(sample, *args):
+        samples.inc()
+        start = time.perf_counter()
+        try:
+            return callback(sample, *args)
+        finally:
+            latency.observe(time.perf_counter() - start)
+
+    return wrapper
@@ -0,0 +1,355 @@
+"""
+Point cloud map tiles.
+
+The pointcloud_map.pcd next to a lanelet2 map is far too heavy for the browser, so it is ingested once: the file
+is memory-mapped and reduced in chunks to voxel centroids (position and intensity averaged per voxel), first at
+the finest voxel size, then at each coarser level of detail by merging 2x2x2 voxels of the level below. Every level
+is cut into square tiles of TILE_SIZE meters, saved as one float32 (x, y, z, intensity) .npy array per level sorted
+by tile, with the offsets of the tiles in meta.json. The result is cached on disk under CACHE_DIR, keyed by the PCD
+file, the map origin and the parameters, and tiles are served from memory maps of those files.
+
+Level 0 is the coarsest (voxels of FINEST_VOXEL * 2 ** (LOD_COUNT - 1) meters), level LOD_COUNT - 1 the finest.
+Coordinates are in the map frame; meta.json carries an affine approximation of the map --> lat/lon projection
+around the center of the cloud for overlays.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = Path(os.environ.get('FMS_POINTCLOUD_CACHE', ROOT / '.cache' / 'pointcloud'))
+PCD_NAME = 'pointcloud_map.pcd'
+# Voxel size of the finest level (m), and number of levels, each twice as coarse as the next
+FINEST_VOXEL = float(os.environ.get('FMS_POINTCLOUD_VOXEL', 0.5))
+LOD_COUNT = 4
+# Side of a tile (m)
+TILE_SIZE = 100.0
+# Points reduced at once while reading the PCD file
+CHUNK_POINTS = 2_000_000
+# Bump when the cache layout changes
+CACHE_FORMAT = 1
+
+PCD_TYPES = {
+    ('F', 4): 'f4',
+    ('F', 8): 'f8',
+    ('U', 1): 'u1',
+    ('U', 2): 'u2',
+    ('U', 4): 'u4',
+    ('U', 8): 'u8',
+    ('I', 1): 'i1',
+    ('I', 2): 'i2',
+    ('I', 4): 'i4',
+    ('I', 8): 'i8',
+}
+
+
+class PointCloudNotReady(Exception):
+    """The tiles of the point cloud are still being built"""
+
+
+def read_pcd(path):
+    """Points of a PCD file as a structured array, memory-mapped for binary files; raises ValueError"""
+    header = {}
+    with open(path, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f'{path}: no DATA line in the PCD header')
+            line = line.decode('ascii', 'replace').strip()
+            if not line or line.startswith('#'):
+                continue
+            key, _, value = line.partition(' ')
+            header[key.upper()] = value.split()
+            if key.upper() == 'DATA':
+                offset = f.tell()
+                break
+
+    names = []
+    formats = []
+    for i, (name, size, kind, count) in enumerate(
+        zip(header['FIELDS'], header['SIZE'], header['TYPE'], header.get('COUNT', ['1'] * len(header['FIELDS'])))
+    ):
+        fmt = PCD_TYPES.get((kind.upper(), int(size)))
+        if fmt is None:
+            raise ValueError(f'{path}: unsupported field {name} of type {kind}{size}')
+        # Padding fields are all named '_'
+        names.append(name if name not in names else f'{name}{i}')
+        formats.append(fmt if int(count) == 1 else (fmt, int(count)))
+    dtype = np.dtype({'names': names, 'formats': ['<' + f if isinstance(f, str) else ('<' + f[0], f[1]) for f in formats]})
+    points = int(header['POINTS'][0]) if 'POINTS' in header else int(header['WIDTH'][0]) * int(header.get('HEIGHT', ['1'])[0])
+
+    data = header['DATA'][0].lower()
+    if data == 'binary':
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(points,))
+    if data == 'ascii':
+        with open(path, 'rb') as f:
+            header_lines = f.read(offset).count(b'\n')
+        columns = np.loadtxt(path, dtype=np.float64, ndmin=2, skiprows=header_lines)
+        array = np.zeros(len(columns), dtype=dtype)
+        column = 0
+        for name in names:
+            width = 1 if dtype[name].shape == () else dtype[name].shape[0]
+            array[name] = columns[:, column] if width == 1 else columns[:, column : column + width]
+            column += width
+        return array
+    raise ValueError(f'{path}: DATA {data} is not supported, convert the file to binary (e.g. pcl_convert_pcd_ascii_binary)')
+
+
+def _reduce(keys, sums, counts):
+    """Merge the rows sharing a key: summed values (n, 4) and point counts"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    merged = np.empty((len(unique), sums.shape[1]), dtype=np.float64)
+    for c in range(sums.shape[1]):
+        merged[:, c] = np.bincount(inverse, weights=sums[:, c], minlength=len(unique))
+    return unique, merged, np.bincount(inverse, weights=counts, minlength=len(unique))
+
+
+def _pack(ijk, dims):
+    return (ijk[:, 0] * dims[1] + ijk[:, 1]) * dims[2] + ijk[:, 2]
+
+
+def _unpack(keys, dims):
+    ij, k = np.divmod(keys, dims[2])
+    i, j = np.divmod(ij, dims[1])
+    return np.column_stack([i, j, k])
+
+
+def build_levels(points, finest=FINEST_VOXEL, lod_count=LOD_COUNT, chunk=CHUNK_POINTS):
+    """
+    Voxel centroids of every level of detail, coarsest first: [(n, 4) float32 x, y, z, intensity], and the
+    (min, max) bounds of the cloud. Only the finest level reads the points, chunk by chunk.
+    """
+    has_intensity = 'intensity' in points.dtype.names
+
+    def columns(start, stop):
+        part = points[start:stop]
+        values = np.column_stack(
+            [
+                part['x'].astype(np.float64),
+                part['y'].astype(np.float64),
+                part['z'].astype(np.float64),
+                part['intensity'].astype(np.float64) if has_intensity else np.zeros(len(part)),
+            ]
+        )
+        return values[np.isfinite(values[:, :3]).all(axis=1)]
+
+    # Bounds first, so that voxel coordinates fit in one int64 key
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    for start in range(0, len(points), chunk):
+        values = columns(start, start + chunk)
+        if len(values):
+            low = np.minimum(low, values[:, :3].min(axis=0))
+            high = np.maximum(high, values[:, :3].max(axis=0))
+    if not np.isfinite(low).all():
+        raise ValueError('The point cloud has no valid point')
+    dims = np.floor((high - low) / finest).astype(np.int64) + 1
+
+    parts = []
+    for start in range(0, len(points), chunk):
+        values = columns(start, start + chunk)
+        ijk = np.floor((values[:, :3] - low) / finest).astype(np.int64)
+        parts.append(_reduce(_pack(ijk, dims), values, np.ones(len(values))))
+    keys, sums, counts = _reduce(np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]), np.concatenate([p[2] for p in parts]))
+
+    levels = []
+    ijk = _unpack(keys, dims)
+    for level in range(lod_count):
+        if level:
+            # Merge 2x2x2 voxels of the level below
+            ijk = ijk >> 1
+            dims = (dims + 1) >> 1
+            keys, sums, counts = _reduce(_pack(ijk, dims), sums, counts)
+            ijk = _unpack(keys, dims)
+        levels.append((sums / counts[:, None]).astype(np.float32))
+    levels.reverse()
+    return levels, (low, high)
+
+
+def _latlon_transform(origin, x, y, step=100.0):
+    """[lat0, lon0, dlat/dx, dlat/dy, dlon/dx, dlon/dy, x, y]: lat/lon of (x, y) and the slopes around it"""
+    from lanelet2.core import BasicPoint3d
+    from lanelet2.io import Origin
+    from lanelet2.projection import UtmProjector
+
+    projector = UtmProjector(Origin(float(origin[0]), float(origin[1])))
+    center = projector.reverse(BasicPoint3d(x, y, 0.0))
+    east = projector.reverse(BasicPoint3d(x + step, y, 0.0))
+    north = projector.reverse(BasicPoint3d(x, y + step, 0.0))
+    return [
+        center.lat,
+        center.lon,
+        (east.lat - center.lat) / step,
+        (north.lat - center.lat) / step,
+        (east.lon - center.lon) / step,
+        (north.lon - center.lon) / step,
+        x,
+        y,
+    ]
+
+
+class PointCloudTiles:
+    """Tiles of one built point cloud, read from its cache directory"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        self.key = self.directory.name
+        self.origin = np.array(self.meta['bounds'][0][:2])
+        self.levels = [np.load(self.directory / f'lod{level}.npy', mmap_mode='r') for level in range(len(self.meta['lods']))]
+        # ((tx, ty), point count) of the non-empty tiles of every level, in (tx, ty) order
+        self.tile_counts = [[(tuple(int(v) for v in key.split(',')), entry[1]) for key, entry in lod['tiles'].items()] for lod in self.meta['lods']]
+
+    def map_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Map frame bbox covering a lat/lon bbox, through the affine approximation of the projection"""
+        if self.meta['latlon_transform'] is None:
+            raise ValueError('The point cloud was built without a map origin')
+        lat0, lon0, lat_x, lat_y, lon_x, lon_y, x0, y0 = self.meta['latlon_transform']
+        inverse = np.linalg.inv(np.array([[lat_x, lat_y], [lon_x, lon_y]]))
+        corners = np.array([[min_lat, min_lon], [min_lat, max_lon], [max_lat, min_lon], [max_lat, max_lon]]) - [lat0, lon0]
+        xy = corners @ inverse.T + [x0, y0]
+        return (*xy.min(axis=0), *xy.max(axis=0))
+
+    def tile_index(self, x, y):
+        return tuple(int(v) for v in np.floor((np.array([x, y]) - self.origin) / self.meta['tile_size']))
+
+    def tiles(self, lod, bbox):
+        """
+        [(tx, ty, points)] of the non-empty tiles of level lod intersecting bbox (min x, min y, max x, max y, map frame).
+        The built tiles are filtered, so the cost does not depend on the size of the bbox; raises ValueError for
+        non-finite bounds.
+        """
+        if not np.isfinite(bbox).all():
+            raise ValueError('bbox values must be finite')
+        (x0, y0), (x1, y1) = self.tile_index(bbox[0], bbox[1]), self.tile_index(bbox[2], bbox[3])
+        return [(tx, ty, count) for (tx, ty), count in self.tile_counts[lod] if x0 <= tx <= x1 and y0 <= ty <= y1]
+
+    def tile(self, lod, tx, ty):
+        """float32 (x, y, z, intensity) rows of a tile as bytes, None for an empty tile; raises IndexError"""
+        entry = self.meta['lods'][lod]['tiles'].get(f'{tx},{ty}')
+        if entry is None:
+            return None
+        offset, count = entry
+        return self.levels[lod][offset : offset + count].tobytes()
+
+
+def cache_key(pcd_path, origin=None):
+    """Cache directory name of a PCD file; the origin is part of it since meta.json carries the lat/lon transform"""
+    stat = os.stat(pcd_path)
+    origin = None if origin is None else tuple(float(v) for v in origin)
+    ident = f'{Path(pcd_path).resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{origin}|{FINEST_VOXEL}|{LOD_COUNT}|{TILE_SIZE}|{CACHE_FORMAT}'
+    return f'{Path(pcd_path).stem}-{hashlib.sha1(ident.encode()).hexdigest()[:16]}'
+
+
+def build(pcd_path, directory, origin=None):
+    """
+    Ingest pcd_path into directory, for a map of origin (lat, lon) if given.
+    Written to a temporary directory first, so that readers never see half of it.
+    """
+    points = read_pcd(pcd_path)
+    levels, (low, high) = build_levels(points)
+    directory = Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=directory.parent, prefix=directory.name, suffix='.tmp'))
+    try:
+        lods = []
+        for level, centroids in enumerate(levels):
+            tiles = np.floor((centroids[:, :2] - low[:2]) / TILE_SIZE).astype(np.int64)
+            order = np.lexsort((tiles[:, 1], tiles[:, 0]))
+            centroids, tiles = centroids[order], tiles[order]
+            unique, starts, counts = np.unique(tiles, axis=0, return_index=True, return_counts=True)
+            np.save(tmp / f'lod{level}.npy', centroids)
+            lods.append(
+                {
+                    'voxel': FINEST_VOXEL * 2 ** (len(levels) - 1 - level),
+                    'points': int(len(centroids)),
+                    'tiles': {f'{tx},{ty}': [int(start), int(count)] for (tx, ty), start, count in zip(unique, starts, counts)},
+                }
+            )
+        center = (low + high) / 2
+        meta = {
+            'source': str(pcd_path),
+            'points': int(len(points)),
+            'bounds': [low.tolist(), high.tolist()],
+            'tile_size': TILE_SIZE,
+            'format': 'float32 x, y, z, intensity',
+            'lods': lods,
+            'latlon_transform': _latlon_transform(origin, center[0], center[1]) if origin is not None else None,
+        }
+        with open(tmp / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Another process finished the same build first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return PointCloudTiles(directory)
+
+
+class PointCloudStore:
+    """Built point clouds by PCD file; builds run in a background thread, one at a time"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.loaded = {}
+        self.building = {}
+        self.lock = threading.Lock()
+
+    def get(self, pcd_path, origin=None):
+        """PointCloudTiles of pcd_path; raises PointCloudNotReady while building, FileNotFoundError without a PCD"""
+        directory = self.cache_dir / cache_key(pcd_path, origin)
+        with self.lock:
+            tiles = self.loaded.get(directory)
+            if tiles is not None:
+                return tiles
+            if (directory / 'meta.json').exists():
+                tiles = self.loaded[directory] = PointCloudTiles(directory)
+                return tiles
+            state = self.building.get(directory)
+            if state is None:
+                # A failed build is not retried until the file changes (and so its cache key)
+                state = self.building[directory] = {'error': None}
+                threading.Thread(target=self._build, args=(pcd_path, directory, origin, state), daemon=True).start()
+            elif state['error']:
+                raise ValueError(state['error'])
+        raise PointCloudNotReady(f'Building the tiles of {pcd_path}')
+
+    def _build(self, pcd_path, directory, origin, state):
+        logger.info(f'Building point cloud tiles of {pcd_path}')
+        try:
+            tiles = build(pcd_path, directory, origin)
+        except Exception as e:
+            logger.error(f'Failed to build point cloud tiles of {pcd_path}: {e}')
+            state['error'] = str(e)
+            return
+        with self.lock:
+            self.loaded[directory] = tiles
+            self.building.pop(directory, None)
+        logger.info(
+            f'Point cloud tiles of {pcd_path} ready: {tiles.meta["points"]} points, {[lod["points"] for lod in tiles.meta["lods"]]} per level'
+        )
+
+
+def pcd_path(map_info):
+    """PCD file of a map: its 'pointcloud' entry, or pointcloud_map.pcd next to the lanelet2 file"""
+    public = ROOT / 'frontend' / 'public'
+    if map_info.get('pointcloud'):
+        return public / map_info['pointcloud'].lstrip('/')
+    return (public / map_info['path'].lstrip('/')).parent / PCD_NAME
+
+
+STORE = PointCloudStore()
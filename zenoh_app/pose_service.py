@@ -1,12 +1,16 @@
+import dataclasses
 import logging
+import math
 import os
+import random
+import struct
 import time
 import warnings
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 import zenoh
-from lanelet2.core import BasicPoint3d, GPSPoint
-from lanelet2.io import Origin
-from lanelet2.projection import UtmProjector
 from zenoh_ros_type.autoware_adapi_msgs import (
     ChangeOperationModeResponse,
     ClearRouteResponse,
@@ -17,15 +21,28 @@ from zenoh_ros_type.autoware_adapi_msgs import (
     VehicleKinematics,
 )
 from zenoh_ros_type.common_interfaces import (
+    Accel,
+    AccelWithCovariance,
+    AccelWithCovarianceStamped,
     Header,
     Point,
     Pose,
+    PoseWithCovariance,
+    PoseWithCovarianceStamped,
     Quaternion,
+    Twist,
+    TwistWithCovariance,
+    TwistWithCovarianceStamped,
+    Vector3,
 )
+from zenoh_ros_type.geographic_info import GeoPoint, GeoPointStamped
 from zenoh_ros_type.rcl_interfaces import Time
 from zenoh_ros_type.tier4_autoware_msgs import GateMode
 
-from .map_parser import OrientationParser
+from . import qos, telemetry_table, versions
+from .latest_sample import LatestSample
+from .log_pipeline import throttle
+from .metrics import instrument_callback
 
 logger = logging.getLogger(__name__)
 
@@ -38,25 +55,246 @@ SET_CLEAR_ROUTE_KEY_EXPR = '/api/routing/clear_route'
 ### TODO: Should be replaced by ADAPI
 SET_GATE_MODE_KEY_EXPR = '/control/gate_mode_cmd'
 
+# Upper bound of concurrent vehicle requests in batch dispatch
+BATCH_MAX_WORKERS = 16
+
+# Size of the CDR encapsulation header in front of every serialized message
+CDR_HEADER_SIZE = 4
+
+# Decoded vehicle pose: map position (m), lat/lon, heading (deg), and the lanelet it matched with the arc length
+# along its centerline (m), both None when off the lanelets
+Kinematics = namedtuple('Kinematics', 'x y lat lon heading lanelet arc')
+NO_POSE = Kinematics(0.0, 0.0, 0.0, 0.0, 0.0, None, None)
+
+
+
+class UnroutableGoal(ValueError):
+    """The goal cannot be reached on the map, it is not sent to the vehicle"""
+
+
+class KinematicsDecoder:
+    """
+    Read the pose of autoware_adapi_v1_msgs/VehicleKinematics without deserializing the whole message.
+
+    Only the position x/y and the orientation are needed, and they sit right after two headers: the fields are read
+    at offsets computed from the CDR layout (the frame_id strings are the only variable-length fields in front of
+    them), skipping the covariances, twist and acceleration. The layout is checked against the full deserializer on
+    random messages at startup and on one sample out of SPOT_CHECK_INTERVAL afterwards; on any mismatch the decoder
+    falls back to VehicleKinematics.deserialize for good.
+    """
+
+    SPOT_CHECK_INTERVAL = 256
+    VERIFY_MESSAGES = 64
+
+    ### Offsets after the encapsulation header
+    ### [geographic_pose{header{stamp(0) frame_id(8)} position(lat, lon, alt, 8-aligned)}]
+    ### pose{header{stamp frame_id} pose{pose{position(x, y, z, 8-aligned) orientation(x, y, z, w)} covariance}} ...
+    STAMP_SIZE = 8
+    GEO_POINT_SIZE = 24
+
+    def __init__(self):
+        self.u32 = {0: struct.Struct('>I'), 1: struct.Struct('<I')}
+        self.pose_struct = {0: struct.Struct('>7d'), 1: struct.Struct('<7d')}
+        leading = [field.name for field in dataclasses.fields(VehicleKinematics)]
+        leading = leading[: leading.index('pose')] if 'pose' in leading else None
+        self.geographic = leading == ['geographic_pose']
+        self.count = 0
+        self.fast = leading in ([], ['geographic_pose']) and self.verify()
+        if not self.fast:
+            logger.warning('VehicleKinematics layout mismatch, falling back to full deserialization')
+
+    def _skip_header(self, payload, offset, u32):
+        """Offset after a std_msgs/Header starting at offset"""
+        offset += self.STAMP_SIZE
+        (length,) = u32.unpack_from(payload, CDR_HEADER_SIZE + offset)
+        return offset + 4 + length
+
+    def _fast(self, payload):
+        # Plain CDR only: big endian (0x0000) or little endian (0x0001)
+        if payload[0] != 0 or payload[1] > 1:
+            raise ValueError('unsupported CDR encapsulation')
+        u32 = self.u32[payload[1]]
+        offset = 0
+        if self.geographic:
+            offset = self._skip_header(payload, offset, u32)
+            offset = (offset + 7) & ~7
+            offset += self.GEO_POINT_SIZE
+        offset = self._skip_header(payload, offset, u32)
+        offset = (offset + 7) & ~7
+        x, y, _, qx, qy, qz, qw = self.pose_struct[payload[1]].unpack_from(payload, CDR_HEADER_SIZE + offset)
+        return x, y, qx, qy, qz, qw
+
+    def _full(self, payload):
+        pose = VehicleKinematics.deserialize(payload).pose.pose.pose
+        return (
+            pose.position.x,
+            pose.position.y,
+            pose.orientation.x,
+            pose.orientation.y,
+            pose.orientation.z,
+            pose.orientation.w,
+        )
+
+    def verify(self):
+        """Compare the fast and full decoding of random messages, with frame_ids of every alignment"""
+        rng = random.Random(0)
+
+        def header():
+            frame_id = ''.join(rng.choice('abcdefghij_/') for _ in range(rng.randrange(24)))
+            return Header(stamp=Time(sec=rng.randrange(2**31), nanosec=rng.randrange(10**9)), frame_id=frame_id)
+
+        def vector():
+            return Vector3(x=rng.uniform(-1e3, 1e3), y=rng.uniform(-1e3, 1e3), z=rng.uniform(-1e3, 1e3))
+
+        def covariance():
+            return [rng.uniform(-1, 1) for _ in range(36)]
+
+        try:
+            for _ in range(self.VERIFY_MESSAGES):
+                pose = Pose(
+                    position=Point(x=rng.uniform(-1e5, 1e5), y=rng.uniform(-1e5, 1e5), z=rng.uniform(-1e2, 1e2)),
+                    orientation=Quaternion(x=rng.uniform(-1, 1), y=rng.uniform(-1, 1), z=rng.uniform(-1, 1), w=rng.uniform(-1, 1)),
+                )
+                fields = {
+                    'pose': PoseWithCovarianceStamped(header=header(), pose=PoseWithCovariance(pose=pose, covariance=covariance())),
+                    'twist': TwistWithCovarianceStamped(
+                        header=header(), twist=TwistWithCovariance(twist=Twist(linear=vector(), angular=vector()), covariance=covariance())
+                    ),
+                    'accel': AccelWithCovarianceStamped(
+                        header=header(), accel=AccelWithCovariance(accel=Accel(linear=vector(), angular=vector()), covariance=covariance())
+                    ),
+                }
+                if self.geographic:
+                    position = GeoPoint(latitude=rng.uniform(-90, 90), longitude=rng.uniform(-180, 180), altitude=rng.uniform(0, 1e3))
+                    fields['geographic_pose'] = GeoPointStamped(header=header(), position=position)
+                payload = VehicleKinematics(**fields).serialize()
+                if self._fast(payload) != self._full(payload):
+                    return False
+            return True
+        except Exception as e:
+            logger.error(f'Failed to verify VehicleKinematics layout: {e}')
+            return False
+
+    def decode(self, payload):
+        """(x, y, qx, qy, qz, qw) of the pose in a serialized VehicleKinematics"""
+        if not self.fast:
+            return self._full(payload)
+        try:
+            pose = self._fast(payload)
+        except (ValueError, IndexError, struct.error):
+            return self._full(payload)
+        self.count += 1
+        if self.count % self.SPOT_CHECK_INTERVAL == 0:
+            full = self._full(payload)
+            if pose != full:
+                self.fast = False
+                logger.warning('VehicleKinematics spot check mismatch, falling back to full deserialization')
+                return full
+        return pose
+
+
+_kinematics_decoder = None
+
+
+def service_status(replies, response_type, service):
+    """
+    (success, message) of the reply to an ADAPI service query, from its ResponseStatus.
+    An error reply, an undecodable reply and no reply before the query timeout are failures.
+    """
+    for reply in replies:
+        if reply.ok is None:
+            return False, f'{service} failed: {reply.err.payload.to_string()}'
+        try:
+            response = response_type.deserialize(reply.ok.payload.to_bytes())
+        except Exception as e:
+            return False, f'Failed to decode the {service} response: {e}'
+        logger.info(f">> Received ('{reply.ok.key_expr}': {response})")
+        return response.status.success, response.status.message
+    return False, f'No reply to {service}'
+
+
+def kinematics_decoder():
+    """KinematicsDecoder shared by every vehicle, verified on first use"""
+    global _kinematics_decoder
+    if _kinematics_decoder is None:
+        _kinematics_decoder = KinematicsDecoder()
+    return _kinematics_decoder
+
+
+# Parsed maps shared by every vehicle, keyed by (path, originX, originY)
+_parser_cache = {}
+_parser_lock = Lock()
+
+
+def make_projector(origin_lat, origin_lon):
+    # lanelet2 is heavy, only load it once a vehicle needs it
+    from lanelet2.io import Origin
+    from lanelet2.projection import UtmProjector
+
+    return UtmProjector(Origin(float(origin_lat), float(origin_lon)))
+
+
+def load_orientation_parser(path=None, originX=None, originY=None):
+    """Return the shared OrientationParser of a map, parsing it on first use"""
+    from .map_parser import OrientationParser
+
+    key = (path, originX, originY)
+    with _parser_lock:
+        parser = _parser_cache.get(key)
+        if parser is not None:
+            return parser
+
+        # Suppress all output (including stderr) from lanelet2 parsing
+        import io
+        import sys
+
+        old_stdout = sys.stdout
+        old_stderr = sys.stderr
+        sys.stdout = io.StringIO()
+        sys.stderr = io.StringIO()
+        try:
+            if path is None:
+                parser = OrientationParser()
+            else:
+                parser = OrientationParser(path=path, originX=originX, originY=originY)
+        finally:
+            # Restore stdout/stderr
+            sys.stdout = old_stdout
+            sys.stderr = old_stderr
+
+        _parser_cache[key] = parser
+        return parser
+
+
+def cached_orientation_parser(map_config=None):
+    """The OrientationParser of a map if it is already parsed, without loading it"""
+    return _parser_cache.get(map_config or (None, None, None))
+
 
 class VehiclePose:
-    def __init__(self, session, scope, use_bridge_ros2dds=True):
+    def __init__(self, session, scope, use_bridge_ros2dds=True, map_config=None):
         ### Information
         self.use_bridge_ros2dds = use_bridge_ros2dds
         self.session = session
         self.scope = scope
-        self.originX = float(os.environ['REACT_APP_MAP_ORIGIN_LAT'])
-        self.originY = float(os.environ['REACT_APP_MAP_ORIGIN_LON'])
-        self.projector = UtmProjector(Origin(self.originX, self.originY))
+        # (map path, origin lat, origin lon); None falls back to the REACT_APP_MAP_* environment variables
+        self.map_config = map_config
+        if map_config is not None:
+            self.originX = float(map_config[1])
+            self.originY = float(map_config[2])
+        else:
+            self.originX = float(os.environ['REACT_APP_MAP_ORIGIN_LAT'])
+            self.originY = float(os.environ['REACT_APP_MAP_ORIGIN_LON'])
+        self.projector = make_projector(self.originX, self.originY)
         self.initialize()
 
     def initialize(self):
-        self.lat = 0.0
-        self.lon = 0.0
-        self.heading = 0.0  # heading in degrees (0 = North, 90 = East, etc.)
+        from lanelet2.core import BasicPoint3d
 
-        self.positionX = 0.0
-        self.positionY = 0.0
+        # Newest kinematics sample, decoded and projected when the pose is read (see decode_kinematics)
+        self.kinematics = LatestSample('kinematics', self.decode_kinematics)
+        # Lanelet of the previous match, preferred by the next one (see OrientationParser.matchPose)
+        self._laneletId = None
 
         self.topic_prefix = self.scope if self.use_bridge_ros2dds else self.scope + '/rt'
 
@@ -70,30 +308,8 @@ class VehiclePose:
         self.goalValid = False
 
         def callback_position(sample):
-            # print("size of the message (bytes) ", struct.calcsize(sample.payload))
-            # print(sample.payload)
-            data = VehicleKinematics.deserialize(sample.payload.to_bytes())
-            # print(data)
-            self.positionX = data.pose.pose.pose.position.x
-            self.positionY = data.pose.pose.pose.position.y
-            gps = self.projector.reverse(BasicPoint3d(self.positionX, self.positionY, 0.0))
-            self.lat = gps.lat
-            self.lon = gps.lon
-            
-            # Extract heading from quaternion orientation
-            # quaternion format: (x, y, z, w)
-            qx = -data.pose.pose.pose.orientation.x
-            qy = -data.pose.pose.pose.orientation.y
-            qz = -data.pose.pose.pose.orientation.z
-            qw = -data.pose.pose.pose.orientation.w
-            
-            # Convert quaternion to yaw (heading)
-            import math
-            siny_cosp = 2 * (qw * qz + qx * qy)
-            cosy_cosp = 1 - 2 * (qy * qy + qz * qz)
-            yaw = math.atan2(siny_cosp, cosy_cosp)
-            # Convert from radians to degrees
-            self.heading = math.degrees(yaw)
+            self.kinematics.put(sample)
+            versions.bump('pose')
 
         def callback_goalPosition(sample):
             data = Route.deserialize(sample.payload.to_bytes())
@@ -103,115 +319,252 @@ class VehiclePose:
                 gps = self.projector.reverse(BasicPoint3d(self.goalX, self.goalY, 0.0))
                 self.goalLat = gps.lat
                 self.goalLon = gps.lon
-                print('Echo back goal pose: ', self.goalLat, self.goalLon)
+                logger.info(f'Echo back goal pose of {self.scope}: {self.goalLat}, {self.goalLon}', extra=throttle(1))
                 self.goalValid = True
             else:
                 self.goalValid = False
+            versions.bump('goal')
 
         ### Topics
         ###### Subscribers
-        self.subscriber_pose = self.session.declare_subscriber(self.topic_prefix + GET_POSE_KEY_EXPR, callback_position)
-        self.subscriber_goalPose = self.session.declare_subscriber(self.topic_prefix + GET_GOAL_POSE_KEY_EXPR, callback_goalPosition)
+        self.subscriber_pose = self.session.declare_subscriber(
+            self.topic_prefix + GET_POSE_KEY_EXPR, instrument_callback('kinematics', callback_position)
+        )
+        self.subscriber_goalPose = self.session.declare_subscriber(
+            self.topic_prefix + GET_GOAL_POSE_KEY_EXPR, instrument_callback('route', callback_goalPosition)
+        )
 
         ###### Publishers
-        self.publisher_gate_mode = self.session.declare_publisher(self.topic_prefix + SET_GATE_MODE_KEY_EXPR)
+        self.publisher_gate_mode = qos.declare_publisher(self.session, self.topic_prefix + SET_GATE_MODE_KEY_EXPR, 'command')
+
+    def decode_kinematics(self, payload):
+        """Pose of a kinematics payload: map position, lat/lon and heading; also matches it to a lanelet"""
+        from lanelet2.core import BasicPoint3d
+
+        x, y, qx, qy, qz, qw = kinematics_decoder().decode(payload)
+        gps = self.projector.reverse(BasicPoint3d(x, y, 0.0))
+
+        # Heading from the quaternion orientation (x, y, z, w)
+        qx, qy, qz, qw = -qx, -qy, -qz, -qw
+
+        # Convert quaternion to yaw (heading)
+        siny_cosp = 2 * (qw * qz + qx * qy)
+        cosy_cosp = 1 - 2 * (qy * qy + qz * qz)
+        yaw = math.atan2(siny_cosp, cosy_cosp)
+        # Convert from radians to degrees
+        pose = Kinematics(x, y, gps.lat, gps.lon, math.degrees(yaw), *self.match_lanelet(x, y))
+        telemetry_table.publish(
+            self.scope,
+            lat=pose.lat,
+            lon=pose.lon,
+            heading=pose.heading,
+            lanelet=-1 if pose.lanelet is None else pose.lanelet,
+            arc=pose.arc or 0.0,
+        )
+        return pose
+
+    @property
+    def pose(self):
+        """Kinematics of the newest sample, None until the first one or if it failed to decode"""
+        try:
+            return self.kinematics.get()
+        except Exception as e:
+            logger.error(f"Failed to decode the kinematics of {self.scope}: {e}", extra=throttle(5))
+            return self.kinematics.value
+
+    @property
+    def poseValid(self):
+        """Set once the first kinematics message arrived"""
+        return self.pose is not None
+
+    @property
+    def positionX(self):
+        return (self.pose or NO_POSE).x
+
+    @property
+    def positionY(self):
+        return (self.pose or NO_POSE).y
+
+    @property
+    def lat(self):
+        return (self.pose or NO_POSE).lat
+
+    @property
+    def lon(self):
+        return (self.pose or NO_POSE).lon
+
+    @property
+    def heading(self):
+        """Heading in degrees (0 = North, 90 = East, etc.)"""
+        return (self.pose or NO_POSE).heading
+
+    @property
+    def laneletId(self):
+        return (self.pose or NO_POSE).lanelet
+
+    @property
+    def laneletArc(self):
+        return (self.pose or NO_POSE).arc
+
+    def match_lanelet(self, x, y):
+        """(lanelet id, arc length) of a position once the map is parsed, else (None, None); see OrientationParser.matchPose"""
+        parser = self.orientationGen or cached_orientation_parser(self.map_config)
+        if parser is None:
+            return None, None
+        try:
+            match = parser.matchPose(x, y, self._laneletId)
+        except Exception as e:
+            logger.debug(f"Failed to match {self.scope} to a lanelet: {e}")
+            match = None
+        self._laneletId, arc = match if match is not None else (None, None)
+        return self._laneletId, arc
 
     def _ensure_orientation_parser(self):
         """Lazily initialize OrientationParser if not already done"""
         if self.orientationGen is not None:
             return True
-        
+
         try:
-            # Suppress all output (including stderr) from lanelet2 parsing
-            import sys
-            import io
-            old_stdout = sys.stdout
-            old_stderr = sys.stderr
-            sys.stdout = io.StringIO()
-            sys.stderr = io.StringIO()
-            
-            try:
-                self.orientationGen = OrientationParser()
-                logger.info(f"OrientationParser initialized successfully for {self.scope}")
-                return True
-            finally:
-                # Restore stdout/stderr
-                sys.stdout = old_stdout
-                sys.stderr = old_stderr
+            if self.map_config is not None:
+                self.orientationGen = load_orientation_parser(*self.map_config)
+            else:
+                self.orientationGen = load_orientation_parser()
+            logger.info(f"OrientationParser initialized successfully for {self.scope}")
+            return True
         except Exception as e:
             logger.error(f"Failed to initialize OrientationParser for {self.scope}: {e}", exc_info=True)
             return False
 
-    def setGoal(self, lat, lon):
+    def setGoal(self, lat, lon, snap=False):
+        """
+        Send a goal to the vehicle; with snap, the goal is first moved to the nearest lanelet centerline.
+        Returns (success, message) of the set_route_points reply, see service_status.
+        """
+        from lanelet2.core import GPSPoint
+
+        from .map_parser import SNAP_MAX_DISTANCE
+
         try:
             # Ensure OrientationParser is initialized
             if not self._ensure_orientation_parser():
                 raise RuntimeError(f"OrientationParser initialization failed for {self.scope}")
-                
+
+            coordinate = self.projector.forward(GPSPoint(float(lat), float(lon), 0))
+            x, y = coordinate.x, coordinate.y
+            q = None
+            if snap:
+                x, y, lanelet_id, yaw, moved = self.orientationGen.getCenterlineIndex().snap([(x, y)])[0]
+                if moved > SNAP_MAX_DISTANCE:
+                    raise UnroutableGoal(f'Goal is {moved:.1f} m away from the nearest lanelet')
+                q = [0, 0, math.sin(yaw / 2), math.cos(yaw / 2)]
+                logger.info(f"Goal of {self.scope} snapped by {moved:.2f} m onto lanelet {lanelet_id}")
+
+            # Reject unroutable goals before sending anything to the vehicle
+            self._route(x, y)
+
             replies = self.session.get(self.topic_prefix + SET_CLEAR_ROUTE_KEY_EXPR)
 
             for reply in replies:
                 try:
-                    print(">> Received ('{}': {})".format(reply.ok.key_expr, ClearRouteResponse.deserialize(reply.ok.payload.to_bytes())))
+                    logger.info(f">> Received ('{reply.ok.key_expr}': {ClearRouteResponse.deserialize(reply.ok.payload.to_bytes())})")
                 except Exception as e:
-                    print(f'Failed to handle response: {e}')
+                    logger.error(f'Failed to handle response: {e}')
 
-            coordinate = self.projector.forward(GPSPoint(float(lat), float(lon), 0))
-            q = self.orientationGen.genQuaternion_seg(coordinate.x, coordinate.y)
+            if q is None:
+                q = self.orientationGen.genQuaternion_seg(x, y)
             request = SetRoutePointsRequest(
                 header=Header(stamp=Time(sec=0, nanosec=0), frame_id='map'),
                 option=RouteOption(allow_goal_modification=False),
-                goal=Pose(position=Point(x=coordinate.x, y=coordinate.y, z=0), orientation=Quaternion(x=q[0], y=q[1], z=q[2], w=q[3])),
+                goal=Pose(position=Point(x=x, y=y, z=0), orientation=Quaternion(x=q[0], y=q[1], z=q[2], w=q[3])),
                 waypoints=[],
             ).serialize()
 
             replies = self.session.get(self.topic_prefix + SET_ROUTE_POINT_KEY_EXPR, payload=request)
-            for reply in replies:
-                try:
-                    print(">> Received ('{}': {})".format(reply.ok.key_expr, SetRoutePointsResponse.deserialize(reply.ok.payload.to_bytes())))
-                except Exception as e:
-                    print(f'Failed to handle response: {e}')
-            logger.info(f"Goal set successfully for {self.scope}: lat={lat}, lon={lon}")
+            success, message = service_status(replies, SetRoutePointsResponse, 'set_route_points')
+            if success:
+                logger.info(f"Goal set successfully for {self.scope}: lat={lat}, lon={lon}")
+            else:
+                logger.warning(f"Goal of {self.scope} refused: {message}")
+            return success, message
+        except UnroutableGoal as e:
+            logger.warning(f"Rejected goal for {self.scope}: {e}")
+            raise
         except Exception as e:
             logger.error(f"Error setting goal for {self.scope}: {e}", exc_info=True)
             raise
 
+    def _route(self, x, y):
+        """
+        Shortest route from the vehicle to (x, y) in map coordinates, see OrientationParser.shortestRoute.
+        Until the vehicle reports a position on a lanelet, only checks that the goal lies on one and returns None.
+        """
+        pose = self.pose
+        try:
+            if pose is None:
+                self.orientationGen.matchGoal(x, y)
+                return None
+            return self.orientationGen.shortestRoute((pose.x, pose.y), (x, y))
+        except ValueError as e:
+            raise UnroutableGoal(str(e)) from e
+
+    def previewRoute(self, lat, lon):
+        """Route the vehicle would take to a goal, with its geometry in lat/lon; raises UnroutableGoal"""
+        from lanelet2.core import BasicPoint3d, GPSPoint
+
+        start = time.perf_counter()
+        if not self._ensure_orientation_parser():
+            raise RuntimeError(f"OrientationParser initialization failed for {self.scope}")
+        if not self.poseValid:
+            raise UnroutableGoal(f'Position of {self.scope} is not known yet')
+        coordinate = self.projector.forward(GPSPoint(float(lat), float(lon), 0))
+        route = self._route(coordinate.x, coordinate.y)
+        if route is None:
+            raise UnroutableGoal(f'{self.scope} is not on a lanelet')
+        geometry = []
+        for x, y in route['points']:
+            gps = self.projector.reverse(BasicPoint3d(x, y, 0.0))
+            geometry.append([gps.lat, gps.lon])
+        return {
+            'scope': self.scope,
+            'lanelets': route['lanelets'],
+            'length_m': round(route['length'], 2),
+            'geometry': geometry,
+            'compute_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
     def update_map(self, map_path, origin_lat, origin_lon):
         self.originX = float(origin_lat)
         self.originY = float(origin_lon)
-        self.projector = UtmProjector(Origin(self.originX, self.originY))
+        self.projector = make_projector(self.originX, self.originY)
+        self.map_config = (map_path, self.originX, self.originY)
+        # Lanelet ids of the previous map mean nothing on the new one
+        self._laneletId = None
         try:
-            # Suppress all output (including stderr) from lanelet2 parsing
-            import sys
-            import io
-            old_stdout = sys.stdout
-            old_stderr = sys.stderr
-            sys.stdout = io.StringIO()
-            sys.stderr = io.StringIO()
-            
-            try:
-                self.orientationGen = OrientationParser(path=map_path, originX=self.originX, originY=self.originY)
-            finally:
-                # Restore stdout/stderr
-                sys.stdout = old_stdout
-                sys.stderr = old_stderr
+            self.orientationGen = load_orientation_parser(*self.map_config)
         except Exception as e:
             logger.info(f"Failed to update OrientationParser with map {map_path}: {e}")
             self.orientationGen = None
-            self.orientationGen = None
+        # Project the newest position again with the new origin
+        self.kinematics.invalidate()
 
     def engage(self):
-        self.publisher_gate_mode.put(GateMode(data=GateMode.DATA['AUTO'].value).serialize())
+        self.set_auto_gate_mode()
 
         # Ensure Autoware receives the gate mode change before the operation mode change
         time.sleep(1)
 
+        self.change_to_autonomous()
+
+    def set_auto_gate_mode(self):
+        self.publisher_gate_mode.put(GateMode(data=GateMode.DATA['AUTO'].value).serialize())
+
+    def change_to_autonomous(self):
+        """Returns (success, message) of the change_to_autonomous reply, see service_status"""
         replies = self.session.get(self.topic_prefix + SET_AUTO_MODE_KEY_EXPR)
-        for reply in replies:
-            try:
-                print(">> Received ('{}': {})".format(reply.ok.key_expr, ChangeOperationModeResponse.deserialize(reply.ok.payload.to_bytes())))
-            except Exception as e:
-                print(f'Failed to handle response: {e}')
+        success, message = service_status(replies, ChangeOperationModeResponse, 'change_to_autonomous')
+        if not success:
+            logger.warning(f"{self.scope} refused to change to autonomous: {message}")
+        return success, message
 
 
 class PoseServer:
@@ -219,6 +572,12 @@ class PoseServer:
         self.use_bridge_ros2dds = use_bridge_ros2dds
         self.session = session
         self.vehicles = {}
+        self.map_config = None
+        # Shared by the batch endpoints, so that a request does not start threads of its own
+        self.batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+    def close(self):
+        self.batch_executor.shutdown(wait=False)
 
     def findVehicles(self, time=10):
         # ✓ NEW: Save goal data before clearing vehicles
@@ -255,7 +614,7 @@ class PoseServer:
             
         for scope in self.vehicles.keys():
             try:
-                self.vehicles[scope] = VehiclePose(self.session, scope)
+                self.vehicles[scope] = VehiclePose(self.session, scope, map_config=self.map_config)
                 
                 # ✓ NEW: Restore goal data if it was backed up
                 if scope in goal_backup:
@@ -265,26 +624,60 @@ class PoseServer:
                     self.vehicles[scope].goalLat = restored['goalLat']
                     self.vehicles[scope].goalLon = restored['goalLon']
                     self.vehicles[scope].goalValid = restored['goalValid']
-                    print(f"Goal restored for {scope}")
+                    logger.info(f"Goal restored for {scope}")
                     
             except Exception as e:
-                print(f"Failed to initialize VehiclePose for {scope}: {e}")
+                logger.error(f"Failed to initialize VehiclePose for {scope}: {e}")
                 self.vehicles[scope] = None
+        versions.bump('pose')
+        versions.bump('goal')
 
     def update_map(self, map_path, origin_lat, origin_lon):
+        self.map_config = (map_path, float(origin_lat), float(origin_lon))
         for scope, vehicle in self.vehicles.items():
             if vehicle is not None:
                 vehicle.update_map(map_path, origin_lat, origin_lon)
 
+    def current_map(self):
+        """(OrientationParser, projector) of the current map"""
+        if self.map_config is not None:
+            return load_orientation_parser(*self.map_config), make_projector(*self.map_config[1:])
+        return load_orientation_parser(), make_projector(os.environ['REACT_APP_MAP_ORIGIN_LAT'], os.environ['REACT_APP_MAP_ORIGIN_LON'])
+
+    def preload_map(self):
+        """Parse the current map and build its routing graph and goal index ahead of the first goal"""
+        parser, _ = self.current_map()
+        parser.getRoutingGraph()
+        parser.getCenterlineIndex()
+
+    def snapGoals(self, points):
+        """
+        Snap (lat, lon) points to the nearest lanelet centerline of the current map.
+        Returns per point the snapped lat/lon, the lanelet id, the lane heading (deg) and the distance moved (m).
+        """
+        from lanelet2.core import BasicPoint3d, GPSPoint
+
+        parser, projector = self.current_map()
+        coordinates = [projector.forward(GPSPoint(float(lat), float(lon), 0)) for lat, lon in points]
+        results = []
+        for x, y, lanelet_id, yaw, moved in parser.getCenterlineIndex().snap([(c.x, c.y) for c in coordinates]):
+            gps = projector.reverse(BasicPoint3d(x, y, 0.0))
+            results.append({'lat': gps.lat, 'lon': gps.lon, 'lanelet': lanelet_id, 'heading': math.degrees(yaw), 'distance_m': round(moved, 3)})
+        return results
+
     def returnPose(self):
         poseInfo = []
         for scope, vehicle in self.vehicles.items():
             if vehicle is not None:
+                # One read of the slot, so that every field comes from the same sample
+                pose = vehicle.pose or NO_POSE
                 poseInfo.append({
                     'name': scope, 
-                    'lat': vehicle.lat, 
-                    'lon': vehicle.lon,
-                    'heading': vehicle.heading
+                    'lat': pose.lat, 
+                    'lon': pose.lon,
+                    'heading': pose.heading,
+                    'lanelet': pose.lanelet,
+                    'arc': None if pose.arc is None else round(pose.arc, 2),
                 })
         return poseInfo
 
@@ -295,18 +688,83 @@ class PoseServer:
                 goalPoseInfo.append({'name': scope, 'lat': vehicle.goalLat, 'lon': vehicle.goalLon})
         return goalPoseInfo
 
-    def setGoal(self, scope, lat, lon):
+    def setGoal(self, scope, lat, lon, snap=False):
         if scope in self.vehicles.keys() and self.vehicles[scope] is not None:
-            self.vehicles[scope].setGoal(lat, lon)
+            self.vehicles[scope].setGoal(lat, lon, snap)
         else:
             logger.warning(f"Vehicle {scope} not found or not initialized for goal setting")
 
+    def previewRoute(self, scope, lat, lon):
+        vehicle = self.vehicles.get(scope)
+        if vehicle is None:
+            raise UnroutableGoal(f'Vehicle {scope} not found or not initialized')
+        return vehicle.previewRoute(lat, lon)
+
     def engage(self, scope):
         if scope in self.vehicles.keys() and self.vehicles[scope] is not None:
             self.vehicles[scope].engage()
         else:
             logger.warning(f"Vehicle {scope} not found or not initialized for engagement")
 
+    def _run_batch(self, scopes, action):
+        """
+        Run action(vehicle) --> (success, message) for every scope concurrently on the batch executor,
+        returning per-vehicle results.
+        """
+
+        def run_one(scope):
+            start = time.perf_counter()
+            result = {'scope': scope, 'success': False, 'message': None, 'error': None}
+            vehicle = self.vehicles.get(scope)
+            if vehicle is None:
+                result['error'] = f'Vehicle {scope} not found or not initialized'
+            else:
+                try:
+                    result['success'], result['message'] = action(vehicle)
+                    if not result['success']:
+                        result['error'] = result['message'] or 'Refused by the vehicle'
+                except Exception as e:
+                    result['error'] = str(e)
+            result['latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            return result
+
+        return list(self.batch_executor.map(run_one, scopes))
+
+    def setGoals(self, goals, snap=False):
+        """
+        Set the goal of many vehicles at once.
+        goals is a list of (scope, lat, lon); the clear/set route queries of all vehicles run concurrently.
+        Raises ValueError when a scope appears more than once.
+        """
+        targets = {scope: (lat, lon) for scope, lat, lon in goals}
+        if len(targets) != len(goals):
+            duplicates = sorted(scope for scope, count in Counter(scope for scope, _, _ in goals).items() if count > 1)
+            raise ValueError(f'More than one goal for {", ".join(duplicates)}')
+
+        # Parse the map once up front so the workers share it instead of racing to load it
+        for scope in targets:
+            vehicle = self.vehicles.get(scope)
+            if vehicle is not None and vehicle._ensure_orientation_parser():
+                vehicle.orientationGen.getRoutingGraph()
+
+        return self._run_batch(list(targets), lambda vehicle: vehicle.setGoal(*targets[vehicle.scope], snap=snap))
+
+    def engageAll(self, scopes):
+        """
+        Engage many vehicles at once.
+        The gate mode of every vehicle is switched first, so that a single settle delay covers the whole fleet.
+        """
+        scopes = list(dict.fromkeys(scopes))
+        for scope in scopes:
+            vehicle = self.vehicles.get(scope)
+            if vehicle is not None:
+                vehicle.set_auto_gate_mode()
+
+        # Ensure Autoware receives the gate mode change before the operation mode change
+        time.sleep(1)
+
+        return self._run_batch(scopes, lambda vehicle: vehicle.change_to_autonomous())
+
 
 if __name__ == '__main__':
     session = zenoh.open()
@@ -0,0 +1,57 @@
+"""
+Traffic classes of the zenoh traffic of the FMS.
+
+Control commands, telemetry and multi-megabyte camera frames can share one session and so one link per peer.
+zenoh keeps a transmission queue per priority on every link and empties the higher ones first, so the class of a
+publisher is what keeps a burst of frames from delaying a teleop command:
+
+- control: the periodic control_cmd of teleop. REAL_TIME priority, express (sent at once instead of waiting to be
+  batched) and DROP congestion control: a command held back by a congested link is stale by the next tick, which
+  carries a newer one.
+- command: one-shot state changes (gate mode, gear). INTERACTIVE_HIGH, express, and BLOCK so that they are not lost.
+- telemetry: status, pose and CPU topics. DATA priority and DROP: a sample held back is superseded by the next.
+- video: camera frames. DATA_LOW and DROP, so that frames queue behind the telemetry of the same vehicle.
+
+The FMS publishes control and commands toward the vehicles; telemetry and video flow the other way, and their
+classes are for the publishers on that side: the simulated fleet of the benchmarks, the replay of the recorder and
+my_scripts/zenoh_cpu_bridge.py (see traffic_class). Priorities only order the traffic inside a link. With
+FMS_VIDEO_SESSION=1, camera subscriptions also get a session of their own listening on FMS_VIDEO_LISTEN; vehicles
+connecting there send their frames on a separate link.
+"""
+
+import json
+import os
+
+import zenoh
+
+CONFIG_FILE = 'config.json5'
+VIDEO_SESSION = os.environ.get('FMS_VIDEO_SESSION', '0').lower() in ('1', 'true', 'yes')
+VIDEO_LISTEN = os.environ.get('FMS_VIDEO_LISTEN', 'tcp/0.0.0.0:7888')
+
+TRAFFIC_CLASSES = {
+    'control': {'priority': zenoh.Priority.REAL_TIME, 'express': True, 'congestion_control': zenoh.CongestionControl.DROP},
+    'command': {'priority': zenoh.Priority.INTERACTIVE_HIGH, 'express': True, 'congestion_control': zenoh.CongestionControl.BLOCK},
+    'telemetry': {'priority': zenoh.Priority.DATA, 'congestion_control': zenoh.CongestionControl.DROP},
+    'video': {'priority': zenoh.Priority.DATA_LOW, 'congestion_control': zenoh.CongestionControl.DROP},
+}
+# Key expressions ending like this carry camera frames
+VIDEO_KEY_SUFFIXES = ('/image_raw', '/image_raw/compressed')
+
+
+def declare_publisher(session, key_expr, traffic_class):
+    """session.declare_publisher with the priority, express flag and congestion control of a traffic class"""
+    return session.declare_publisher(key_expr, **TRAFFIC_CLASSES[traffic_class])
+
+
+def traffic_class(key_expr):
+    """Class of a vehicle-side topic: video for camera frames, telemetry for the rest"""
+    return 'video' if key_expr.endswith(VIDEO_KEY_SUFFIXES) else 'telemetry'
+
+
+def open_video_session(config_file=CONFIG_FILE):
+    """A second session for camera subscriptions when FMS_VIDEO_SESSION is set, else None (use the main session)"""
+    if not VIDEO_SESSION:
+        return None
+    conf = zenoh.Config.from_file(config_file)
+    conf.insert_json5('listen/endpoints', json.dumps([VIDEO_LISTEN]))
+    return zenoh.open(conf)
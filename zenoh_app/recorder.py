@@ -0,0 +1,331 @@
+"""
+Recorder and replay tool for the raw zenoh traffic of the fleet.
+
+The recorder subscribes to a set of key expressions and appends every sample (raw CDR payload, reception time and
+key id) to an append-only binary log, with a small sidecar index to seek into it. The replay republishes a log at
+its original pace, N times faster, or as fast as possible, to reproduce field incidents or load the FMS with real
+traffic.
+
+Log format (<log>): a header, then records of HEADER = (kind, key id, time in ns, payload length) + payload.
+A KEY record maps a key id to its key expression (payload), a SAMPLE record carries the payload of a key.
+Index format (<log>.idx): entries of INDEX_ENTRY = (kind, time in ns, offset of the record in the log), one for
+every KEY record and one CHECKPOINT every INDEX_INTERVAL of recorded time. A truncated last record, left by a
+crash, is ignored when reading.
+
+Usage:
+    python -m zenoh_app.recorder record incident.fmsrec                      # default topics of every vehicle
+    python -m zenoh_app.recorder record incident.fmsrec -k 'v1/**'          # everything of one vehicle
+    python -m zenoh_app.recorder replay incident.fmsrec --speed 4 --announce
+    python -m zenoh_app.recorder info incident.fmsrec
+"""
+
+import argparse
+import bisect
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+
+from . import qos
+from .pose_service import GET_GOAL_POSE_KEY_EXPR, GET_POSE_KEY_EXPR
+from .status_autoware import TOPIC_CPU, TOPIC_GEAR, TOPIC_STEER, TOPIC_TURN, TOPIC_VELOCITY
+
+MAGIC = b'FMSREC\x00\x01'
+HEADER = struct.Struct('<BHqI')
+INDEX_ENTRY = struct.Struct('<Bqq')
+KEY = 1
+SAMPLE = 2
+CHECKPOINT = 3
+INDEX_INTERVAL_NS = 1_000_000_000
+FLUSH_INTERVAL = 1.0
+
+# '**' matches the scope of every vehicle, with or without the '/rt' prefix of zenoh-bridge-dds
+DEFAULT_KEY_EXPRS = [
+    '**' + topic for topic in (GET_POSE_KEY_EXPR, GET_GOAL_POSE_KEY_EXPR, TOPIC_CPU, TOPIC_GEAR, TOPIC_TURN, TOPIC_STEER, TOPIC_VELOCITY)
+]
+
+
+def index_path(path):
+    return str(path) + '.idx'
+
+
+class LogWriter:
+    """Appends records to a log; samples are queued by the zenoh callbacks and written by one thread"""
+
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.log = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+        if new:
+            self.log.write(MAGIC)
+        # Key expressions already in the log keep their ids when appending to it
+        self.keys = {key: key_id for key_id, key in LogReader(path).keys.items()} if not new else {}
+        self.last_checkpoint = None
+        self.samples = 0
+        self.bytes = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, key, payload, t_ns=None):
+        """Thread-safe, does not block on disk"""
+        self.queue.put((key, t_ns or time.time_ns(), payload))
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self.write_sample(*item)
+            if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def write_record(self, kind, key_id, t_ns, payload):
+        offset = self.log.tell()
+        self.log.write(HEADER.pack(kind, key_id, t_ns, len(payload)))
+        self.log.write(payload)
+        return offset
+
+    def write_sample(self, key, t_ns, payload):
+        key_id = self.keys.get(key)
+        if key_id is None:
+            key_id = len(self.keys)
+            if key_id > 0xFFFF:
+                raise ValueError(f'Too many key expressions in {self.path}')
+            self.keys[key] = key_id
+            offset = self.write_record(KEY, key_id, t_ns, key.encode())
+            self.index.write(INDEX_ENTRY.pack(KEY, t_ns, offset))
+        offset = self.write_record(SAMPLE, key_id, t_ns, payload)
+        if self.last_checkpoint is None or t_ns - self.last_checkpoint >= INDEX_INTERVAL_NS:
+            self.index.write(INDEX_ENTRY.pack(CHECKPOINT, t_ns, offset))
+            self.last_checkpoint = t_ns
+        self.samples += 1
+        self.bytes += len(payload)
+
+    def flush(self):
+        self.log.flush()
+        self.index.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.log.close()
+        self.index.close()
+
+
+class LogReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a recorder log')
+        self.keys = {}
+        self.checkpoints = []
+        if os.path.exists(index_path(path)):
+            self.load_index()
+        else:
+            # No index (e.g. copied without it): find the keys with a full scan
+            for kind, key_id, _, payload in self.records(len(MAGIC)):
+                if kind == KEY:
+                    self.keys[key_id] = payload.decode()
+
+    def load_index(self):
+        with open(index_path(self.path), 'rb') as index, open(self.path, 'rb') as log:
+            data = index.read()
+            for i in range(len(data) // INDEX_ENTRY.size):
+                kind, t_ns, offset = INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+                if kind == CHECKPOINT:
+                    self.checkpoints.append((t_ns, offset))
+                elif kind == KEY:
+                    log.seek(offset)
+                    header = log.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    _, key_id, _, length = HEADER.unpack(header)
+                    self.keys[key_id] = log.read(length).decode()
+
+    def records(self, offset):
+        """Yield (kind, key id, time in ns, payload) from offset to the end of the log"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                kind, key_id, t_ns, length = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield kind, key_id, t_ns, payload
+
+    def samples(self, start_ns=None):
+        """Yield (key expression, time in ns, payload), from the last checkpoint before start_ns"""
+        offset = len(MAGIC)
+        if start_ns is not None and self.checkpoints:
+            i = bisect.bisect_right(self.checkpoints, (start_ns, float('inf'))) - 1
+            if i >= 0:
+                offset = self.checkpoints[i][1]
+        for kind, key_id, t_ns, payload in self.records(offset):
+            if kind != SAMPLE or (start_ns is not None and t_ns < start_ns):
+                continue
+            yield self.keys[key_id], t_ns, payload
+
+    def first_time(self):
+        if self.checkpoints:
+            return self.checkpoints[0][0]
+        return next((t_ns for _, t_ns, _ in self.samples()), None)
+
+    def info(self):
+        counts = {}
+        first = last = None
+        for key, t_ns, payload in self.samples():
+            count = counts.setdefault(key, [0, 0])
+            count[0] += 1
+            count[1] += len(payload)
+            first = t_ns if first is None else first
+            last = t_ns
+        return {
+            'path': self.path,
+            'duration_s': round((last - first) / 1e9, 3) if first is not None else 0,
+            'samples': sum(count[0] for count in counts.values()),
+            'keys': {key: {'samples': count[0], 'bytes': count[1]} for key, count in sorted(counts.items())},
+        }
+
+
+def record(session, path, key_exprs=DEFAULT_KEY_EXPRS, duration=None):
+    writer = LogWriter(path)
+    subscribers = [
+        session.declare_subscriber(key_expr, lambda sample: writer.put(str(sample.key_expr), sample.payload.to_bytes())) for key_expr in key_exprs
+    ]
+    print(f'Recording {", ".join(key_exprs)} to {path}')
+    start = time.monotonic()
+    try:
+        while duration is None or time.monotonic() - start < duration:
+            time.sleep(1)
+            print(f'\r{writer.samples} samples, {writer.bytes / 1e6:.1f} MB', end='', flush=True)
+    except KeyboardInterrupt:
+        pass
+    print()
+    for subscriber in subscribers:
+        subscriber.undeclare()
+    writer.close()
+
+
+class Announcer:
+    """Answer the admin-space queries of zenoh-bridge-ros2dds for the replayed vehicles, so that the FMS finds them"""
+
+    def __init__(self, session):
+        self.session = session
+        self.queryables = []
+        self.scopes = set()
+
+    def add(self, key):
+        if not key.endswith(GET_POSE_KEY_EXPR):
+            return
+        scope = key[: -len(GET_POSE_KEY_EXPR)]
+        if scope in self.scopes or '/' in scope:
+            return
+        self.scopes.add(scope)
+        bridge = uuid.uuid4().hex
+        self.queryables += [
+            self.session.declare_queryable(
+                f'@/{bridge}/ros2/config', lambda query: query.reply(query.key_expr, json.dumps({'namespace': '/' + scope}))
+            ),
+            self.session.declare_queryable(f'@/{bridge}/ros2/pub/{key}', lambda query: query.reply(query.key_expr, json.dumps({'name': key}))),
+        ]
+
+    def close(self):
+        for queryable in self.queryables:
+            queryable.undeclare()
+
+
+def replay(session, path, speed=1.0, start=0.0, loop=False, announce=False):
+    """Republish a log; speed is a multiple of the recorded pace, 0 publishes as fast as possible"""
+    reader = LogReader(path)
+    first = reader.first_time()
+    if first is None:
+        print(f'{path} has no samples')
+        return
+    start_ns = first + int(start * 1e9)
+    publishers = {}
+    announcer = Announcer(session) if announce else None
+    if announcer is not None:
+        for key in reader.keys.values():
+            announcer.add(key)
+    published = 0
+    try:
+        while True:
+            wall_start = time.perf_counter()
+            for key, t_ns, payload in reader.samples(start_ns):
+                if speed > 0:
+                    delay = (t_ns - start_ns) / 1e9 / speed - (time.perf_counter() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                publisher = publishers.get(key)
+                if publisher is None:
+                    publisher = publishers[key] = qos.declare_publisher(session, key, qos.traffic_class(key))
+                publisher.put(payload)
+                published += 1
+            print(f'Replayed {published} samples in {time.perf_counter() - wall_start:.1f} s')
+            if not loop:
+                break
+    except KeyboardInterrupt:
+        pass
+    for publisher in publishers.values():
+        publisher.undeclare()
+    if announcer is not None:
+        announcer.close()
+
+
+def main():
+    import zenoh
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config.json5', help='zenoh config file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help='record zenoh samples to a log')
+    record_parser.add_argument('log')
+    record_parser.add_argument(
+        '-k', '--key', action='append', help='key expression to record (repeatable, default: pose, route, status and CPU topics)'
+    )
+    record_parser.add_argument('--duration', type=float, help='seconds to record (default: until Ctrl-C)')
+
+    replay_parser = commands.add_parser('replay', help='republish a log')
+    replay_parser.add_argument('log')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='multiple of the recorded pace, 0 for as fast as possible')
+    replay_parser.add_argument('--start', type=float, default=0.0, help='seconds into the log to start from')
+    replay_parser.add_argument('--loop', action='store_true', help='replay again from the start when done')
+    replay_parser.add_argument('--announce', action='store_true', help='answer the zenoh-bridge-ros2dds admin space for the replayed vehicles')
+
+    info_parser = commands.add_parser('info', help='summarize a log')
+    info_parser.add_argument('log')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(json.dumps(LogReader(args.log).info(), indent=2))
+        return
+
+    session = zenoh.open(zenoh.Config.from_file(args.config))
+    try:
+        if args.command == 'record':
+            record(session, args.log, args.key or DEFAULT_KEY_EXPRS, args.duration)
+        else:
+            replay(session, args.log, args.speed, args.start, args.loop, args.announce)
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+State hub shared between the zenoh ingest process and any number of stateless API workers.
+
+The ingest process owns the FleetState and periodically publishes a JSON snapshot of it (and the latest JPEG
+camera frame) into shared memory, guarded by a sequence counter so that readers never see a torn write. Commands
+(goals, teleop, map switch...) are forwarded to the owner over a local socket. The socket lives in a directory private
+to the user ($XDG_RUNTIME_DIR), and the owner draws a random authentication key at startup that workers read from a
+0600 file next to it.
+
+Usage:
+    python -m zenoh_app.state_hub                                 # ingest process, owns the zenoh session
+    FMS_STATE_HUB=fms uvicorn api_server:app --workers 4          # stateless workers
+"""
+
+import json
+import logging
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HUB = 'fms'
+AUTHKEY_SIZE = 32
+SNAPSHOT_SIZE = 4 * 1024 * 1024
+VIDEO_SIZE = 8 * 1024 * 1024
+PUBLISH_RATE_HZ = 20
+
+# Methods of FleetState that workers may call
+COMMANDS = {
+    'list_autoware',
+    'status',
+    'status_history',
+    'find_vehicles',
+    'set_goal',
+    'route_preview',
+    'snap_goals',
+    'engage',
+    'set_goals',
+    'engage_all',
+    'teleop_startup',
+    'teleop_stop',
+    'teleop_gear',
+    'teleop_velocity',
+    'teleop_turn',
+    'teleop_input',
+    'teleop_attach',
+    'teleop_detach',
+    'apply_map',
+}
+
+# Header of a store: sequence number (odd while a write is in progress), payload length
+HEADER = struct.Struct('<QI')
+
+
+def hub_dir():
+    """Directory of the hub socket and key: $XDG_RUNTIME_DIR, else a per-user 0700 directory in the temp dir"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+    path = os.path.join(tempfile.gettempdir(), f'fms-{os.getuid()}')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f'{path} is not a directory private to the current user')
+    return path
+
+
+def hub_address(name):
+    return os.path.join(hub_dir(), f'{name}_hub.sock')
+
+
+def hub_key_path(name):
+    return os.path.join(hub_dir(), f'{name}_hub.key')
+
+
+def write_authkey(name):
+    """Draw a new random authentication key and store it in a file only the current user can read"""
+    authkey = os.urandom(AUTHKEY_SIZE)
+    path = hub_key_path(name)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+
+def read_authkey(name):
+    with open(hub_key_path(name), 'rb') as f:
+        return f.read()
+
+
+class SnapshotStore:
+    """Single-writer, multi-reader byte buffer in shared memory, with seqlock consistency"""
+
+    def __init__(self, name, create=False, size=SNAPSHOT_SIZE):
+        self.name = name
+        if create:
+            try:
+                shared_memory.SharedMemory(name=name).unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator may unlink the segment when it exits
+            try:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                pass
+        self.owner = create
+        self.capacity = self.shm.size - HEADER.size
+        self.seq = 0
+
+    def write(self, data):
+        if len(data) > self.capacity:
+            raise ValueError(f'{len(data)} bytes do not fit in {self.name} ({self.capacity} bytes)')
+        buf = self.shm.buf
+        _, length = HEADER.unpack_from(buf, 0)
+        HEADER.pack_into(buf, 0, self.seq + 1, length)
+        buf[HEADER.size : HEADER.size + len(data)] = data
+        self.seq += 2
+        HEADER.pack_into(buf, 0, self.seq, len(data))
+
+    def version(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def read(self, retries=100):
+        """Return (seq, bytes); bytes is None before the first write"""
+        buf = self.shm.buf
+        for _ in range(retries):
+            seq, length = HEADER.unpack_from(buf, 0)
+            if seq & 1:
+                continue
+            data = bytes(buf[HEADER.size : HEADER.size + length])
+            if HEADER.unpack_from(buf, 0)[0] == seq:
+                return seq, (data if seq else None)
+        raise RuntimeError(f'{self.name} is being rewritten too fast to read')
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class HubServer:
+    """Publishes the FleetState snapshot and serves the commands of the workers"""
+
+    def __init__(self, fleet, name=DEFAULT_HUB, rate_hz=PUBLISH_RATE_HZ):
+        self.fleet = fleet
+        self.name = name
+        self.period = 1.0 / rate_hz
+        self.store = SnapshotStore(name, create=True)
+        self.video = SnapshotStore(name + '_video', create=True, size=VIDEO_SIZE)
+
+        address = hub_address(name)
+        if os.path.exists(address):
+            os.unlink(address)
+        self.listener = Listener(address, family='AF_UNIX', authkey=write_authkey(name))
+
+        self.end_event = threading.Event()
+        self.publish_thread = threading.Thread(target=self.publish, daemon=True)
+        self.accept_thread = threading.Thread(target=self.accept, daemon=True)
+        self.publish_thread.start()
+        self.accept_thread.start()
+
+    def publish(self):
+        last_frame = None
+        deadline = time.perf_counter()
+        while not self.end_event.is_set():
+            try:
+                self.store.write(json.dumps(self.fleet.snapshot()).encode())
+                frame = self.fleet.jpeg_frame()
+                if frame is not None and frame is not last_frame:
+                    self.video.write(frame)
+                    last_frame = frame
+            except Exception as e:
+                logger.error(f'Failed to publish the state snapshot: {e}')
+            deadline += self.period
+            self.end_event.wait(max(0.0, deadline - time.perf_counter()))
+
+    def accept(self):
+        while not self.end_event.is_set():
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if not self.end_event.is_set():
+                    logger.error(f'Failed to accept a worker connection: {e}')
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if method not in COMMANDS:
+                    conn.send(('error', f'Unknown command {method}'))
+                    continue
+                try:
+                    conn.send(('ok', getattr(self.fleet, method)(*args, **kwargs)))
+                except ValueError as e:
+                    # Invalid input (e.g. an unroutable goal), raised again as ValueError in the worker
+                    conn.send(('invalid', str(e)))
+                except Exception as e:
+                    logger.error(f'Command {method} failed: {e}')
+                    conn.send(('error', str(e)))
+
+    def close(self):
+        self.end_event.set()
+        self.listener.close()
+        self.publish_thread.join()
+        self.store.close()
+        self.video.close()
+        try:
+            os.unlink(hub_key_path(self.name))
+        except FileNotFoundError:
+            pass
+
+
+class HubClient:
+    """Worker-side view of the FleetState: reads come from the shared snapshot, commands go to the owner"""
+
+    def __init__(self, name=DEFAULT_HUB):
+        self.name = name
+        self.address = hub_address(name)
+        self.store = SnapshotStore(name)
+        self.video = SnapshotStore(name + '_video')
+        self.local = threading.local()
+        self.snapshot_seq = -1
+        self.snapshot_data = {}
+
+    def close(self):
+        self.store.close()
+        self.video.close()
+
+    def call(self, method, *args, **kwargs):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Read the key on every connection, the owner draws a new one when it restarts
+            conn = Client(self.address, family='AF_UNIX', authkey=read_authkey(self.name))
+            self.local.conn = conn
+        try:
+            conn.send((method, args, kwargs))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            # The owner restarted, reconnect on the next call
+            self.local.conn = None
+            raise
+        if status == 'invalid':
+            raise ValueError(result)
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def snapshot(self):
+        seq = self.store.version()
+        if seq != self.snapshot_seq:
+            seq, data = self.store.read()
+            self.snapshot_data = json.loads(data) if data else {}
+            self.snapshot_seq = seq
+        return self.snapshot_data
+
+    ### Reads
+    def version(self, kind, scope=None):
+        versions = self.snapshot().get('versions', {})
+        if scope is None:
+            return versions.get(kind, 0)
+        return versions.get(kind, {}).get(scope, 0)
+
+    @property
+    def epoch(self):
+        return self.snapshot().get('epoch', '')
+
+    @property
+    def map_ready(self):
+        return self.snapshot().get('map_ready', False)
+
+    def vehicles(self):
+        return self.snapshot().get('vehicles', [])
+
+    def pose(self):
+        return self.snapshot().get('pose', [])
+
+    def goal_pose(self):
+        return self.snapshot().get('goalPose', [])
+
+    def status(self, scope):
+        status = self.snapshot().get('status', {}).get(scope)
+        if status is None:
+            # First request for this vehicle: let the owner subscribe to it
+            status = self.call('status', scope)
+        return status
+
+    def teleop_status(self, scope=None):
+        snapshot = self.snapshot()
+        status = snapshot.get('teleop', {}).get(scope or snapshot.get('teleop_scope'))
+        return status or {'velocity': '---', 'gear': '---', 'steering': '---'}
+
+    def scheduler_stats(self):
+        return self.snapshot().get('scheduler', {})
+
+    def alerts(self):
+        return self.snapshot().get('alerts', {'active': [], 'recent': []})
+
+    def jpeg_frame(self):
+        _, data = self.video.read()
+        return data
+
+    ### Commands
+    def __getattr__(self, method):
+        if method not in COMMANDS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+
+if __name__ == '__main__':
+    import zenoh
+
+    from . import log_pipeline, qos
+    from .fleet_state import FleetState
+    from .map_registry import REGISTRY as map_registry
+
+    log_pipeline.setup(logging.INFO)
+    name = os.environ.get('FMS_STATE_HUB', DEFAULT_HUB)
+
+    session = zenoh.open(zenoh.Config.from_file('config.json5'))
+    video_session = qos.open_video_session()
+    fleet = FleetState(session, video_session=video_session)
+    try:
+        _, info = map_registry.current()
+        fleet.apply_map(info)
+    except Exception as e:
+        logger.error(f'failed to apply map config on startup: {e}')
+    fleet.preload_map()
+
+    hub = HubServer(fleet, name)
+    logger.info(f'State hub {name} ready on {hub_address(name)}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    hub.close()
+    fleet.close()
+    if video_session is not None:
+        video_session.close()
+    session.close()
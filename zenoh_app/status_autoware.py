@@ -1,10 +1,16 @@
 import json
-import time
+import logging
 import zenoh
-import threading
 import sys
-import os
 import math 
+import struct
+
+from . import telemetry_history, telemetry_table, versions
+from .latest_sample import LatestSample
+from .log_pipeline import throttle
+from .metrics import instrument_callback
+
+logger = logging.getLogger(__name__)
 # --- IMPORTS ---
 # We use the files you already have. 
 # We use Tier4 definitions to read Universe data where compatible (TurnSignal).
@@ -36,6 +42,7 @@ TOPIC_STEER     = '/vehicle/status/steering_status'
 TOPIC_VELOCITY  = '/vehicle/status/velocity_status'
 
 # --- GLOBAL CACHE ---
+# scope --> topic name --> LatestSample; samples are only decoded when read (see latest_sample.py)
 VEHICLE_CACHE = {}
 ACTIVE_SUBSCRIBERS = {}
 
@@ -51,88 +58,116 @@ def class2dict(instance):
             new_subdic[key] = class2dict(round(value, 4)) if isinstance(value, float) else class2dict(value)
     return new_subdic
 
-# --- CALLBACKS ---
-
-def callback_cpu(sample, scope):
-    try:
-        data = CpuUsage.deserialize(sample.payload.to_bytes())
-        d = class2dict(data)
-        try:
-            d['all']['status'] = CpuStatus.STATUS(d['all']['status']).name
-            print(d['all']['status'])
-            for i in range(len(d['cpus'])):
-                d['cpus'][i]['status'] = CpuStatus.STATUS(d['cpus'][i]['status']).name
-        except: pass
-        
-        if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
-        VEHICLE_CACHE[scope]['cpu'] = d
-    except Exception:
-        pass 
-
-def callback_gear(sample, scope):
-    try:
-        # Use GearReport (from your autoware_auto_vehicle_msgs.py)
-        data = GearReport.deserialize(sample.payload.to_bytes())
-        val = data.report 
-        
-        gear_str = "UNKNOWN"
-        # Universe Constants
-        if val == 2: gear_str = "DRIVE"
-        elif val == 20 or val == 3: gear_str = "REVERSE"
-        elif val == 22 or val == 4: gear_str = "PARKING"
-        elif val == 1: gear_str = "NEUTRAL"
-        elif val == 0: gear_str = "NONE"
-        
-        if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
-        VEHICLE_CACHE[scope]['gear'] = gear_str
-    except Exception as e:
-        print(f"[ERROR] Gear Parse: {e}")
-
-def callback_turn(sample, scope):
-    try:
-        # HERE IS THE FIX: Use TurnSignalStamped (from your tier4_external_api_msgs.py)
-        # It fits the binary data perfectly.
-        data = TurnSignalStamped.deserialize(sample.payload.to_bytes())
-        
-        # We access .turn_signal.data as you suggested
-        val = data.turn_signal.data
-        
-        turn_str = "NONE"
-        # Universe Constants (1=Left, 2=Right)
-        if val == 1: turn_str = "LEFT" 
-        elif val == 2: turn_str = "RIGHT"
-        elif val == 3: turn_str = "RIGHT" 
-        
-        if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
-        VEHICLE_CACHE[scope]['turn'] = turn_str
-    except Exception as e:
-        print(f"[ERROR] Turn Parse: {e}")
+# --- DECODERS ---
+# Called on read with the payload of the newest sample, they return the cached value
 
-def callback_steering(sample, scope):
+def decode_cpu(payload, scope):
+    data = CpuUsage.deserialize(payload)
+    d = class2dict(data)
     try:
-        # Use SteeringReport (from your autoware_auto_vehicle_msgs.py)
-        data = SteeringReport.deserialize(sample.payload.to_bytes())
-        val = data.steering_tire_angle
-        val= val*(180.0/math.pi)  # Convert to degrees
-        val= round(val,2)
-        
-        if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
-        VEHICLE_CACHE[scope]['steer'] = val
-    except Exception as e:
-        print(f"[ERROR] Steer Parse: {e}")
-
-def callback_velocity(sample, scope):
+        d['all']['status'] = CpuStatus.STATUS(d['all']['status']).name
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"CPU status of {scope}: {d['all']['status']}", extra=throttle(10))
+        for i in range(len(d['cpus'])):
+            d['cpus'][i]['status'] = CpuStatus.STATUS(d['cpus'][i]['status']).name
+    except: pass
+    return d
+
+def decode_gear(payload, scope):
+    # Use GearReport (from your autoware_auto_vehicle_msgs.py)
+    data = GearReport.deserialize(payload)
+    return gear_name(data.report)
+
+def gear_name(val):
+    gear_str = "UNKNOWN"
+    # Universe Constants
+    if val == 2: gear_str = "DRIVE"
+    elif val == 20 or val == 3: gear_str = "REVERSE"
+    elif val == 22 or val == 4: gear_str = "PARKING"
+    elif val == 1: gear_str = "NEUTRAL"
+    elif val == 0: gear_str = "NONE"
+    return gear_str
+
+def decode_turn(payload, scope):
+    # HERE IS THE FIX: Use TurnSignalStamped (from your tier4_external_api_msgs.py)
+    # It fits the binary data perfectly.
+    data = TurnSignalStamped.deserialize(payload)
+    
+    # We access .turn_signal.data as you suggested
+    val = data.turn_signal.data
+    
+    turn_str = "NONE"
+    # Universe Constants (1=Left, 2=Right)
+    if val == 1: turn_str = "LEFT" 
+    elif val == 2: turn_str = "RIGHT"
+    elif val == 3: turn_str = "RIGHT" 
+    return turn_str
+
+def decode_steering(payload, scope):
+    # Use SteeringReport (from your autoware_auto_vehicle_msgs.py)
+    data = SteeringReport.deserialize(payload)
+    val = data.steering_tire_angle
+    val= val*(180.0/math.pi)  # Convert to degrees
+    return round(val,2)
+
+def decode_velocity(payload, scope):
+    # Use VelocityReport (from your autoware_auto_vehicle_msgs.py)
+    data = VelocityReport.deserialize(payload)
+    val = data.longitudinal_velocity
+    val= val*(3.6)  # Convert to km/h
+    return round(val,2)
+
+
+# --- SCALAR READERS ---
+# Called by the subscriber callback on every sample, so that the history rollups see every peak and the table
+# stays current without readers. They read the few scalars kept there straight from the CDR payload, at the
+# offsets of the message layouts above, and leave the full decode to the readers.
+# A payload starts with a 4-byte encapsulation header; alignment counts from its end.
+
+CDR_HEADER = 4
+
+def _f32(payload, offset):
+    # Bit 0 of the encapsulation kind is set for little endian
+    return struct.unpack_from('<f' if payload[1] & 1 else '>f', payload, CDR_HEADER + offset)[0]
+
+def _u32(payload, offset):
+    return struct.unpack_from('<I' if payload[1] & 1 else '>I', payload, CDR_HEADER + offset)[0]
+
+def record_cpu(payload, scope):
+    # stamp (8), all: status (1, padded to 4), total, usr, nice, sys, idle; cpus: length, then 24-byte CpuStatus
+    total = _f32(payload, 12)
+    cores = {f'cpu{i}': _f32(payload, 40 + 24 * i) for i in range(_u32(payload, 32))}
+    telemetry_table.publish(scope, cpu_total=total)
+    telemetry_history.record(scope, cpu_total=total, **cores)
+
+def record_gear(payload, scope):
+    # stamp (8), report (uint8)
+    telemetry_table.publish(scope, gear=gear_name(payload[CDR_HEADER + 8]))
+
+def record_steering(payload, scope):
+    # stamp (8), steering_tire_angle
+    val = _f32(payload, 8)
+    telemetry_table.publish(scope, steer=val)
+    telemetry_history.record(scope, steer=val * (180.0 / math.pi))
+
+def record_velocity(payload, scope):
+    # header: stamp (8), frame_id (length with the NUL, then the bytes); longitudinal_velocity aligned to 4
+    offset = 12 + _u32(payload, 8)
+    val = _f32(payload, offset + -offset % 4)
+    telemetry_table.publish(scope, velocity=val)
+    telemetry_history.record(scope, velocity=val * 3.6)
+
+
+def read(scope, name, default):
+    """Decoded value of a topic of scope, default until its first sample or when it fails to decode"""
+    slot = VEHICLE_CACHE.get(scope, {}).get(name)
+    if slot is None:
+        return default
     try:
-        # Use VelocityReport (from your autoware_auto_vehicle_msgs.py)
-        data = VelocityReport.deserialize(sample.payload.to_bytes())
-        val = data.longitudinal_velocity
-        val= val*(3.6)  # Convert to km/h
-        val= round(val,2)
-        
-        if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
-        VEHICLE_CACHE[scope]['vel'] = val
+        return slot.get(default)
     except Exception as e:
-        print(f"[ERROR] Vel Parse: {e}")
+        logger.error(f"{name} parse failed for {scope}: {e}", extra=throttle(5))
+        return default
 
 
 # --- MANAGER ---
@@ -140,24 +175,35 @@ def ensure_subscribers(session, scope, use_bridge_ros2dds):
     if scope in ACTIVE_SUBSCRIBERS:
         return 
 
-    print(f"\n[INIT] Starting background subscribers for {scope}...")
+    logger.info(f"Starting background subscribers for {scope}...")
     ACTIVE_SUBSCRIBERS[scope] = {}
-    if scope not in VEHICLE_CACHE: VEHICLE_CACHE[scope] = {}
+    slots = VEHICLE_CACHE.setdefault(scope, {})
 
     prefix = scope if use_bridge_ros2dds else scope + '/rt'
 
-    def create_sub(topic, callback):
+    def create_sub(name, topic, decode, record=None):
         full_key = prefix + topic
-        sub = session.declare_subscriber(full_key, lambda s: callback(s, scope))
+        slot = slots[name] = LatestSample(name, lambda payload: decode(payload, scope))
+
+        def handle(sample):
+            slot.put(sample)
+            if record is not None:
+                try:
+                    record(sample.payload.to_bytes(), scope)
+                except Exception as e:
+                    logger.error(f"{name} sample of {scope} unreadable: {e}", extra=throttle(5))
+            versions.bump(('status', scope))
+
+        sub = session.declare_subscriber(full_key, instrument_callback(name, handle))
         return sub
 
-    ACTIVE_SUBSCRIBERS[scope]['cpu']   = create_sub(TOPIC_CPU, callback_cpu)
-    ACTIVE_SUBSCRIBERS[scope]['gear']  = create_sub(TOPIC_GEAR, callback_gear)
-    ACTIVE_SUBSCRIBERS[scope]['turn']  = create_sub(TOPIC_TURN, callback_turn)
-    ACTIVE_SUBSCRIBERS[scope]['steer'] = create_sub(TOPIC_STEER, callback_steering)
-    ACTIVE_SUBSCRIBERS[scope]['vel']   = create_sub(TOPIC_VELOCITY, callback_velocity)
-    
-    print(f"[INIT] Subscribers active for {scope}")
+    ACTIVE_SUBSCRIBERS[scope]['cpu']   = create_sub('cpu', TOPIC_CPU, decode_cpu, record_cpu)
+    ACTIVE_SUBSCRIBERS[scope]['gear']  = create_sub('gear', TOPIC_GEAR, decode_gear, record_gear)
+    ACTIVE_SUBSCRIBERS[scope]['turn']  = create_sub('turn', TOPIC_TURN, decode_turn)
+    ACTIVE_SUBSCRIBERS[scope]['steer'] = create_sub('steer', TOPIC_STEER, decode_steering, record_steering)
+    ACTIVE_SUBSCRIBERS[scope]['vel']   = create_sub('vel', TOPIC_VELOCITY, decode_velocity, record_velocity)
+
+    logger.info(f"Subscribers active for {scope}")
 
 
 # --- API FUNCTIONS ---
@@ -165,17 +211,15 @@ def ensure_subscribers(session, scope, use_bridge_ros2dds):
 def get_cpu_status(session, scope, use_bridge_ros2dds=True):
     ensure_subscribers(session, scope, use_bridge_ros2dds)
     default_cpu = {'all': {'status': 'WAIT', 'total': 0.0, 'sys':0.0, 'usr':0.0, 'idle':0.0}, 'cpus': []}
-    return VEHICLE_CACHE.get(scope, {}).get('cpu', default_cpu)
+    return read(scope, 'cpu', default_cpu)
 
 def get_vehicle_status(session, scope, use_bridge_ros2dds=True):
     ensure_subscribers(session, scope, use_bridge_ros2dds)
     
-    cache = VEHICLE_CACHE.get(scope, {})
-    
-    gear_str = cache.get('gear', "CONNECTING")
-    turn_str = cache.get('turn', "NONE")
-    steer_val = cache.get('steer', 0.0)
-    vel_val = cache.get('vel', 0.0)
+    gear_str = read(scope, 'gear', "CONNECTING")
+    turn_str = read(scope, 'turn', "NONE")
+    steer_val = read(scope, 'steer', 0.0)
+    vel_val = read(scope, 'vel', 0.0)
     
     # Construct Response for React App
     response = {
@@ -0,0 +1,130 @@
+"""
+Per-vehicle telemetry history at several resolutions, in bounded memory.
+
+Every metric of a vehicle (velocity in km/h, steering in degrees, CPU total and per-core usage in %) is kept in
+preallocated ring arrays: one with the raw samples and one per rollup period, where each row is a time bucket with
+its min, max, mean and sample count. The rollups are updated incrementally as samples arrive, so the bucket in
+progress is visible to readers, and the oldest rows are overwritten once a ring is full.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# Resolution --> (bucket period in seconds, 0 for raw samples; number of rows)
+RESOLUTIONS = {
+    'raw': (0, 600),
+    '1s': (1, 900),
+    '10s': (10, 720),
+    '1m': (60, 1440),
+}
+DEFAULT_RESOLUTION = '1s'
+
+
+class Ring:
+    def __init__(self, period, capacity):
+        self.period = period
+        self.capacity = capacity
+        self.t = np.zeros(capacity, dtype=np.float64)
+        self.min = np.zeros(capacity, dtype=np.float32)
+        self.max = np.zeros(capacity, dtype=np.float32)
+        self.mean = np.zeros(capacity, dtype=np.float32)
+        self.count = np.zeros(capacity, dtype=np.uint32)
+        # Index of the latest row, and number of rows in use
+        self.head = -1
+        self.size = 0
+
+    def add(self, t, value):
+        head = self.head
+        if self.period:
+            bucket = t - t % self.period
+            # Late samples are folded into the bucket in progress
+            if head >= 0 and bucket <= self.t[head]:
+                n = self.count[head] + 1
+                self.count[head] = n
+                self.mean[head] += (value - self.mean[head]) / n
+                self.min[head] = min(self.min[head], value)
+                self.max[head] = max(self.max[head], value)
+                return
+            t = bucket
+        head = (head + 1) % self.capacity
+        self.t[head] = t
+        self.min[head] = self.max[head] = self.mean[head] = value
+        self.count[head] = 1
+        self.head = head
+        self.size = min(self.size + 1, self.capacity)
+
+    def query(self, since=None):
+        """Rows in time order, with a bucket start (or sample time) after since"""
+        order = np.arange(self.head - self.size + 1, self.head + 1) % self.capacity
+        if since is not None:
+            order = order[self.t[order] > since]
+        if not self.period:
+            return {'t': self.t[order].tolist(), 'value': self.mean[order].tolist()}
+        return {
+            't': self.t[order].tolist(),
+            'min': self.min[order].tolist(),
+            'max': self.max[order].tolist(),
+            'mean': self.mean[order].tolist(),
+            'count': self.count[order].tolist(),
+        }
+
+
+class Series:
+    def __init__(self):
+        self.rings = {res: Ring(period, capacity) for res, (period, capacity) in RESOLUTIONS.items()}
+        self.lock = threading.Lock()
+
+    def add(self, t, value):
+        with self.lock:
+            for ring in self.rings.values():
+                ring.add(t, value)
+
+    def query(self, res, since=None):
+        with self.lock:
+            return self.rings[res].query(since)
+
+
+class TelemetryHistory:
+    def __init__(self):
+        # scope --> metric --> Series
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def record(self, scope, t=None, **values):
+        t = time.time() if t is None else t
+        metrics = self.series.get(scope)
+        if metrics is None:
+            with self.lock:
+                metrics = self.series.setdefault(scope, {})
+        for metric, value in values.items():
+            series = metrics.get(metric)
+            if series is None:
+                with self.lock:
+                    series = metrics.setdefault(metric, Series())
+            series.add(t, float(value))
+
+    def query(self, scope, res=DEFAULT_RESOLUTION, since=None, metrics=None):
+        if res not in RESOLUTIONS:
+            raise ValueError(f'Unknown resolution {res}, expected one of {", ".join(RESOLUTIONS)}')
+        series = dict(self.series.get(scope, {}))
+        if metrics:
+            series = {metric: s for metric, s in series.items() if metric in metrics}
+        return {
+            'scope': scope,
+            'res': res,
+            'period': RESOLUTIONS[res][0],
+            'series': {metric: s.query(res, since) for metric, s in sorted(series.items())},
+        }
+
+
+HISTORY = TelemetryHistory()
+
+
+def record(scope, t=None, **values):
+    HISTORY.record(scope, t, **values)
+
+
+def query(scope, res=DEFAULT_RESOLUTION, since=None, metrics=None):
+    return HISTORY.query(scope, res, since, metrics)
@@ -0,0 +1,196 @@
+"""
+Fixed-layout fleet telemetry table in shared memory.
+
+One row per vehicle slot, stored as a NumPy structured array inside multiprocessing.shared_memory, so that any
+local process can read the fleet state without serialization or IPC round trip. The zenoh callbacks of the owner
+process write the rows; each row carries a sequence number that is odd while the row is being written (seqlock),
+and readers retry until they copy a row whose sequence number is even and unchanged.
+
+Usage (reader in another process):
+    python -m zenoh_app.telemetry_table
+"""
+
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+DEFAULT_NAME = os.environ.get('FMS_TELEMETRY_TABLE', 'fms_telemetry')
+DEFAULT_SLOTS = 256
+READ_RETRIES = 100
+
+GEARS = ('NONE', 'NEUTRAL', 'DRIVE', 'REVERSE', 'PARKING', 'UNKNOWN')
+
+# Units: degrees for lat/lon/heading, m/s for velocity, rad for steer, % for cpu_total, UNIX seconds for timestamp,
+# m for arc (along the centerline of lanelet); lanelet is -1 and arc 0 when the vehicle is off the lanelets
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ('seq', '<u8'),
+        ('scope', 'S32'),
+        ('lat', '<f8'),
+        ('lon', '<f8'),
+        ('heading', '<f8'),
+        ('velocity', '<f8'),
+        ('steer', '<f8'),
+        ('cpu_total', '<f8'),
+        ('timestamp', '<f8'),
+        ('lanelet', '<i8'),
+        ('arc', '<f8'),
+        ('gear', '<u1'),
+    ],
+    align=True,
+)
+
+
+def _attach(name, create, size):
+    if create:
+        try:
+            shared_memory.SharedMemory(name=name).unlink()
+        except FileNotFoundError:
+            pass
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    shm = shared_memory.SharedMemory(name=name)
+    # Only the creator may unlink the segment when it exits
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class TelemetryTable:
+    def __init__(self, name=DEFAULT_NAME, slots=DEFAULT_SLOTS, create=False):
+        self.name = name
+        self.owner = create
+        if not create:
+            slots = None
+        self.shm = _attach(name, create, (slots or 0) * TELEMETRY_DTYPE.itemsize)
+        self.table = np.ndarray((self.shm.size // TELEMETRY_DTYPE.itemsize,), dtype=TELEMETRY_DTYPE, buffer=self.shm.buf)
+        if create:
+            self.table[:] = np.zeros(len(self.table), dtype=TELEMETRY_DTYPE)
+            self.table['lanelet'] = -1
+        self.slots = {}
+        # Writers of the owner process run on several zenoh callback threads
+        self.lock = threading.Lock()
+        self.row_locks = {}
+
+    def close(self):
+        del self.table
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def slot(self, scope):
+        """Row of a vehicle; the owner allocates a free row on first use"""
+        index = self.slots.get(scope)
+        if index is not None:
+            return index
+        key = scope.encode()[:32]
+        with self.lock:
+            matches = np.flatnonzero(self.table['scope'] == key)
+            if len(matches):
+                index = int(matches[0])
+                self.row_locks.setdefault(index, threading.Lock())
+            elif self.owner:
+                free = np.flatnonzero(self.table['scope'] == b'')
+                if not len(free):
+                    raise RuntimeError(f'Telemetry table {self.name} is full')
+                index = int(free[0])
+                self.table['scope'][index] = key
+                self.row_locks[index] = threading.Lock()
+            else:
+                return None
+            self.slots[scope] = index
+            return index
+
+    def update(self, scope, **fields):
+        index = self.slot(scope)
+        if 'gear' in fields:
+            gear = fields['gear']
+            fields['gear'] = GEARS.index(gear) if gear in GEARS else GEARS.index('UNKNOWN')
+        seq = self.table['seq']
+        with self.row_locks[index]:
+            seq[index] += 1
+            for field, value in fields.items():
+                self.table[field][index] = value
+            self.table['timestamp'][index] = time.time()
+            seq[index] += 1
+
+    def read(self, scope):
+        """Consistent copy of one vehicle's row as a dict, or None if the vehicle has no row"""
+        index = self.slot(scope)
+        if index is None:
+            return None
+        seq = self.table['seq']
+        for _ in range(READ_RETRIES):
+            before = int(seq[index])
+            if before & 1:
+                continue
+            row = self.table[index].copy()
+            if int(seq[index]) == before:
+                return self.to_dict(row)
+        raise RuntimeError(f'Row of {scope} is being rewritten too fast to read')
+
+    def read_all(self):
+        """Consistent copy of every used row, as a structured array"""
+        # One evaluation of the used rows, so that rows[i] is always a copy of row indices[i]
+        indices = np.flatnonzero(self.table['scope'] != b'')
+        rows = self.table[indices]
+        for _ in range(READ_RETRIES):
+            # Rows that were being written or changed while copying are copied again
+            dirty = (rows['seq'] & 1).astype(bool) | (self.table['seq'][indices] != rows['seq'])
+            if not dirty.any():
+                return rows
+            rows[dirty] = self.table[indices[dirty]]
+        raise RuntimeError('Telemetry table is being rewritten too fast to read')
+
+    @staticmethod
+    def to_dict(row):
+        return {
+            'scope': row['scope'].decode(),
+            'lat': float(row['lat']),
+            'lon': float(row['lon']),
+            'heading': float(row['heading']),
+            'velocity': float(row['velocity']),
+            'steer': float(row['steer']),
+            'gear': GEARS[row['gear']] if row['gear'] < len(GEARS) else 'UNKNOWN',
+            'cpu_total': float(row['cpu_total']),
+            'lanelet': int(row['lanelet']),
+            'arc': float(row['arc']),
+            'seq': int(row['seq']),
+            'timestamp': float(row['timestamp']),
+        }
+
+
+### The table written by the zenoh callbacks of this process, if it owns one
+_writer = None
+
+
+def create(name=DEFAULT_NAME, slots=DEFAULT_SLOTS):
+    global _writer
+    _writer = TelemetryTable(name, slots, create=True)
+    return _writer
+
+
+def close():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+def publish(scope, **fields):
+    """Write fields of a vehicle's row; a no-op when this process does not own a table"""
+    if _writer is not None:
+        _writer.update(scope, **fields)
+
+
+if __name__ == '__main__':
+    reader = TelemetryTable(DEFAULT_NAME)
+    while True:
+        for row in reader.read_all():
+            print(TelemetryTable.to_dict(row))
+        print()
+        time.sleep(1)
@@ -1,5 +1,9 @@
+import copy
+import itertools
+import logging
+import struct
 import time
-from threading import Event, Thread
+from threading import Event, Lock, Thread
 
 import zenoh
 from zenoh_ros_type.autoware_adapi_msgs import ChangeOperationModeResponse
@@ -7,6 +11,10 @@ from zenoh_ros_type.autoware_msgs import Control, Lateral, Longitudinal
 from zenoh_ros_type.rcl_interfaces import Time
 from zenoh_ros_type.tier4_autoware_msgs import GateMode, GearShift, GearShiftStamped, VehicleStatusStamped
 
+from . import qos, versions
+
+logger = logging.getLogger(__name__)
+
 GET_STATUS_KEY_EXPR = '/api/external/get/vehicle/status'
 SET_REMOTE_MODE_KEY_EXPR = '/api/operation_mode/change_to_remote'
 SET_GEAR_KEY_EXPR = '/api/external/set/command/remote/shift'
@@ -15,12 +23,90 @@ SET_GEAR_KEY_EXPR = '/api/external/set/command/remote/shift'
 SET_GATE_MODE_KEY_EXPR = '/control/gate_mode_cmd'
 SET_CONTROL_KEY_EXPR = '/external/selected/control_cmd'
 
+# Publish interval of a controller running its own thread (without a ControlScheduler)
+CONTROL_INTERVAL = 0.33
+
+# Tokens of the clients attached to a controller, unique across controllers
+CLIENT_TOKENS = itertools.count(1)
+
+
+# Size of the CDR encapsulation header in front of every serialized message
+CDR_HEADER_SIZE = 4
+
+
+class ControlSerializer:
+    """
+    Serialize autoware_control_msgs/Control by patching a preallocated buffer.
+
+    Between two ticks only the stamp, the steering angle, the velocity and the acceleration change, so the
+    template is serialized once and those fields are written in place at their fixed CDR offsets.
+    """
+
+    ### Offsets after the encapsulation header
+    ### stamp(0) control_time(8) lateral{stamp(16) control_time(24) steering_tire_angle(32) rate(36) defined(40)}
+    ### longitudinal{stamp(44) control_time(52) velocity(60) acceleration(64) jerk(68) defined(72, 73)}
+    STAMP_OFFSET = 0
+    STEERING_TIRE_ANGLE_OFFSET = 32
+    VELOCITY_OFFSET = 60
+
+    def __init__(self, template):
+        self.template = template
+        self.buffer = bytearray(template.serialize())
+        endian = '<' if self.buffer[1] == 1 else '>'
+        self.stamp_struct = struct.Struct(endian + 'iI')
+        self.steering_struct = struct.Struct(endian + 'f')
+        self.speed_struct = struct.Struct(endian + 'ff')
+        self.patching = self.verify()
+        if not self.patching:
+            logger.warning('Control layout mismatch, falling back to full serialization')
+
+    def _patch(self, buffer, sec, nanosec, steering_tire_angle, velocity, acceleration):
+        self.stamp_struct.pack_into(buffer, CDR_HEADER_SIZE + self.STAMP_OFFSET, sec, nanosec)
+        self.steering_struct.pack_into(buffer, CDR_HEADER_SIZE + self.STEERING_TIRE_ANGLE_OFFSET, steering_tire_angle)
+        self.speed_struct.pack_into(buffer, CDR_HEADER_SIZE + self.VELOCITY_OFFSET, velocity, acceleration)
+
+    def _serialize(self, control, sec, nanosec, steering_tire_angle, velocity, acceleration):
+        control.stamp.sec = sec
+        control.stamp.nanosec = nanosec
+        control.lateral.steering_tire_angle = steering_tire_angle
+        control.longitudinal.velocity = velocity
+        control.longitudinal.acceleration = acceleration
+        return control.serialize()
+
+    def verify(self):
+        """Round-trip a patched buffer through Control.deserialize and compare it with a full serialization"""
+        # Values exactly representable as float32
+        values = (123, 456789, 0.25, 3.5, -0.75)
+        try:
+            patched = bytearray(self.buffer)
+            self._patch(patched, *values)
+            expected = self._serialize(copy.deepcopy(self.template), *values)
+            data = Control.deserialize(bytes(patched))
+            decoded = (
+                data.stamp.sec,
+                data.stamp.nanosec,
+                data.lateral.steering_tire_angle,
+                data.longitudinal.velocity,
+                data.longitudinal.acceleration,
+            )
+            return bytes(patched) == bytes(expected) and decoded == values
+        except Exception as e:
+            logger.error(f'Failed to verify control layout: {e}')
+            return False
+
+    def pack(self, sec, nanosec, steering_tire_angle, velocity, acceleration):
+        if not self.patching:
+            return self._serialize(self.template, sec, nanosec, steering_tire_angle, velocity, acceleration)
+        self._patch(self.buffer, sec, nanosec, steering_tire_angle, velocity, acceleration)
+        return self.buffer
+
 
 class ManualController:
-    def __init__(self, session, scope, use_bridge_ros2dds=True):
+    def __init__(self, session, scope, use_bridge_ros2dds=True, scheduler=None):
         ### Information
         self.session = session
         self.scope = scope
+        self.scheduler = scheduler
 
         self.end_event = Event()
 
@@ -31,6 +117,14 @@ class ManualController:
         self.target_velocity = 0
         self.target_angle = 0
 
+        ### Deadman: zero the command when no input arrives within the timeout (None disables it)
+        self.deadman_timeout = None
+        self.deadman_tripped = False
+        self.last_input_time = time.monotonic()
+        ### Clients (teleop WebSockets) holding the deadman armed
+        self.clients = set()
+        self.clients_lock = Lock()
+
         self.topic_prefix = scope if use_bridge_ros2dds else scope + '/rt'
 
         def callback_status(sample):
@@ -39,15 +133,16 @@ class ManualController:
             gear_val = data.status.gear_shift.data
             self.current_gear = GearShift.DATA(gear_val).name
             self.current_steer = data.status.steering.data
+            versions.bump('teleop')
 
         ### Topics
         ###### Subscribers
         self.subscriber_status = self.session.declare_subscriber(self.topic_prefix + GET_STATUS_KEY_EXPR, callback_status)
 
         ###### Publishers
-        self.publisher_gate_mode = self.session.declare_publisher(self.topic_prefix + SET_GATE_MODE_KEY_EXPR)
-        self.publisher_gear = self.session.declare_publisher(self.topic_prefix + SET_GEAR_KEY_EXPR)
-        self.publisher_control = self.session.declare_publisher(self.topic_prefix + SET_CONTROL_KEY_EXPR)
+        self.publisher_gate_mode = qos.declare_publisher(self.session, self.topic_prefix + SET_GATE_MODE_KEY_EXPR, 'command')
+        self.publisher_gear = qos.declare_publisher(self.session, self.topic_prefix + SET_GEAR_KEY_EXPR, 'command')
+        self.publisher_control = qos.declare_publisher(self.session, self.topic_prefix + SET_CONTROL_KEY_EXPR, 'control')
 
         ### Control command
         self.control_command = Control(
@@ -69,6 +164,9 @@ class ManualController:
                 is_defined_jerk=False),
         )
 
+        self.control_serializer = ControlSerializer(self.control_command)
+        self.control_nanosec = 0
+
         ### Startup external control
         self.publisher_gate_mode.put(GateMode(data=GateMode.DATA['EXTERNAL'].value).serialize())
         
@@ -78,19 +176,28 @@ class ManualController:
         replies = self.session.get(self.topic_prefix + SET_REMOTE_MODE_KEY_EXPR)
         for reply in replies:
             try:
-                print(">> Received ('{}': {})".format(reply.ok.key_expr, ChangeOperationModeResponse.deserialize(reply.ok.payload.to_bytes())))
+                logger.info(f">> Received ('{reply.ok.key_expr}': {ChangeOperationModeResponse.deserialize(reply.ok.payload.to_bytes())})")
             except Exception as e:
-                print(f'Failed to handle response: {e}')
+                logger.error(f'Failed to handle response: {e}')
 
 
-        ### Create new thread to send control command
-        self.thread = Thread(target=self.pub_control)
-        self.thread.start()
+        ### Send control command from the shared scheduler, or from a dedicated thread
+        if self.scheduler is not None:
+            self.scheduler.register(self.scope, self)
+        else:
+            self.thread = Thread(target=self.pub_control)
+            self.thread.start()
 
     def stop_teleop(self):
         self.update_control_command(0, 0)
-        self.end_event.set()
-        self.thread.join()
+        if self.scheduler is not None:
+            # unregister waits for a tick in flight, so this one does not race with the scheduler
+            self.scheduler.unregister(self.scope)
+            # Make sure the zero command goes out even if the scheduler had no tick left for us
+            self.tick()
+        else:
+            self.end_event.set()
+            self.thread.join()
 
     def pub_gear(self, gear):
         gear_val = GearShift.DATA[gear.upper()].value
@@ -102,32 +209,78 @@ class ManualController:
         if angle is not None:
             self.target_angle = angle
 
+    def attach_client(self, deadman_timeout):
+        """Arm the deadman for one more client; returns the token to detach it with"""
+        token = next(CLIENT_TOKENS)
+        with self.clients_lock:
+            self.clients.add(token)
+            self.arm_deadman(deadman_timeout)
+        return token
+
+    def detach_client(self, token):
+        """
+        Forget a client. When it was the last one, disarm the deadman and zero the targets.
+        A reconnecting client attaches before its old connection is detected as closed, so the deadman stays armed.
+        """
+        with self.clients_lock:
+            if token not in self.clients:
+                return
+            self.clients.discard(token)
+            if not self.clients:
+                self.disarm_deadman()
+                self.update_control_command(0, 0)
+
+    def arm_deadman(self, timeout):
+        self.deadman_timeout = timeout
+        self.feed_deadman()
+
+    def disarm_deadman(self):
+        self.deadman_timeout = None
+        self._set_deadman_tripped(False)
+
+    def feed_deadman(self):
+        self.last_input_time = time.monotonic()
+        self._set_deadman_tripped(False)
+
+    def _set_deadman_tripped(self, tripped):
+        if self.deadman_tripped != tripped:
+            self.deadman_tripped = tripped
+            versions.bump('teleop')
+
+    def check_deadman(self):
+        if self.deadman_timeout is None or self.deadman_tripped:
+            return
+        if time.monotonic() - self.last_input_time > self.deadman_timeout:
+            logger.warning(f'Deadman timeout on {self.scope}, stopping the vehicle')
+            self._set_deadman_tripped(True)
+            self.update_control_command(0, 0)
+
+    def tick(self):
+        self.check_deadman()
+
+        ### Considering gear with velocity
+        if self.current_gear.upper() == 'REVERSE':
+            _real_target_speed = self.target_velocity * (-1)
+        else:
+            _real_target_speed = self.target_velocity
+
+        ### Calculate acceleration
+        acceleration = self.target_velocity - abs(self.current_velocity)
+        if acceleration > 1.0:
+            acceleration = 1.0
+        elif acceleration < -1.0:
+            acceleration = -1.0
+
+        ### Pub control (steering angle, velocity and acceleration)
+        self.control_nanosec = (self.control_nanosec + 1) & 0xFFFFFFFF
+        self.publisher_control.put(self.control_serializer.pack(0, self.control_nanosec, self.target_angle, self.target_velocity, acceleration))
+
     def pub_control(self):
         while not self.end_event.is_set():
-            ### Considering gear with velocity
-            if self.current_gear.upper() == 'REVERSE':
-                _real_target_speed = self.target_velocity * (-1)
-            else:
-                _real_target_speed = self.target_velocity
-
-            ### Calculate acceleration
-            acceleration = self.target_velocity - abs(self.current_velocity)
-            if acceleration > 1.0:
-                acceleration = 1.0
-            elif acceleration < -1.0:
-                acceleration = -1.0
-
-            ### Steering angle
-            self.control_command.lateral.steering_tire_angle = self.target_angle
-
-            ### Pub control
-            self.control_command.longitudinal.velocity = self.target_velocity
-            self.control_command.longitudinal.acceleration = acceleration
-            self.control_command.stamp.nanosec += 1
-            self.publisher_control.put(self.control_command.serialize())
+            self.tick()
 
             ### Set interval
-            time.sleep(0.33)
+            time.sleep(CONTROL_INTERVAL)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,24 @@
+"""
+Change counters of the fleet state.
+
+Writers bump the counter of what they changed (e.g. 'pose' from the kinematics callbacks, ('status', scope) from
+the status callbacks); readers compare counters to tell whether a cached view of the state is still current.
+"""
+
+import threading
+import uuid
+
+# Distinguishes the counters of this process from those of a previous run, which also start from 0
+BOOT_ID = uuid.uuid4().hex[:8]
+
+_lock = threading.Lock()
+_versions = {}
+
+
+def bump(key):
+    with _lock:
+        _versions[key] = _versions.get(key, 0) + 1
+
+
+def get(key):
+    return _versions.get(key, 0)